@@ -1,6 +1,5 @@
 # inspired by https://github.com/deepset-ai/haystack/blob/master/ui/webapp.py
 
-import time
 import streamlit as st
 import logging
 from json import JSONDecodeError
@@ -8,21 +7,26 @@ from markdown import markdown
 from annotated_text import annotation
 from urllib.parse import unquote
 import random
+import uuid
 
-from app_utils.backend_utils import load_questions, query
+from app_utils.backend_utils import load_questions, query, pipeline_ready
 from app_utils.frontend_utils import (set_state_if_absent, reset_results, 
     SIDEBAR_STYLE, TWIN_PEAKS_IMG_SRC, LAURA_PALMER_IMG_SRC, SPOTIFY_IFRAME)
-from app_utils.config import RETRIEVER_TOP_K, READER_TOP_K, LOW_RELEVANCE_THRESHOLD
+from app_utils.config import (RETRIEVER_TOP_K, READER_TOP_K, LOW_RELEVANCE_THRESHOLD,
+    CORPORA, DEFAULT_CORPUS)
+from app_utils.dedup import passage_sources
+from app_utils.query_executor import QueryRejected, QueryCancelled
 
 def main():
-    questions = load_questions()
-
     # Persistent state
     set_state_if_absent('question', "Where is Twin Peaks?")
     set_state_if_absent('answer', '')
     set_state_if_absent('results', None)
     set_state_if_absent('raw_json', None)
     set_state_if_absent('random_question_requested', False)
+    set_state_if_absent('corpus', DEFAULT_CORPUS)
+    # identifies the questions of this session in the query executor
+    set_state_if_absent('session_id', uuid.uuid4().hex)
 
     ## SIDEBAR
     st.markdown(SIDEBAR_STYLE, unsafe_allow_html=True)
@@ -37,8 +41,14 @@ def main():
         Twin Peaks Wiki</a>.</small>
         </p><img src="{LAURA_PALMER_IMG_SRC}"/><br/></div>
         """, unsafe_allow_html=True)
+    # other wikis, if configured (their indexes are loaded on first use)
+    if len(CORPORA) > 1:
+        st.sidebar.selectbox("Wiki", list(CORPORA), key='corpus', on_change=reset_results,
+                             format_func=lambda name: CORPORA[name].get('title', name))
     # spotify webplayer
     st.sidebar.markdown(SPOTIFY_IFRAME, unsafe_allow_html=True)
+    corpus = st.session_state.corpus
+    questions = load_questions(corpus)
 
     ## MAIN CONTAINER
     st.write("# Who killed Laura Palmer?")
@@ -60,8 +70,8 @@ def main():
         "<style>.stButton button {width:100%;}</style>", unsafe_allow_html=True)
     # Run button
     run_pressed = col1.button("Run")
-    # Random question button
-    if col2.button("Random question"):
+    # Random question button (if the corpus has selected questions)
+    if questions and col2.button("Random question"):
         reset_results()
         question = random.choice(questions)
         # Avoid picking the same question twice (the change is not visible on the UI)
@@ -80,16 +90,24 @@ def main():
 
     # Get results for query
     if run_query and question:
-        time_start = time.time()
         reset_results()
         st.session_state.question = question
-        with st.spinner("🧠 &nbsp;&nbsp; Performing neural search on documents..."):
+        spinner_text = "🧠 &nbsp;&nbsp; Performing neural search on documents..." if pipeline_ready() \
+            else "⏳ &nbsp;&nbsp; Loading the models (only at startup) and performing neural search..."
+        # updated while waiting: if the user changes the question, the rerun stops this script here
+        # and the computation is abandoned (unless other sessions are waiting for the same question)
+        heartbeat = st.empty()
+        with st.spinner(spinner_text):
             try:
+                # timings are traced by query() (structured logs and metrics)
                 st.session_state.results = query(
-                    question, RETRIEVER_TOP_K, READER_TOP_K)
-                time_end = time.time()
-                print(time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()))
-                print(f'elapsed time: {time_end - time_start}')
+                    question, RETRIEVER_TOP_K, READER_TOP_K, corpus,
+                    session_id=st.session_state.session_id, on_wait=heartbeat.empty)
+            except QueryRejected:
+                st.warning("🚦 &nbsp;&nbsp; Too many questions right now. Please try again in a few seconds.")
+                return
+            except QueryCancelled:
+                return
             except JSONDecodeError as je:
                 st.error(
                     "👓 &nbsp;&nbsp; An error occurred reading the results. Is the document store working?")
@@ -124,10 +142,9 @@ def main():
             st.write(markdown("- ..."+context[:start_idx] +
                     str(annotation(answer, "ANSWER", "#3e1c21", "white")) + 
                     context[end_idx:]+"..."), unsafe_allow_html=True)
-            source = ""
-            name = unquote(result['meta']['name']).replace('_', ' ')
-            url = result['meta']['url']
-            source = f"[{name}]({url})"
+            # near-duplicate passages are indexed once, with all their sources
+            source = ", ".join(f"[{unquote(page['name']).replace('_', ' ')}]({page['url']})"
+                               for page in passage_sources(result['meta']))
             st.markdown(
                 f"**Score:** {result['score']:.2f} -  **Source:** {source}")
 
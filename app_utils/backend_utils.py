@@ -1,56 +1,123 @@
-import shutil
-from haystack.document_stores import FAISSDocumentStore
-from haystack.nodes import EmbeddingRetriever
-from haystack.pipelines import ExtractiveQAPipeline
-from haystack.nodes import FARMReader
 import streamlit as st
 
-from app_utils.config import (INDEX_DIR, RETRIEVER_MODEL, RETRIEVER_MODEL_FORMAT,
-    READER_MODEL, READER_CONFIG_THRESHOLD, QUESTIONS_PATH)
+from app_utils.config import (ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL,
+    ANSWER_CACHE_SIMILARITY_THRESHOLD, QA_SERVICE_URL, METRICS_PORT, DEFAULT_CORPUS)
+from app_utils.corpora import CorpusManager, corpus_paths
+from app_utils.metrics import start_metrics_server, trace
+from app_utils.precomputed_answers import PrecomputedAnswers
+from app_utils.qa_client import QAClient
+from app_utils.query_executor import QueryExecutor
+from app_utils.semantic_cache import SemanticCache, normalize_question
+from app_utils.startup import PipelineLoader, pipeline_params, params_key
+from app_utils.questions import read_selected_questions
 
 # cached to make index and models load only at start
 @st.cache(hash_funcs={"builtins.SwigPyObject": lambda _: None},
           allow_output_mutation=True)
 def start_haystack():
     """
-    load document store, retriever, reader and create pipeline
+    load document store, retriever, reader and create pipeline of the default corpus
+    (in a background thread, if STARTUP_MODE is "fast"); the other corpora are loaded on first use
     """
-    shutil.copy(f'{INDEX_DIR}/faiss_document_store.db', '.')
-    document_store = FAISSDocumentStore(
-        faiss_index_path=f'{INDEX_DIR}/my_faiss_index.faiss',
-        faiss_config_path=f'{INDEX_DIR}/my_faiss_index.json')
-    print(f'Index size: {document_store.get_document_count()}')
-    
-    retriever = EmbeddingRetriever(
-        document_store=document_store,
-        embedding_model=RETRIEVER_MODEL,
-        model_format=RETRIEVER_MODEL_FORMAT
-    )
-    
-    reader = FARMReader(model_name_or_path=READER_MODEL,
-                        use_gpu=False,
-                        confidence_threshold=READER_CONFIG_THRESHOLD)
-    
-    pipe = ExtractiveQAPipeline(reader, retriever)
-    return pipe
-
-pipe = start_haystack()
-# the pipeline is not included as parameter of the following function,
-# because it is difficult to cache
-@st.cache(persist=True, allow_output_mutation=True)
-def query(question: str, retriever_top_k: int = 10, reader_top_k: int = 5):
-    """Run query and get answers"""
-    params = {"Retriever": {"top_k": retriever_top_k},
-              "Reader": {"top_k": reader_top_k}}
-    results = pipe.run(question, params=params)
-    return results      
+    return CorpusManager(PipelineLoader())
+
+# cached to start the metrics endpoint only once
+@st.cache(allow_output_mutation=True)
+def start_metrics():
+    """Serve Prometheus metrics on METRICS_PORT (if set)"""
+    return start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+
+start_metrics()
+
+# with the QA service, the pipeline (and the index) are not loaded by the web app
+if QA_SERVICE_URL:
+    qa_client = QAClient(QA_SERVICE_URL)
+else:
+    corpus_manager = start_haystack()
+
+def get_pipeline(timeout: float = None, corpus: str = DEFAULT_CORPUS):
+    """Pipeline of a corpus, waiting until it is loaded"""
+    return corpus_manager.get(corpus, timeout)
+
+def pipeline_ready() -> bool:
+    return bool(QA_SERVICE_URL) or corpus_manager.ready
+
+# cached to share the same answer cache (per corpus) among all sessions
+@st.cache(allow_output_mutation=True)
+def get_answer_cache(corpus: str = DEFAULT_CORPUS):
+    """Semantic cache of the answers, saved on disk"""
+    return SemanticCache(max_size=ANSWER_CACHE_SIZE,
+                         ttl=ANSWER_CACHE_TTL,
+                         similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+                         index_version=corpus_manager.index_version(corpus),
+                         path=corpus_paths(corpus)['answer_cache_path'])
+
+# cached to load the precomputed answers only once per corpus
+@st.cache(allow_output_mutation=True)
+def get_precomputed_answers(corpus: str = DEFAULT_CORPUS):
+    """Answers precomputed for the known questions (None if not available for the current index)"""
+    return PrecomputedAnswers.load(corpus_manager.index_version(corpus),
+                                   path=corpus_paths(corpus)['precomputed_answers_path'])
+
+# cached to share the worker pool (and the questions in flight) among all sessions
+@st.cache(allow_output_mutation=True)
+def get_query_executor():
+    """Bounded pool answering the questions, computing identical questions in flight only once"""
+    return QueryExecutor()
+
+def query(question: str, retriever_top_k: int = 10, reader_top_k: int = 5, corpus: str = DEFAULT_CORPUS,
+          session_id: str = None, on_wait=None):
+    """
+    Run query on a corpus and get answers (reusing the answers to similar past questions).
+    The pipeline runs in the query executor: a new question of a session abandons the previous ones,
+    on_wait is called while waiting and QueryRejected is raised if the executor is overloaded.
+    The request is traced (structured log and metrics).
+    """
+    with trace('query', question=question, retriever_top_k=retriever_top_k,
+               reader_top_k=reader_top_k, corpus=corpus) as request_trace:
+        if QA_SERVICE_URL:
+            if corpus != DEFAULT_CORPUS:
+                raise ValueError('The QA service serves only the default corpus')
+            # the service batches concurrent questions and has its own answer cache
+            request_trace.attributes['cache'] = 'service'
+            return qa_client.query(question, retriever_top_k, reader_top_k)
+        params = pipeline_params(retriever_top_k, reader_top_k)
+        answers_key = params_key(params)
+        if corpus != DEFAULT_CORPUS:
+            # other corpora are loaded on first use (the caches need their index version)
+            get_pipeline(corpus=corpus)
+        precomputed_answers = get_precomputed_answers(corpus)
+        if precomputed_answers is not None:
+            results = precomputed_answers.get(question, answers_key)
+            if results is not None:
+                request_trace.attributes['cache'] = 'precomputed'
+                return results
+        answer_cache = get_answer_cache(corpus)
+        answer_cache.check_index_version(corpus_manager.index_version(corpus))
+
+        pipe = get_pipeline(corpus=corpus)
+        question_emb = pipe.get_node("Retriever").embed_queries([question])[0]
+        results = answer_cache.lookup(question, question_emb, answers_key)
+        if results is not None:
+            request_trace.attributes['cache'] = 'semantic_cache'
+        else:
+            # only the pipeline runs in the executor (cache hits are not queued, nor rejected)
+            def compute(cancelled):
+                # checked by the PassageGate node, between retriever and reader
+                gate_params = {**params['PassageGate'], 'cancelled': cancelled}
+                results = pipe.run(question, params={**params, 'PassageGate': gate_params})
+                answer_cache.store(question, question_emb, results, answers_key)
+                return results
+
+            results, shared = get_query_executor().run(
+                (corpus, normalize_question(question), answers_key), compute,
+                session_id=session_id, on_wait=on_wait)
+            request_trace.attributes['cache'] = 'in_flight' if shared else 'miss'
+        request_trace.attributes['answers'] = len(results['answers'])
+        return results
 
 @st.cache()
-def load_questions():
-    """Load selected questions from file"""
-    with open(QUESTIONS_PATH) as fin:
-        questions = [line.strip() for line in fin.readlines()
-                     if not line.startswith('#')]
-    return questions
-
-              
\ No newline at end of file
+def load_questions(corpus: str = DEFAULT_CORPUS):
+    """Load selected questions of a corpus from file (no questions if the corpus has none)"""
+    questions_path = corpus_paths(corpus)['questions_path']
+    return read_selected_questions(questions_path) if questions_path else []
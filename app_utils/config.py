@@ -1,10 +1,129 @@
-
 INDEX_DIR = 'data/index'
+INPUT_DOCS_DIR = 'data/input_docs'
 QUESTIONS_PATH = 'data/questions/selected_questions.txt'
+# generated_questions.txt comes from the question generation notebook; the .jsonl file
+# (written by scripts/generate_questions.py) can be used as well
+GENERATED_QUESTIONS_PATH = 'data/questions/generated_questions.txt'
+GENERATED_QUESTIONS_JSONL_PATH = 'data/questions/generated_questions.jsonl'
+QUESTION_GENERATION_MODEL = "valhalla/t5-base-e2e-qg"
+# Named corpora (one per fandom wiki, crawled with "-a wiki=<name>"), served by the same web app.
+# Without explicit folders, a corpus lives in data/corpora/<name>/input_docs and data/corpora/<name>/index.
+# The default corpus is loaded at startup; the others are loaded on first use and, when their indexes
+# exceed CORPUS_MEMORY_BUDGET_MB, the least recently used ones are evicted. Models are shared.
+CORPORA = {
+    "twinpeaks": {"title": "Twin Peaks", "input_docs_dir": INPUT_DOCS_DIR, "index_dir": INDEX_DIR,
+                  "questions_path": QUESTIONS_PATH},
+}
+DEFAULT_CORPUS = "twinpeaks"
+CORPORA_DIR = 'data/corpora'
+CORPUS_MEMORY_BUDGET_MB = 4096
 RETRIEVER_MODEL = "sentence-transformers/multi-qa-mpnet-base-dot-v1"
 RETRIEVER_MODEL_FORMAT = "sentence_transformers"
 READER_MODEL = "deepset/roberta-base-squad2"
 READER_CONFIG_THRESHOLD = 0.15
+# Reader backend: "pytorch" or "onnx" (quantized model exported with scripts/export_onnx_reader.py)
+READER_BACKEND = "pytorch"
+ONNX_READER_DIR = 'data/onnx_reader'
+ONNX_NUM_THREADS = None  # ONNX Runtime threads (None: all the CPU cores)
+# Serve the reader tokenization of the passages from data/index/reader_tokens.npz
+# (created at index time): only the question is tokenized at query time
+READER_TOKEN_CACHE = True
+# Startup of the web app:
+# "eager": the document store database is copied in the working directory, the FAISS index
+#   is read in RAM and the models are loaded before the first page is rendered;
+# "fast": the index is opened in place (FAISS index memory-mapped: IVF inverted lists with any FAISS
+#   version, flat/HNSW vectors only with FAISS >= 1.8, otherwise read in RAM; passages read from the
+#   memory-mapped passage store, or from the database opened read-only if the store is missing)
+#   and the pipeline is loaded in a background thread while the UI renders.
+STARTUP_MODE = "eager"
+# query run once after loading, before the pipeline is reported ready (None: no warmup)
+WARMUP_QUERY = "Who killed Laura Palmer?"
+# file created when the pipeline is ready (e.g. for a readiness probe; None: not created)
+READY_FILE = None
+# QA service (scripts/qa_service.py): if set, the web app sends the questions to this URL
+# instead of loading the pipeline (e.g. "http://localhost:8001")
+QA_SERVICE_URL = None
+QA_SERVICE_TIMEOUT = 60  # seconds
+# micro-batching: concurrent questions collected within the window are answered together
+QA_SERVICE_MAX_BATCH_SIZE = 16
+QA_SERVICE_MAX_WAIT_MS = 20
+# Questions of the web app sessions (without QA service) not found in the answer caches are answered
+# by a pool of QUERY_WORKERS threads;
+# identical questions in flight are computed once. With all the workers busy and QUERY_MAX_QUEUED
+# questions waiting, new questions are rejected immediately.
+QUERY_WORKERS = 2
+QUERY_MAX_QUEUED = 16
 RETRIEVER_TOP_K = 10
 READER_TOP_K = 5
-LOW_RELEVANCE_THRESHOLD = 0.5
\ No newline at end of file
+LOW_RELEVANCE_THRESHOLD = 0.5
+# Adaptive reader depth: passed as params of the PassageGate node (see passage_gate.py).
+# Thresholds refer to the raw dot product similarity between question and passages.
+# Tune them with scripts/evaluate_passage_gate.py before enabling.
+PASSAGE_GATE_PARAMS = {
+    "enabled": False,
+    "min_similarity": None,  # skip the reader if no passage reaches this similarity
+    "score_gap": None,  # stop after a similarity drop larger than this value
+    "score_mass": 0.99,  # stop when the softmax probability mass of the passages reaches this value
+}
+# Hybrid retrieval: dense (FAISS) and sparse (BM25, data/index/bm25.npz) results fused with
+# reciprocal rank fusion. Both retrievers return "candidates" passages; the best RETRIEVER_TOP_K
+# fused passages reach the reader. Measure with scripts/benchmark_hybrid.py before enabling.
+HYBRID_RETRIEVAL_PARAMS = {
+    "enabled": False,
+    "candidates": 20,
+    "rrf_k": 60,
+}
+
+# Indexing: document store settings compatible with Embedding Retriever
+# and preprocessing of the wiki pages in chunks of 200 words
+SIMILARITY = "dot_product"
+EMBEDDING_DIM = 768
+PREPROCESSOR_PARAMS = {
+    "clean_empty_lines": True,
+    "clean_whitespace": True,
+    "clean_header_footer": True,
+    "split_by": "word",
+    "split_length": 200,
+    "split_respect_sentence_boundary": True,
+    "split_overlap": 0,
+    "language": "en",
+}
+# processes splitting the pages in chunks when building the index (None: one per CPU core)
+CHUNKING_WORKERS = None
+# Near-duplicate chunks (MinHash/LSH): the chunks whose estimated Jaccard similarity of word shingles
+# with a longer chunk is >= threshold are not indexed; the longer chunk gets the sources of its group.
+# Measure with scripts/evaluate_dedup.py before enabling (then rebuild the index).
+DEDUP_PARAMS = {
+    "enabled": False,
+    "threshold": 0.8,
+    "num_perm": 128,  # MinHash permutations
+    "bands": 16,  # LSH bands (num_perm / bands rows per band)
+    "shingle_size": 5,  # words per shingle
+}
+
+# FAISS index type, chosen with the index factory syntax
+# (https://github.com/facebookresearch/faiss/wiki/The-index-factory):
+# "Flat" (exact search), "HNSW32", "IVF64,Flat", "IVF64,PQ64"...
+# It is used when building the index; changing it does not require re-embedding.
+FAISS_INDEX_FACTORY = "Flat"
+# Search-time parameters of approximate indexes, applied when loading the index
+FAISS_NPROBE = 8  # IVF: number of inverted lists visited per query
+FAISS_EF_SEARCH = 64  # HNSW: size of the candidate list during search
+
+# Answers precomputed by scripts/precompute_answers.py for the known questions
+# (used only if computed with the current index and the same query parameters)
+PRECOMPUTED_ANSWERS_PATH = f'{INDEX_DIR}/precomputed_answers.json.gz'
+
+# Tracing and metrics: one JSON line per question (None: standard output)
+# and Prometheus metrics served on http://127.0.0.1:METRICS_PORT/metrics (None: not served)
+TRACES_LOG_PATH = None
+METRICS_PORT = None
+
+# Semantic answer cache: the answers to a past question are reused
+# for new questions whose embeddings are similar enough
+ANSWER_CACHE_SIZE = 1000
+ANSWER_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+# cosine similarity between question embeddings:
+# lower values increase the hit rate, at the risk of answering a different question
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+ANSWER_CACHE_PATH = 'answer_cache.pkl'
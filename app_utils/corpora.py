@@ -0,0 +1,145 @@
+"""
+Named corpora (one per fandom wiki) served by the same web app.
+
+The default corpus is loaded at startup by PipelineLoader. The other corpora are loaded on
+first use: their FAISS index, document store and BM25 index are opened, while the models
+(retriever query encoder and reader) are shared with the default pipeline.
+When the indexes of the loaded corpora exceed the memory budget, the least recently used
+corpora are evicted (the default one is always kept).
+"""
+
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app_utils.config import (CORPORA, DEFAULT_CORPUS, CORPORA_DIR, CORPUS_MEMORY_BUDGET_MB,
+    HYBRID_RETRIEVAL_PARAMS, ANSWER_CACHE_PATH, PRECOMPUTED_ANSWERS_PATH)
+from app_utils.indexing import (DOCUMENT_STORE_DB, FAISS_INDEX_FILE, open_document_store,
+    index_version)
+from app_utils.metrics import instrument_pipeline, strip_instrumentation
+from app_utils.passage_gate import PassageGate, GatedExtractiveQAPipeline
+from app_utils.passage_store import PASSAGE_STORE_FILE
+from app_utils.sparse_index import SPARSE_INDEX_FILE, load_sparse_index
+
+logger = logging.getLogger(__name__)
+
+# files held in memory (or in the page cache) by a loaded corpus
+INDEX_MEMORY_FILES = (FAISS_INDEX_FILE, PASSAGE_STORE_FILE, SPARSE_INDEX_FILE)
+
+
+def corpus_paths(name: str) -> dict:
+    """Folders and files of a corpus (configured in CORPORA, or default layout in CORPORA_DIR)"""
+    corpus = CORPORA.get(name, {})
+    index_dir = corpus.get('index_dir', f'{CORPORA_DIR}/{name}/index')
+    default = name == DEFAULT_CORPUS
+    return {'input_docs_dir': corpus.get('input_docs_dir', f'{CORPORA_DIR}/{name}/input_docs'),
+            'index_dir': index_dir,
+            'questions_path': corpus.get('questions_path'),
+            'precomputed_answers_path': PRECOMPUTED_ANSWERS_PATH if default
+            else f'{index_dir}/{os.path.basename(PRECOMPUTED_ANSWERS_PATH)}',
+            'answer_cache_path': ANSWER_CACHE_PATH if default or not ANSWER_CACHE_PATH
+            else f'{os.path.splitext(ANSWER_CACHE_PATH)[0]}_{name}.pkl'}
+
+
+def index_memory_mb(index_dir: str) -> float:
+    """Estimated memory of a loaded index: FAISS index and passages (or SQL database, if no passage store)"""
+    files = list(INDEX_MEMORY_FILES)
+    if not os.path.exists(f'{index_dir}/{PASSAGE_STORE_FILE}'):
+        files.append(DOCUMENT_STORE_DB)
+    return sum(os.path.getsize(f'{index_dir}/{file_name}') for file_name in files
+               if os.path.exists(f'{index_dir}/{file_name}')) / 2 ** 20
+
+
+class CorpusManager:
+    """Pipelines of the corpora, loaded lazily and evicted (LRU) under a memory budget"""
+
+    def __init__(self, pipeline_loader, default: str = DEFAULT_CORPUS,
+                 memory_budget_mb: float = CORPUS_MEMORY_BUDGET_MB):
+        self.pipeline_loader = pipeline_loader
+        self.default = default
+        self.memory_budget_mb = memory_budget_mb
+        default_index_dir = corpus_paths(default)['index_dir']
+        self.default_memory_mb = index_memory_mb(default_index_dir)
+        self.index_versions = {default: index_version(default_index_dir)}
+        # name -> (pipeline, estimated memory in MB), least recently used first
+        self._loaded = OrderedDict()
+        # name -> event set when the corpus being loaded is ready (or its loading failed)
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.pipeline_loader.ready
+
+    def loaded(self):
+        return [self.default] + list(self._loaded)
+
+    def get(self, name: str = None, timeout: float = None):
+        """
+        Pipeline of a corpus, loading it if needed (the default pipeline is waited for).
+        A corpus is loaded outside the lock, so the queries on the loaded corpora are not blocked;
+        concurrent requests for a corpus being loaded wait for the same loading.
+        """
+        name = name or self.default
+        if name != self.default and name not in CORPORA:
+            raise ValueError(f'Unknown corpus: {name}. Add it to CORPORA in app_utils/config.py.')
+        base_pipeline = self.pipeline_loader.get(timeout)
+        if name == self.default:
+            return base_pipeline
+        while True:
+            with self._lock:
+                if name in self._loaded:
+                    self._loaded.move_to_end(name)
+                    return self._loaded[name][0]
+                loading = self._loading.get(name)
+                if loading is None:
+                    loading = self._loading[name] = threading.Event()
+                    break
+            # loaded by another thread: check again (if its loading failed, this thread tries)
+            if not loading.wait(timeout):
+                raise TimeoutError(f'Corpus {name} is still loading')
+        try:
+            index_dir = corpus_paths(name)['index_dir']
+            start = time.perf_counter()
+            pipeline = self._load(index_dir, base_pipeline)
+            version, memory_mb = index_version(index_dir), index_memory_mb(index_dir)
+            with self._lock:
+                self.index_versions[name] = version
+                self._loaded[name] = (pipeline, memory_mb)
+                self._evict(keep=name)
+            logger.info(f'Corpus {name} loaded in {time.perf_counter() - start:.1f} s')
+            return pipeline
+        finally:
+            with self._lock:
+                del self._loading[name]
+            loading.set()
+
+    def _load(self, index_dir: str, base_pipeline):
+        document_store = open_document_store(index_dir, read_only=True)
+        # shallow copy: the query encoder (and the embeddings memo) are shared
+        retriever = strip_instrumentation(copy.copy(base_pipeline.get_node('Retriever')))
+        retriever.document_store = document_store
+        retriever.set_sparse_index(load_sparse_index(index_dir) if HYBRID_RETRIEVAL_PARAMS['enabled'] else None,
+                                   **HYBRID_RETRIEVAL_PARAMS)
+        gate = PassageGate(similarity=document_store.similarity)
+        pipeline = GatedExtractiveQAPipeline(base_pipeline.get_node('Reader'), retriever, gate)
+        return instrument_pipeline(pipeline)
+
+    def _evict(self, keep: str):
+        """Evict least recently used corpora until the loaded indexes fit the budget"""
+        def used_mb():
+            return self.default_memory_mb + sum(memory_mb for _, memory_mb in self._loaded.values())
+
+        # down to the default corpus and the requested one, even if they exceed the budget
+        while used_mb() > self.memory_budget_mb and any(name != keep for name in self._loaded):
+            name = next(name for name in self._loaded if name != keep)
+            _, memory_mb = self._loaded.pop(name)
+            # the index is freed (garbage collected) when the queries still running on it are finished
+            logger.info(f'Corpus {name} evicted ({memory_mb:.0f} MB)')
+
+    def index_version(self, name: str = None) -> str:
+        """Version of the index loaded for a corpus"""
+        return self.index_versions[name or self.default]
@@ -0,0 +1,76 @@
+"""
+Streaming reader of the corpus downloaded by the crawler.
+
+Two layouts are supported:
+- sharded corpus written by the crawler pipeline: gzip-compressed JSONL shards
+  (corpus-00000.jsonl.gz, ...) and an offset index (corpus_index.json);
+- one JSON file per page (the original crawler output).
+
+Pages are yielded one at a time as Haystack-like dicts, so the corpus is never fully loaded in memory.
+"""
+
+import glob
+import gzip
+import json
+import os
+from typing import Iterator
+
+from app_utils.config import INPUT_DOCS_DIR
+
+CORPUS_INDEX_FILE = 'corpus_index.json'
+
+
+def _to_document(record: dict) -> dict:
+    return {'content': record['text'],
+            'meta': {'name': record['name'],
+                     'url': record['url']}}
+
+
+def load_corpus_index(input_dir: str = INPUT_DOCS_DIR):
+    """Load the offset index of a sharded corpus, if present"""
+    index_path = f'{input_dir}/{CORPUS_INDEX_FILE}'
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+def iter_documents(input_dir: str = INPUT_DOCS_DIR) -> Iterator[dict]:
+    """
+    Yield the live pages of the corpus.
+    In a sharded corpus, shards are append-only (until the crawler compacts them): a record is yielded only
+    if it is the version of the page referenced by the offset index (older versions and deletions are skipped).
+    """
+    corpus_index = load_corpus_index(input_dir)
+    if corpus_index is None:
+        for json_file in sorted(glob.glob(f'{input_dir}/*.json')):
+            with open(json_file, 'r', encoding='utf-8') as fin:
+                yield _to_document(json.load(fin))
+        return
+
+    live_pages = corpus_index['pages']
+    seen = set()
+    for shard in corpus_index['shards']:
+        # gzip transparently reads the concatenated members of a shard
+        with gzip.open(f'{input_dir}/{shard}', 'rt', encoding='utf-8') as fin:
+            for line in fin:
+                record = json.loads(line)
+                entry = live_pages.get(record['name'])
+                if record.get('deleted') or entry is None or record['name'] in seen \
+                        or entry['revid'] != record['revid'] or entry['shard'] != shard:
+                    continue
+                seen.add(record['name'])
+                yield _to_document(record)
+
+
+def read_document(name: str, input_dir: str = INPUT_DOCS_DIR, corpus_index: dict = None):
+    """Random access to a single page of a sharded corpus, through the offset index (None if missing)"""
+    corpus_index = corpus_index or load_corpus_index(input_dir)
+    entry = corpus_index['pages'].get(name) if corpus_index else None
+    if entry is None:
+        return None
+    with open(f"{input_dir}/{entry['shard']}", 'rb') as fin:
+        fin.seek(entry['offset'])
+        member = gzip.decompress(fin.read(entry['length']))
+    line = member.decode('utf-8').split('\n')[entry['line']]
+    return _to_document(json.loads(line))
@@ -0,0 +1,123 @@
+"""
+Near-duplicate detection of chunks with MinHash and locality-sensitive hashing (LSH).
+
+Fandom pages overlap heavily (episode summaries repeat character bios, pages quote each other),
+so many chunks are near-identical. Every chunk gets a MinHash signature of its word shingles;
+chunks sharing an LSH band are compared, and the ones whose estimated Jaccard similarity reaches
+the threshold are near-duplicates. Groups are formed around the chunk that is kept (the longest):
+every chunk of a group is a near-duplicate of the kept one (similarity is not chained through
+other chunks). Only the kept chunk is indexed: it keeps the names/urls of all the pages of the group
+in the "sources" metadata field.
+"""
+
+import json
+import re
+import zlib
+from typing import Dict, List
+
+import numpy as np
+from haystack import Document
+
+from app_utils.config import DEDUP_PARAMS
+
+# smallest prime above the 32-bit shingle hashes, for the hash family h(x) = (a * x + b) mod P
+_PRIME = np.uint64(4294967311)
+
+
+def shingles(text: str, size: int = 5) -> np.ndarray:
+    """32-bit hashes of the word n-grams of a text"""
+    words = re.findall(r'\w+', text.lower())
+    grams = [' '.join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))]
+    return np.array(sorted({zlib.crc32(gram.encode('utf-8')) for gram in grams}), dtype=np.uint64)
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        # a * x < 2^64 for 32-bit shingle hashes: the products are exact and wrap around P many times
+        # (with a * x < P, h would be almost monotonic and the similarities overestimated)
+        self.a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingle_hashes: np.ndarray) -> np.ndarray:
+        return ((self.a[:, None] * shingle_hashes[None, :] % _PRIME + self.b[:, None]) % _PRIME).min(axis=1)
+
+
+def _keep_order(doc: Document):
+    # the longest document of a group is kept
+    return -len(doc.content), doc.meta['name'], doc.id
+
+
+def find_near_duplicates(documents: List[Document], threshold: float = DEDUP_PARAMS['threshold'],
+                         num_perm: int = DEDUP_PARAMS['num_perm'], bands: int = DEDUP_PARAMS['bands'],
+                         shingle_size: int = DEDUP_PARAMS['shingle_size']) -> List[List[int]]:
+    """
+    Groups of near-duplicate documents (lists of positions, with at least two documents):
+    the first document of a group is the one to keep, and all the others are near-duplicates of it
+    """
+    if num_perm % bands:
+        raise ValueError(f'num_perm ({num_perm}) must be a multiple of bands ({bands})')
+    hasher = MinHasher(num_perm)
+    signatures = np.vstack([hasher.signature(shingles(doc.content, shingle_size)) for doc in documents]) \
+        if documents else np.zeros((0, num_perm), dtype=np.uint64)
+    rows = num_perm // bands
+
+    # near-duplicates of every document, among the candidates sharing an LSH band
+    similar = [set() for _ in documents]
+    compared = set()
+    for band in range(bands):
+        buckets = {}
+        for i, band_signature in enumerate(signatures[:, band * rows:(band + 1) * rows]):
+            buckets.setdefault(band_signature.tobytes(), []).append(i)
+        for bucket in buckets.values():
+            for position, j in enumerate(bucket[1:], start=1):
+                for i in bucket[:position]:
+                    if (i, j) in compared:
+                        continue
+                    compared.add((i, j))
+                    if np.mean(signatures[i] == signatures[j]) >= threshold:
+                        similar[i].add(j)
+                        similar[j].add(i)
+
+    # documents in keep order: a document not yet grouped is kept, with its near-duplicates not yet grouped
+    # (they come later in keep order, otherwise they would have been kept with their own group)
+    keep_order = sorted(range(len(documents)), key=lambda i: _keep_order(documents[i]))
+    rank = {i: r for r, i in enumerate(keep_order)}
+    grouped = set()
+    groups = []
+    for i in keep_order:
+        if i in grouped:
+            continue
+        duplicates = sorted(similar[i] - grouped, key=rank.get)
+        if duplicates:
+            groups.append([i] + duplicates)
+            grouped.update(groups[-1])
+    return groups
+
+
+def passage_sources(meta: dict) -> List[Dict[str, str]]:
+    """Pages (name and url) containing a passage"""
+    if 'sources' in meta:
+        # JSON string: list metadata values are not supported by the SQL document store
+        return json.loads(meta['sources'])
+    return [{'name': meta['name'], 'url': meta.get('url')}]
+
+
+def deduplicate(documents: List[Document], **dedup_params):
+    """
+    Collapse near-duplicate documents: the longest document of every group is kept
+    and gets the sources of the whole group.
+    Return the kept documents (in the original order) and the number of removed ones.
+    """
+    for doc in documents:
+        doc.meta.pop('sources', None)
+    removed = set()
+    for group in find_near_duplicates(documents, **dedup_params):
+        sources = []
+        for i in group:
+            source = {'name': documents[i].meta['name'], 'url': documents[i].meta.get('url')}
+            if source not in sources:
+                sources.append(source)
+        documents[group[0]].meta['sources'] = json.dumps(sources)
+        removed.update(group[1:])
+    return [doc for i, doc in enumerate(documents) if i not in removed], len(removed)
@@ -0,0 +1,413 @@
+"""
+Incremental indexing of the wiki pages.
+
+A manifest stored next to the index keeps a content hash for every source page
+and the IDs of its chunks (chunk IDs are content hashes too).
+When the index is rebuilt, only new or modified chunks are embedded:
+the embeddings of unchanged chunks are reused and the chunks of deleted pages are dropped.
+Optionally, near-duplicate chunks are collapsed before embedding (see dedup.py).
+The BM25 index used for hybrid retrieval, the memory-mapped passage store
+and the reader tokenization of the passages are rebuilt from the same chunks.
+The resulting FAISS document store has the same layout as the one
+created in the indexing notebook, so it can be loaded by the web app.
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+from haystack.document_stores import FAISSDocumentStore
+from haystack.nodes import EmbeddingRetriever, PreProcessor
+
+from app_utils.corpus import iter_documents
+from app_utils.dedup import deduplicate
+from app_utils.passage_store import (PASSAGE_STORE_FILE, MmapFAISSDocumentStore, PassageStore,
+    write_passage_store)
+from app_utils.reader_tokens import READER_TOKENS_FILE, build_reader_tokens
+from app_utils.sparse_index import SPARSE_INDEX_FILE, build_sparse_index
+from app_utils.config import (INDEX_DIR, INPUT_DOCS_DIR, RETRIEVER_MODEL,
+    RETRIEVER_MODEL_FORMAT, SIMILARITY, EMBEDDING_DIM, PREPROCESSOR_PARAMS,
+    FAISS_INDEX_FACTORY, FAISS_NPROBE, FAISS_EF_SEARCH, DEDUP_PARAMS, CHUNKING_WORKERS)
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_STORE_DB = 'faiss_document_store.db'
+FAISS_INDEX_FILE = 'my_faiss_index.faiss'
+FAISS_CONFIG_FILE = 'my_faiss_index.json'
+EMBEDDINGS_FILE = 'embeddings.npz'
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def page_hash(page: dict) -> str:
+    """Content hash of a wiki page (text and metadata)"""
+    serialized = json.dumps([page['content'], page['meta']], sort_keys=True)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def chunk_id(name: str, content: str, occurrence: int = 0) -> str:
+    """
+    Content hash of a chunk.
+    The page name is included, so that the same text in different pages
+    produces different documents (with different metadata).
+    """
+    key = f'{name}\n{content}' if occurrence == 0 else f'{name}\n{occurrence}\n{content}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def index_settings(preprocessor_params: dict = PREPROCESSOR_PARAMS) -> dict:
+    """Settings that affect chunks and embeddings: if they change, a full rebuild is needed"""
+    return {'preprocessor': preprocessor_params,
+            'retriever_model': RETRIEVER_MODEL,
+            'similarity': SIMILARITY,
+            'embedding_dim': EMBEDDING_DIM}
+
+
+def load_manifest(index_dir: str = INDEX_DIR):
+    """Load the index manifest, if present"""
+    manifest_path = f'{index_dir}/{MANIFEST_FILE}'
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+# (index file path, size, mtime) -> content hash of the index files
+_content_versions = {}
+
+
+def index_version(index_dir: str = INDEX_DIR) -> str:
+    """Identifier of the index build: changes every time the index is rebuilt"""
+    manifest = load_manifest(index_dir)
+    if manifest and 'build_id' in manifest:
+        return manifest['build_id']
+    # index not built by build_index (e.g. created in the notebook, or shipped with the repository):
+    # content hash of the FAISS index and config, the same on every checkout and replica
+    index_path = f'{index_dir}/{FAISS_INDEX_FILE}'
+    stat = os.stat(index_path)
+    key = (os.path.abspath(index_path), stat.st_size, stat.st_mtime)
+    if key not in _content_versions:
+        sha1 = hashlib.sha1()
+        for file_name in (FAISS_INDEX_FILE, FAISS_CONFIG_FILE):
+            with open(f'{index_dir}/{file_name}', 'rb') as fin:
+                for block in iter(lambda: fin.read(2 ** 20), b''):
+                    sha1.update(block)
+        _content_versions[key] = f'sha1-{sha1.hexdigest()[:16]}'
+    return _content_versions[key]
+
+
+def preprocess_pages(pages, processor: PreProcessor = None):
+    """
+    Split pages in chunks, assigning content-hash IDs.
+    Return a dict: page name -> list of chunks (Documents)
+    """
+    processor = processor or PreProcessor(progress_bar=False, **PREPROCESSOR_PARAMS)
+    chunks_by_page = {}
+    for page in pages:
+        name = page['meta']['name']
+        chunks = processor.process([page])
+        seen = Counter()
+        for chunk in chunks:
+            chunk.id = chunk_id(name, chunk.content, seen[chunk.content])
+            seen[chunk.content] += 1
+        chunks_by_page[name] = chunks
+    return chunks_by_page
+
+
+# PreProcessor of a chunking worker process
+_worker_processor = None
+
+
+def _init_chunking_worker(preprocessor_params: dict):
+    global _worker_processor
+    _worker_processor = PreProcessor(progress_bar=False, **preprocessor_params)
+
+
+def _chunk_page(page):
+    return preprocess_pages([page], _worker_processor)
+
+
+def chunk_pages(pages, workers: int = CHUNKING_WORKERS, preprocessor_params: dict = PREPROCESSOR_PARAMS):
+    """
+    Split a stream of pages in chunks with a pool of worker processes
+    (workers=None: one per CPU core; workers=1: in this process).
+    Pages are consumed in windows, so that only a few of them are in memory;
+    yield (page name, chunks) pairs, in completion order.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        processor = PreProcessor(progress_bar=False, **preprocessor_params)
+        for page in pages:
+            yield from preprocess_pages([page], processor).items()
+        return
+    pages = iter(pages)
+    with multiprocessing.Pool(workers, initializer=_init_chunking_worker,
+                              initargs=(preprocessor_params,)) as pool:
+        while True:
+            window = list(itertools.islice(pages, workers * 16))
+            if not window:
+                break
+            for chunks_by_page in pool.imap_unordered(_chunk_page, window, chunksize=4):
+                yield from chunks_by_page.items()
+
+
+def document_store_config(faiss_index_factory: str = FAISS_INDEX_FACTORY) -> dict:
+    """Config saved next to the FAISS index (the same as the indexing notebook for a flat index)"""
+    config = {'similarity': SIMILARITY, 'embedding_dim': EMBEDDING_DIM}
+    if faiss_index_factory != 'Flat':
+        config['faiss_index_factory_str'] = faiss_index_factory
+    return config
+
+
+def configure_faiss_search(faiss_index, nprobe: int = FAISS_NPROBE,
+                           ef_search: int = FAISS_EF_SEARCH):
+    """Set the search-time parameters of approximate (IVF/HNSW) indexes; no-op for flat indexes"""
+    import faiss
+
+    index = faiss.downcast_index(faiss_index)
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        # not an IVF index
+        pass
+    if hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = ef_search
+
+
+def _is_ivf_index_file(index_path: str) -> bool:
+    """Whether a FAISS index file contains an IVF index (from its four-character type code)"""
+    with open(index_path, 'rb') as fin:
+        fourcc = fin.read(4)
+    return fourcc[:2] in (b'Iw', b'Iv')
+
+
+def read_faiss_index(index_path: str, mmap: bool = False):
+    """
+    Read a FAISS index. With mmap, the index data is memory-mapped read-only:
+    pages are loaded lazily by the OS and shared among processes.
+    The inverted lists of IVF indexes are memory-mapped by every FAISS version; the vectors of flat
+    (and HNSW) indexes only with IO_FLAG_MMAP_IFC (FAISS >= 1.8), otherwise they are read in RAM.
+    """
+    import faiss
+
+    if mmap:
+        flags = getattr(faiss, 'IO_FLAG_READ_ONLY', 0)
+        if _is_ivf_index_file(index_path):
+            flags |= faiss.IO_FLAG_MMAP
+        elif hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+            flags |= faiss.IO_FLAG_MMAP_IFC
+        else:
+            logger.info(f'This FAISS version memory-maps only IVF indexes: {index_path} is read in RAM')
+            return faiss.read_index(index_path)
+        try:
+            return faiss.read_index(index_path, flags)
+        except RuntimeError as e:
+            logger.warning(f'Cannot memory-map {index_path}, reading it in RAM: {e}')
+    return faiss.read_index(index_path)
+
+
+def open_document_store(index_dir: str = INDEX_DIR, read_only: bool = False) -> FAISSDocumentStore:
+    """
+    Open the FAISS document store saved in index_dir, using the SQL database in place.
+    With read_only, the FAISS index is memory-mapped (see read_faiss_index), and the passages are read from the
+    memory-mapped passage store (if present) or from the SQL database opened read-only
+    (the app never writes to the document store).
+    """
+    with open(f'{index_dir}/{FAISS_CONFIG_FILE}', 'r') as fin:
+        config = json.load(fin)
+    # configs saved by Haystack also contain the SQL url
+    config.pop('sql_url', None)
+    faiss_index = read_faiss_index(f'{index_dir}/{FAISS_INDEX_FILE}', mmap=read_only)
+    configure_faiss_search(faiss_index)
+    if read_only and os.path.exists(f'{index_dir}/{PASSAGE_STORE_FILE}'):
+        return MmapFAISSDocumentStore(
+            passage_store=PassageStore(f'{index_dir}/{PASSAGE_STORE_FILE}'),
+            faiss_index=faiss_index,
+            progress_bar=False,
+            **config)
+    sql_url = f'sqlite:///file:{index_dir}/{DOCUMENT_STORE_DB}?mode=ro&uri=true' if read_only \
+        else f'sqlite:///{index_dir}/{DOCUMENT_STORE_DB}'
+    return FAISSDocumentStore(
+        faiss_index=faiss_index,
+        sql_url=sql_url,
+        progress_bar=False,
+        **config)
+
+
+def _load_previous_chunks(index_dir: str):
+    """Load the chunks of the previous build, with their embeddings"""
+    embeddings_path = f'{index_dir}/{EMBEDDINGS_FILE}'
+    if not os.path.exists(embeddings_path):
+        return {}
+    with np.load(embeddings_path) as npz:
+        embeddings = dict(zip(npz['ids'].tolist(), npz['embeddings']))
+    document_store = open_document_store(index_dir)
+    chunks = {}
+    for doc in document_store.get_all_documents(return_embedding=False):
+        if doc.id in embeddings:
+            # vector_id is assigned again when the new index is written
+            doc.meta.pop('vector_id', None)
+            doc.embedding = embeddings[doc.id]
+            chunks[doc.id] = doc
+    document_store.session.close()
+    return chunks
+
+
+def _write_document_store(chunks, out_dir: str, faiss_index_factory: str = FAISS_INDEX_FACTORY):
+    """Write chunks (with embeddings) into a new FAISS document store, saved in out_dir"""
+    config = document_store_config(faiss_index_factory)
+    document_store = FAISSDocumentStore(
+        sql_url=f'sqlite:///{out_dir}/{DOCUMENT_STORE_DB}',
+        progress_bar=False,
+        **config)
+    faiss_index = document_store.faiss_indexes[document_store.index]
+    if not faiss_index.is_trained:
+        # IVF and PQ indexes learn their centroids/codebooks from the corpus embeddings
+        document_store.train_index(
+            embeddings=np.vstack([chunk.embedding for chunk in chunks]).astype(np.float32))
+    document_store.write_documents(chunks, duplicate_documents='fail')
+    document_store.save(f'{out_dir}/{FAISS_INDEX_FILE}')
+    # passages with the vector IDs assigned by the document store
+    write_passage_store(document_store.get_all_documents(return_embedding=False),
+                        f'{out_dir}/{PASSAGE_STORE_FILE}')
+    document_store.session.close()
+
+    # the config does not contain the SQL url (unlike the one saved by Haystack):
+    # as with the indexing notebook, the app opens the SQL database from its working directory
+    with open(f'{out_dir}/{FAISS_CONFIG_FILE}', 'w') as fout:
+        json.dump(config, fout)
+
+
+def build_derived_files(index_dir: str = INDEX_DIR):
+    """
+    (Re)build the BM25 index, the passage store and the reader tokens from the chunks
+    of an existing document store (e.g. created in the notebook)
+    """
+    document_store = open_document_store(index_dir)
+    chunks = document_store.get_all_documents(return_embedding=False)
+    document_store.session.close()
+    with tempfile.TemporaryDirectory(dir=index_dir) as tmp_dir:
+        build_sparse_index(chunks, f'{tmp_dir}/{SPARSE_INDEX_FILE}')
+        write_passage_store(chunks, f'{tmp_dir}/{PASSAGE_STORE_FILE}')
+        build_reader_tokens([chunk.content for chunk in chunks], f'{tmp_dir}/{READER_TOKENS_FILE}')
+        for file_name in (SPARSE_INDEX_FILE, PASSAGE_STORE_FILE, READER_TOKENS_FILE):
+            os.replace(f'{tmp_dir}/{file_name}', f'{index_dir}/{file_name}')
+    return len(chunks)
+
+
+def build_index(input_dir: str = INPUT_DOCS_DIR, index_dir: str = INDEX_DIR,
+                full_rebuild: bool = False, batch_size: int = 32,
+                use_gpu: bool = False, retriever: EmbeddingRetriever = None,
+                faiss_index_factory: str = FAISS_INDEX_FACTORY, dedup: bool = DEDUP_PARAMS['enabled'],
+                preprocessor_params: dict = PREPROCESSOR_PARAMS, workers: int = CHUNKING_WORKERS):
+    """
+    Build (or update) the FAISS index from the wiki pages in input_dir.
+    Only new or modified chunks are embedded.
+    With dedup, only one chunk of every group of near-duplicates is indexed.
+    Pages are chunked by `workers` processes (see chunk_pages).
+    The FAISS index is always rewritten from the stored embeddings,
+    so faiss_index_factory can change without re-embedding the corpus.
+    Return a Counter with build statistics.
+    """
+    start = time.time()
+    stats = Counter()
+    settings = index_settings(preprocessor_params)
+    manifest = None if full_rebuild else load_manifest(index_dir)
+    if manifest and (manifest.get('version') != MANIFEST_VERSION
+                     or manifest.get('settings') != settings):
+        logger.info('Index settings changed: rebuilding from scratch')
+        manifest = None
+    previous_chunks = _load_previous_chunks(index_dir) if manifest else {}
+    previous_pages = manifest['pages'] if manifest else {}
+
+    # pages are streamed from the corpus: only their hashes and chunks are kept
+    page_hashes = {}
+    chunks_by_page = {}
+
+    def pages_to_chunk():
+        for page in iter_documents(input_dir):
+            name = page['meta']['name']
+            page_hashes[name] = page_hash(page)
+            previous = previous_pages.get(name)
+            if previous and previous['hash'] == page_hashes[name]:
+                stats['pages_unchanged'] += 1
+                if all(cid in previous_chunks for cid in previous['chunks']):
+                    chunks_by_page[name] = [previous_chunks[cid] for cid in previous['chunks']]
+                    continue
+                # chunks removed as near-duplicates are not in the document store
+            else:
+                stats['pages_modified' if previous else 'pages_added'] += 1
+            yield page
+
+    # new and modified pages are chunked by worker processes
+    chunks_by_page.update(chunk_pages(pages_to_chunk(), workers, preprocessor_params))
+    stats['pages_deleted'] = len(set(previous_pages) - set(page_hashes))
+
+    chunks = [chunk for name in sorted(chunks_by_page) for chunk in chunks_by_page[name]]
+    if dedup:
+        dedup_params = {key: value for key, value in DEDUP_PARAMS.items() if key != 'enabled'}
+        chunks, stats['chunks_duplicate'] = deduplicate(chunks, **dedup_params)
+    else:
+        for chunk in chunks:
+            chunk.meta.pop('sources', None)
+    to_embed = []
+    for chunk in chunks:
+        if chunk.embedding is None and chunk.id in previous_chunks:
+            chunk.embedding = previous_chunks[chunk.id].embedding
+        if chunk.embedding is None:
+            to_embed.append(chunk)
+    stats['chunks'] = len(chunks)
+    stats['chunks_embedded'] = len(to_embed)
+    stats['chunks_reused'] = len(chunks) - len(to_embed)
+    stats['chunks_deleted'] = len(set(previous_chunks) - {chunk.id for chunk in chunks})
+
+    if to_embed:
+        if retriever is None:
+            retriever = EmbeddingRetriever(embedding_model=RETRIEVER_MODEL,
+                                           model_format=RETRIEVER_MODEL_FORMAT,
+                                           use_gpu=use_gpu, progress_bar=False)
+        for i in range(0, len(to_embed), batch_size):
+            batch = to_embed[i:i + batch_size]
+            for chunk, embedding in zip(batch, retriever.embed_documents(batch)):
+                chunk.embedding = np.asarray(embedding, dtype=np.float32)
+            logger.info(f'Embedded {min(i + batch_size, len(to_embed))}/{len(to_embed)} chunks')
+
+    os.makedirs(index_dir, exist_ok=True)
+    new_manifest = {
+        'version': MANIFEST_VERSION,
+        'settings': settings,
+        'build_id': hashlib.sha1(''.join(chunk.id for chunk in chunks).encode()).hexdigest(),
+        'built_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+        'faiss_index_factory': faiss_index_factory,
+        'dedup': {key: value for key, value in DEDUP_PARAMS.items() if key != 'enabled'} if dedup else None,
+        'pages': {name: {'hash': page_hashes[name],
+                         'chunks': [chunk.id for chunk in chunks_by_page[name]]}
+                  for name in sorted(chunks_by_page)}}
+
+    # the new index is written in a temporary directory and then moved,
+    # so that a failed build does not leave a broken index behind
+    with tempfile.TemporaryDirectory(dir=index_dir) as tmp_dir:
+        _write_document_store(chunks, tmp_dir, faiss_index_factory)
+        np.savez(f'{tmp_dir}/{EMBEDDINGS_FILE}',
+                 ids=np.array([chunk.id for chunk in chunks]),
+                 embeddings=np.vstack([chunk.embedding for chunk in chunks]).astype(np.float32))
+        build_sparse_index(chunks, f'{tmp_dir}/{SPARSE_INDEX_FILE}')
+        build_reader_tokens([chunk.content for chunk in chunks], f'{tmp_dir}/{READER_TOKENS_FILE}')
+        with open(f'{tmp_dir}/{MANIFEST_FILE}', 'w', encoding='utf-8') as fout:
+            json.dump(new_manifest, fout)
+        # the manifest is moved last: if something goes wrong,
+        # the next build does not trust the partially updated index
+        for file_name in (DOCUMENT_STORE_DB, FAISS_INDEX_FILE, FAISS_CONFIG_FILE,
+                          EMBEDDINGS_FILE, SPARSE_INDEX_FILE, PASSAGE_STORE_FILE, READER_TOKENS_FILE,
+                          MANIFEST_FILE):
+            os.replace(f'{tmp_dir}/{file_name}', f'{index_dir}/{file_name}')
+
+    stats['seconds'] = round(time.time() - start, 1)
+    return stats
@@ -0,0 +1,299 @@
+"""
+Per-request tracing and metrics of the Question Answering pipeline.
+
+Every question is traced: the instrumented pipeline nodes (see instrument_pipeline)
+record spans (embedding, FAISS search, document fetch, reader...) with their duration
+and attributes (top_k, number of passages, cache hits).
+Finished traces are written as structured logs (one JSON object per line)
+and aggregated in Prometheus-style counters and histograms,
+exposed in the text exposition format by a local HTTP endpoint (/metrics).
+"""
+
+import bisect
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app_utils.config import TRACES_LOG_PATH
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, values)) + '}'
+
+
+class Counter:
+    def __init__(self, name: str, description: str, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.label_names, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, description: str, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> (bucket counts, sum, count)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, times: int = 1, **labels):
+        """Observe a value (times: number of observations of the same value)"""
+        key = tuple(str(labels.get(name, '')) for name in self.label_names)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                counts[index] += times
+            self._values[key] = (counts, total + value * times, count + times)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.label_names + ('le',), key + (bucket,))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.label_names + ('le',), key + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {count}')
+        return lines
+
+
+REQUESTS = Counter('qa_requests_total', 'Questions answered, by outcome', ['outcome'])
+CACHE_LOOKUPS = Counter('qa_cache_lookups_total', 'Answer lookups, by source of the answer', ['result'])
+REQUEST_SECONDS = Histogram('qa_request_duration_seconds', 'Time to answer a question')
+STAGE_SECONDS = Histogram('qa_stage_duration_seconds', 'Duration of the pipeline stages', ['stage'])
+PASSAGES = Histogram('qa_passages', 'Passages per question, by stage', ['stage'], buckets=COUNT_BUCKETS)
+METRICS = [REQUESTS, CACHE_LOOKUPS, REQUEST_SECONDS, STAGE_SECONDS, PASSAGES]
+
+
+def render_metrics() -> str:
+    """All the metrics, in the Prometheus text exposition format"""
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+def _traces_logger():
+    trace_logger = logging.getLogger('wklp.traces')
+    if not trace_logger.handlers:
+        handler = logging.FileHandler(TRACES_LOG_PATH) if TRACES_LOG_PATH \
+            else logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        trace_logger.addHandler(handler)
+        trace_logger.setLevel(logging.INFO)
+        trace_logger.propagate = False
+    return trace_logger
+
+
+_current = threading.local()
+
+
+class Trace:
+    """Spans and attributes of a request, collected in the thread that runs it"""
+
+    def __init__(self, name: str = 'query', **attributes):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attributes = attributes
+        self.spans = []
+        self.start = time.perf_counter()
+        self.timestamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+    def add_span(self, name: str, duration: float, **attributes):
+        self.spans.append({'name': name, 'ms': round(duration * 1000, 2), **attributes})
+
+    def finish(self, outcome: str = 'ok'):
+        duration = time.perf_counter() - self.start
+        # a batch trace (QA service) covers several questions, all answered after the whole batch
+        questions = self.attributes.get('batch_size', 1)
+        REQUESTS.inc(questions, outcome=outcome)
+        REQUEST_SECONDS.observe(duration, times=questions)
+        if 'cache' in self.attributes:
+            CACHE_LOOKUPS.inc(result=self.attributes['cache'])
+        _traces_logger().info(json.dumps({'time': self.timestamp, 'trace_id': self.trace_id,
+                                          'name': self.name, 'outcome': outcome,
+                                          'ms': round(duration * 1000, 2), **self.attributes,
+                                          'spans': self.spans}, default=str))
+
+
+def current_trace():
+    return getattr(_current, 'trace', None)
+
+
+@contextmanager
+def trace(name: str = 'query', **attributes):
+    """
+    Trace a request: the spans recorded in this thread are added to the trace.
+    The outcome is "ok", "error", the trace_outcome of the exception class (e.g. "rejected")
+    or "aborted" if the request is interrupted (e.g. by a Streamlit rerun, which is not an Exception)
+    """
+    new_trace = Trace(name, **attributes)
+    previous, _current.trace = current_trace(), new_trace
+    outcome = 'aborted'
+    try:
+        yield new_trace
+        outcome = 'ok'
+    except Exception as e:
+        outcome = getattr(e, 'trace_outcome', 'error')
+        raise
+    finally:
+        _current.trace = previous
+        new_trace.finish(outcome)
+
+
+@contextmanager
+def use_trace(active_trace):
+    """Add the spans recorded in this thread to a trace started in another thread (e.g. by a worker)"""
+    previous, _current.trace = current_trace(), active_trace
+    try:
+        yield active_trace
+    finally:
+        _current.trace = previous
+
+
+def record_span(name: str, duration: float, passages: int = None, **attributes):
+    """Record a stage: histograms and (if a request is traced) span"""
+    STAGE_SECONDS.observe(duration, stage=name)
+    if passages is not None:
+        PASSAGES.observe(passages, stage=name)
+        attributes['passages'] = passages
+    active_trace = current_trace()
+    if active_trace is not None:
+        active_trace.add_span(name, duration, **attributes)
+
+
+def _count(documents):
+    # documents of one query or of a batch of queries
+    if documents and isinstance(documents[0], list):
+        return sum(len(docs) for docs in documents)
+    return len(documents or [])
+
+
+def _wrap(obj, method_name: str, record):
+    """Replace a method of obj with a timed version; record(duration, args, kwargs, result) records it"""
+    method = getattr(obj, method_name)
+    if getattr(method, '_instrumented', False):
+        # component shared by several pipelines (e.g. the reader of several corpora)
+        return
+
+    @wraps(method)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        result = method(*args, **kwargs)
+        record(time.perf_counter() - start, args, kwargs, result)
+        return result
+
+    timed._instrumented = True
+    setattr(obj, method_name, timed)
+
+
+def strip_instrumentation(obj):
+    """Remove the timed methods set by instrument_pipeline (e.g. from a copy of an instrumented node)"""
+    for name, value in list(vars(obj).items()):
+        if getattr(value, '_instrumented', False):
+            delattr(obj, name)
+    return obj
+
+
+def instrument_pipeline(pipeline):
+    """
+    Add timing to the pipeline components: query embedding, FAISS search, document fetch (SQL)
+    and reader (retrieval and passage gate spans carry top_k and passage counts)
+    """
+    retriever = pipeline.get_node('Retriever')
+    reader = pipeline.get_node('Reader')
+    document_store = retriever.document_store
+
+    _wrap(retriever, 'embed_queries', lambda duration, args, kwargs, result: record_span(
+        'embedding', duration, queries=len(kwargs.get('queries', args[0] if args else []))))
+
+    # FAISS search time = query_by_embedding time - document fetch time
+    fetch_time = threading.local()
+
+    def record_fetch(duration, args, kwargs, result):
+        fetch_time.seconds = getattr(fetch_time, 'seconds', 0.0) + duration
+        record_span('document_fetch', duration, passages=len(result))
+
+    def timed_query_by_embedding(method):
+        @wraps(method)
+        def timed(*args, **kwargs):
+            fetch_time.seconds = 0.0
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            record_span('faiss_search', time.perf_counter() - start - fetch_time.seconds,
+                        top_k=kwargs.get('top_k'))
+            return result
+        timed._instrumented = True
+        return timed
+
+    _wrap(document_store, 'get_documents_by_vector_ids', record_fetch)
+    if not getattr(document_store.query_by_embedding, '_instrumented', False):
+        document_store.query_by_embedding = timed_query_by_embedding(document_store.query_by_embedding)
+
+    _wrap(retriever, 'retrieve', lambda duration, args, kwargs, result: record_span(
+        'retrieval', duration, passages=len(result), top_k=kwargs.get('top_k')))
+    _wrap(retriever, 'retrieve_batch', lambda duration, args, kwargs, result: record_span(
+        'retrieval', duration, passages=_count(result), top_k=kwargs.get('top_k')))
+    _wrap(reader, 'predict', lambda duration, args, kwargs, result: record_span(
+        'reader', duration, passages=len(kwargs.get('documents', [])), top_k=kwargs.get('top_k')))
+    _wrap(reader, 'predict_batch', lambda duration, args, kwargs, result: record_span(
+        'reader', duration, passages=_count(kwargs.get('documents')), top_k=kwargs.get('top_k')))
+    gate = pipeline.get_node('PassageGate')
+    if gate is not None:
+        _wrap(gate, 'select', lambda duration, args, kwargs, result: record_span(
+            'passage_gate', duration, passages=len(result)))
+    return pipeline
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        data = render_metrics().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        # no access log for the scrapes
+        pass
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve /metrics in a background thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,124 @@
+"""
+Retriever-score gating: a pipeline node, between retriever and reader,
+that decides how many retrieved passages are worth reading.
+
+When the top passages clearly dominate (large similarity gap or most of the
+softmax probability mass), the remaining passages are not sent to the reader.
+If no passage reaches a minimum similarity, the reader is skipped altogether.
+"""
+
+from typing import Callable, List, Optional
+
+import numpy as np
+from haystack import Document
+from haystack.nodes.base import BaseComponent
+from haystack.pipelines import ExtractiveQAPipeline, Pipeline
+
+from app_utils.query_executor import QueryCancelled
+
+
+class PassageGate(BaseComponent):
+    """
+    Select the retrieved passages to send to the reader.
+    All the thresholds refer to the raw query-passage similarity
+    (e.g. dot product), recovered from the scaled retriever scores.
+    """
+
+    outgoing_edges = 1
+
+    def __init__(self, similarity: str = "dot_product", enabled: bool = False,
+                 min_similarity: Optional[float] = None, score_gap: Optional[float] = None,
+                 score_mass: Optional[float] = None, temperature: float = 1.0,
+                 min_documents: int = 1):
+        """
+        :param similarity: similarity function of the document store (to unscale the scores)
+        :param enabled: if False, all the passages are sent to the reader
+        :param min_similarity: if the best passage is below this value, the reader is skipped
+        :param score_gap: passages after a similarity drop larger than this value are discarded
+        :param score_mass: passages are kept until their cumulative softmax probability reaches this value
+        :param temperature: temperature of the softmax over similarities
+        :param min_documents: minimum number of passages sent to the reader (if the reader is not skipped)
+        """
+        super().__init__()
+        self.similarity = similarity
+        self.enabled = enabled
+        self.min_similarity = min_similarity
+        self.score_gap = score_gap
+        self.score_mass = score_mass
+        self.temperature = temperature
+        self.min_documents = min_documents
+
+    def _raw_similarities(self, documents: List[Document]) -> np.ndarray:
+        scores = np.array([doc.score for doc in documents], dtype=np.float64)
+        if self.similarity == "cosine":
+            return scores * 2 - 1
+        # dot product scores are scaled by the document store as sigmoid(score / 100)
+        scores = np.clip(scores, 1e-12, 1 - 1e-12)
+        return 100 * np.log(scores / (1 - scores))
+
+    def select(self, documents: List[Document], enabled: Optional[bool] = None,
+               min_similarity: Optional[float] = None, score_gap: Optional[float] = None,
+               score_mass: Optional[float] = None, temperature: Optional[float] = None,
+               min_documents: Optional[int] = None) -> List[Document]:
+        """Return the passages to read (parameters default to the ones set at init)"""
+        enabled = self.enabled if enabled is None else enabled
+        if not enabled or not documents or any(doc.score is None for doc in documents):
+            return documents
+        min_similarity = self.min_similarity if min_similarity is None else min_similarity
+        score_gap = self.score_gap if score_gap is None else score_gap
+        score_mass = self.score_mass if score_mass is None else score_mass
+        temperature = self.temperature if temperature is None else temperature
+        min_documents = self.min_documents if min_documents is None else min_documents
+
+        documents = sorted(documents, key=lambda doc: doc.score, reverse=True)
+        similarities = self._raw_similarities(documents)
+        if min_similarity is not None and similarities[0] < min_similarity:
+            return []
+
+        keep = len(documents)
+        if score_gap is not None:
+            gaps = similarities[:-1] - similarities[1:]
+            for i in range(max(min_documents - 1, 0), len(gaps)):
+                if gaps[i] > score_gap:
+                    keep = min(keep, i + 1)
+                    break
+        if score_mass is not None:
+            exp = np.exp((similarities - similarities[0]) / temperature)
+            cumulative_mass = np.cumsum(exp / exp.sum())
+            keep = min(keep, int(np.searchsorted(cumulative_mass, score_mass)) + 1)
+        return documents[:max(keep, min_documents)]
+
+    def run(self, documents: List[Document], enabled: Optional[bool] = None,  # type: ignore
+            min_similarity: Optional[float] = None, score_gap: Optional[float] = None,
+            score_mass: Optional[float] = None, temperature: Optional[float] = None,
+            min_documents: Optional[int] = None, cancelled: Optional[Callable[[], bool]] = None):
+        # the question was abandoned (see query_executor.py): the reader is not run
+        if cancelled is not None and cancelled():
+            raise QueryCancelled('Question cancelled before the reader')
+        selected = self.select(documents, enabled, min_similarity, score_gap,
+                               score_mass, temperature, min_documents)
+        output = {"documents": selected,
+                  "passage_gate": {"retrieved": len(documents), "read": len(selected)}}
+        return output, "output_1"
+
+    def run_batch(self, documents: List[List[Document]], enabled: Optional[bool] = None,  # type: ignore
+                  min_similarity: Optional[float] = None, score_gap: Optional[float] = None,
+                  score_mass: Optional[float] = None, temperature: Optional[float] = None,
+                  min_documents: Optional[int] = None):
+        selected = [self.select(docs, enabled, min_similarity, score_gap,
+                                score_mass, temperature, min_documents) for docs in documents]
+        output = {"documents": selected,
+                  "passage_gate": [{"retrieved": len(docs), "read": len(sel)}
+                                   for docs, sel in zip(documents, selected)]}
+        return output, "output_1"
+
+
+class GatedExtractiveQAPipeline(ExtractiveQAPipeline):
+    """ExtractiveQAPipeline with a PassageGate node between retriever and reader"""
+
+    def __init__(self, reader, retriever, gate: PassageGate):
+        self.pipeline = Pipeline()
+        self.pipeline.add_node(component=retriever, name="Retriever", inputs=["Query"])
+        self.pipeline.add_node(component=gate, name="PassageGate", inputs=["Retriever"])
+        self.pipeline.add_node(component=reader, name="Reader", inputs=["PassageGate"])
+        self.metrics_filter = {"Retriever": ["recall_single_hit"]}
@@ -0,0 +1,121 @@
+"""
+Read-only, memory-mapped passage store.
+
+Passages (text, name/url metadata and document ID) are saved at index time in a single
+binary file (passages.bin), in FAISS vector ID order:
+- header: magic, number of passages N;
+- table: N rows (content offset, content length, meta offset, meta length) as little-endian uint64;
+- document IDs: N fixed-size ASCII strings;
+- data: UTF-8 content and JSON meta of every passage.
+
+The file is memory-mapped: retrieved passages are decoded directly from the mapped pages
+(no SQL round-trips) and several worker processes share the same pages in the OS page cache.
+"""
+
+import json
+import mmap
+import struct
+from typing import Dict, List, Optional
+
+import numpy as np
+from haystack import Document
+from haystack.document_stores import FAISSDocumentStore
+
+PASSAGE_STORE_FILE = 'passages.bin'
+MAGIC = b'WKLPPS01'
+ID_SIZE = 40  # SHA1 hex digest (chunk IDs)
+TABLE_DTYPE = np.dtype([('content_offset', '<u8'), ('content_length', '<u8'),
+                        ('meta_offset', '<u8'), ('meta_length', '<u8')])
+
+
+def write_passage_store(documents: List[Document], path: str):
+    """Write the passages, ordered by their vector_id (documents must be in the FAISS index)"""
+    documents = sorted(documents, key=lambda doc: int(doc.meta['vector_id']))
+    if [int(doc.meta['vector_id']) for doc in documents] != list(range(len(documents))):
+        raise ValueError('Vector IDs must be 0..N-1 to write the passage store')
+    table = np.zeros(len(documents), dtype=TABLE_DTYPE)
+    ids = np.zeros(len(documents), dtype=f'S{ID_SIZE}')
+    data = []
+    offset = len(MAGIC) + 8 + table.nbytes + ids.nbytes
+    for i, doc in enumerate(documents):
+        content = doc.content.encode('utf-8')
+        meta = json.dumps({key: value for key, value in doc.meta.items() if key != 'vector_id'},
+                          separators=(',', ':')).encode('utf-8')
+        table[i] = (offset, len(content), offset + len(content), len(meta))
+        if len(doc.id) > ID_SIZE:
+            # numpy would silently truncate it
+            raise ValueError(f'Document ID longer than {ID_SIZE} characters: {doc.id}')
+        ids[i] = doc.id.encode('ascii')
+        data += [content, meta]
+        offset += len(content) + len(meta)
+    with open(path, 'wb') as fout:
+        fout.write(MAGIC + struct.pack('<Q', len(documents)))
+        fout.write(table.tobytes())
+        fout.write(ids.tobytes())
+        for chunk in data:
+            fout.write(chunk)
+
+
+class PassageStore:
+    """Memory-mapped passages, accessed by vector ID or document ID"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as fin:
+            self._mmap = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a passage store')
+        (count,) = struct.unpack_from('<Q', self._mmap, len(MAGIC))
+        self._view = memoryview(self._mmap)
+        # views on the mapped file (no copy)
+        self.table = np.frombuffer(self._mmap, dtype=TABLE_DTYPE, count=count, offset=len(MAGIC) + 8)
+        self.ids = np.frombuffer(self._mmap, dtype=f'S{ID_SIZE}', count=count,
+                                 offset=len(MAGIC) + 8 + self.table.nbytes)
+        self._positions = None
+
+    def __len__(self):
+        return len(self.table)
+
+    def position(self, doc_id: str) -> Optional[int]:
+        """Vector ID of a document ID"""
+        if self._positions is None:
+            self._positions = {doc_id.decode('ascii'): i for i, doc_id in enumerate(self.ids)}
+        return self._positions.get(doc_id)
+
+    def get(self, position: int) -> Document:
+        content_offset, content_length, meta_offset, meta_length = self.table[position]
+        content = str(self._view[content_offset:content_offset + content_length], 'utf-8')
+        meta = json.loads(str(self._view[meta_offset:meta_offset + meta_length], 'utf-8'))
+        meta['vector_id'] = str(position)
+        return Document(content=content, id=self.ids[position].decode('ascii'), meta=meta)
+
+
+class MmapFAISSDocumentStore(FAISSDocumentStore):
+    """
+    Read-only FAISSDocumentStore whose passages are read from a PassageStore instead of SQL.
+    FAISS search (query_by_embedding) is unchanged; the SQL database is only an empty in-memory one.
+    """
+
+    def __init__(self, passage_store: PassageStore, faiss_index, **kwargs):
+        # set before the parent init, which checks the number of documents
+        self.passage_store = passage_store
+        super().__init__(sql_url='sqlite://', faiss_index=faiss_index, **kwargs)
+
+    def get_document_count(self, filters=None, index: Optional[str] = None,
+                           only_documents_without_embedding: bool = False, headers: Optional[Dict[str, str]] = None) -> int:
+        return 0 if only_documents_without_embedding else len(self.passage_store)
+
+    def get_documents_by_vector_ids(self, vector_ids: List[str], index: Optional[str] = None,
+                                    batch_size: int = 10_000, headers: Optional[Dict[str, str]] = None):
+        return [self.passage_store.get(int(vector_id)) for vector_id in vector_ids]
+
+    def get_documents_by_id(self, ids: List[str], index: Optional[str] = None,
+                            batch_size: int = 10_000, headers: Optional[Dict[str, str]] = None):
+        positions = [self.passage_store.position(doc_id) for doc_id in ids]
+        return [self.passage_store.get(position) for position in positions if position is not None]
+
+    def get_all_documents(self, index: Optional[str] = None, filters=None, return_embedding: Optional[bool] = None,
+                          batch_size: int = 10_000, headers: Optional[Dict[str, str]] = None) -> List[Document]:
+        return [self.passage_store.get(position) for position in range(len(self.passage_store))]
+
+    def write_documents(self, *args, **kwargs):
+        raise NotImplementedError('MmapFAISSDocumentStore is read-only')
@@ -0,0 +1,73 @@
+"""
+Precomputed answers to known questions (e.g. the ones of the "Random question" button).
+
+The answers are computed offline by scripts/precompute_answers.py and saved in a
+gzip-compressed JSON file, tied to the index build and to the query parameters:
+if the index is rebuilt or the parameters change, the file is ignored.
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+from typing import Dict, List
+
+from haystack.schema import Answer
+
+from app_utils.config import PRECOMPUTED_ANSWERS_PATH
+from app_utils.semantic_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+PRECOMPUTED_ANSWERS_VERSION = 1
+
+
+def save_precomputed_answers(answers: Dict[str, List[Answer]], index_version: str, params_key: str,
+                             path: str = PRECOMPUTED_ANSWERS_PATH):
+    """Save the answers (question -> list of Answers), atomically"""
+    data = {'version': PRECOMPUTED_ANSWERS_VERSION,
+            'index_version': index_version,
+            'params_key': params_key,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+            'answers': {normalize_question(question): {'query': question,
+                                                       'answers': [answer.to_dict() for answer in question_answers]}
+                        for question, question_answers in answers.items()}}
+    tmp_path = f'{path}.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as fout:
+        json.dump(data, fout, separators=(',', ':'), default=float)
+    os.replace(tmp_path, path)
+
+
+class PrecomputedAnswers:
+    """Answers loaded from the precomputed answers file, looked up by normalized question"""
+
+    def __init__(self, answers: dict, params_key: str):
+        self.answers = answers
+        self.params_key = params_key
+        self.hits = 0
+
+    @classmethod
+    def load(cls, index_version: str, path: str = PRECOMPUTED_ANSWERS_PATH):
+        """Load the file, if it exists and was computed with the current index (otherwise return None)"""
+        if not path or not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt', encoding='utf-8') as fin:
+            data = json.load(fin)
+        if data.get('version') != PRECOMPUTED_ANSWERS_VERSION or data.get('index_version') != index_version:
+            logger.warning(f'{path} was computed with a different index: it is not used')
+            return None
+        logger.info(f"Loaded {len(data['answers'])} precomputed answers ({data['created_at']})")
+        return cls(data['answers'], data['params_key'])
+
+    def get(self, question: str, params_key: str):
+        """Results for the question (in the pipeline format), or None"""
+        if params_key != self.params_key:
+            return None
+        entry = self.answers.get(normalize_question(question))
+        if entry is None:
+            return None
+        self.hits += 1
+        return {'query': question,
+                'answers': [Answer.from_dict(answer) for answer in entry['answers']],
+                'precomputed': True}
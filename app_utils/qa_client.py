@@ -0,0 +1,35 @@
+"""
+Thin client of the Question Answering service (app_utils/qa_service.py),
+used by the web app when QA_SERVICE_URL is set.
+"""
+
+import json
+import urllib.request
+
+from haystack.schema import Answer
+
+from app_utils.config import QA_SERVICE_URL, QA_SERVICE_TIMEOUT
+
+
+class QAClient:
+    def __init__(self, url: str = QA_SERVICE_URL, timeout: float = QA_SERVICE_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, path: str, payload: dict = None) -> dict:
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(f'{self.url}{path}', data=data,
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.load(response)
+
+    def query(self, question: str, retriever_top_k: int = 10, reader_top_k: int = 5) -> dict:
+        """Answer a question, returning results in the same format as the pipeline (Answer objects)"""
+        result = self._request('/query', {'question': question,
+                                          'retriever_top_k': retriever_top_k,
+                                          'reader_top_k': reader_top_k})
+        result['answers'] = [Answer.from_dict(answer) for answer in result['answers']]
+        return result
+
+    def health(self) -> dict:
+        return self._request('/health')
@@ -0,0 +1,218 @@
+"""
+Question Answering service with dynamic micro-batching.
+
+A minimal asyncio HTTP server wraps the pipeline: concurrent questions (also from
+different web app sessions) are collected for a short time window and answered together,
+with batched query embedding and batched reader inference (pipeline.run_batch).
+While a batch is running, new questions queue up and form the next batch,
+so larger batches are formed as the load grows.
+
+Endpoints:
+- POST /query {"question": ..., "retriever_top_k": ..., "reader_top_k": ...} -> {"query", "answers", "passage_gate"}
+- GET /health -> {"ready": ..., batching statistics}
+- GET /metrics -> Prometheus metrics (see app_utils/metrics.py)
+"""
+
+import asyncio
+import json
+import logging
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from app_utils.config import (RETRIEVER_TOP_K, READER_TOP_K, QA_SERVICE_MAX_BATCH_SIZE,
+    QA_SERVICE_MAX_WAIT_MS)
+from app_utils.metrics import CACHE_LOOKUPS, render_metrics, trace
+from app_utils.precomputed_answers import PrecomputedAnswers
+from app_utils.semantic_cache import SemanticCache
+from app_utils.startup import PipelineLoader, pipeline_params, params_key
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(obj):
+    # numpy scalars and arrays in answers and metadata
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    return str(obj)
+
+
+class MicroBatcher:
+    """
+    Collect questions in batches (up to max_batch_size questions, waiting at most max_wait_ms
+    after the first one) and answer every batch in a worker thread
+    """
+
+    def __init__(self, loader: PipelineLoader, answer_cache: SemanticCache = None,
+                 max_batch_size: int = QA_SERVICE_MAX_BATCH_SIZE,
+                 max_wait_ms: float = QA_SERVICE_MAX_WAIT_MS):
+        self.loader = loader
+        self.answer_cache = answer_cache
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        # a single worker: the models already use all the CPU cores
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qa-batch')
+        self.stats = Counter()
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        # created in the running event loop
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def submit(self, question: str, params: dict) -> dict:
+        """Enqueue a question and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((question, params, future))
+        return await future
+
+    async def run(self):
+        """Batching loop (to be run as a task)"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.stats['batches'] += 1
+            self.stats['questions'] += len(batch)
+            self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(batch))
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self.answer_batch, [(question, params) for question, params, _ in batch])
+            except Exception as e:
+                logger.exception('Error answering a batch of questions')
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def answer_batch(self, items):
+        """
+        Answer a batch of (question, params) pairs.
+        Questions are embedded together; the ones not found in the answer cache are
+        run through the pipeline in one batch per distinct params.
+        """
+        pipe = self.loader.get()
+        with trace('batch', batch_size=len(items)) as batch_trace:
+            results = self._answer_batch(pipe, items)
+            batch_trace.attributes['cache_hits'] = sum(1 for result in results if result.get('cached'))
+        return results
+
+    def _answer_batch(self, pipe, items):
+        questions = [question for question, _ in items]
+        embeddings = pipe.get_node('Retriever').embed_queries(questions)
+        results = [None] * len(items)
+        to_run = defaultdict(list)
+        run_params = {}
+        for i, ((question, params), embedding) in enumerate(zip(items, embeddings)):
+            answers_key = params_key(params)
+            if self.answer_cache is not None:
+                results[i] = self.answer_cache.lookup(question, embedding, answers_key)
+            if results[i] is None:
+                to_run[answers_key].append(i)
+                run_params[answers_key] = params
+                CACHE_LOOKUPS.inc(result='miss')
+            else:
+                results[i] = {**results[i], 'cached': True}
+                self.stats['cache_hits'] += 1
+                CACHE_LOOKUPS.inc(result='semantic_cache')
+
+        for answers_key, indexes in to_run.items():
+            # embeddings are not computed again (MemoizedEmbeddingRetriever)
+            output = pipe.run_batch(queries=[questions[i] for i in indexes],
+                                    params=run_params[answers_key])
+            for j, i in enumerate(indexes):
+                results[i] = {'query': questions[i],
+                              'answers': output['answers'][j],
+                              'passage_gate': output['passage_gate'][j] if 'passage_gate' in output else None}
+                if self.answer_cache is not None:
+                    self.answer_cache.store(questions[i], embeddings[i], results[i], answers_key)
+        return results
+
+
+class QAService:
+    """Asyncio HTTP server (HTTP/1.1, one request per connection) answering questions with a MicroBatcher"""
+
+    def __init__(self, batcher: MicroBatcher, host: str = '127.0.0.1', port: int = 8001,
+                 precomputed_answers: PrecomputedAnswers = None):
+        self.batcher = batcher
+        self.precomputed_answers = precomputed_answers
+        self.host = host
+        self.port = port
+
+    async def handle_query(self, body: bytes):
+        try:
+            request = json.loads(body)
+            question = request['question']
+            params = pipeline_params(int(request.get('retriever_top_k', RETRIEVER_TOP_K)),
+                                     int(request.get('reader_top_k', READER_TOP_K)))
+        except (ValueError, KeyError, TypeError) as e:
+            return HTTPStatus.BAD_REQUEST, {'error': f'Bad request: {e}'}
+        result = self.precomputed_answers.get(question, params_key(params)) \
+            if self.precomputed_answers is not None else None
+        if result is None:
+            result = await self.batcher.submit(question, params)
+        else:
+            CACHE_LOOKUPS.inc(result='precomputed')
+        return HTTPStatus.OK, {'query': result['query'],
+                               'answers': [answer.to_dict() for answer in result['answers']],
+                               'passage_gate': result.get('passage_gate')}
+
+    async def route(self, method: str, path: str, body: bytes):
+        if method == 'POST' and path == '/query':
+            return await self.handle_query(body)
+        if method == 'GET' and path == '/metrics':
+            return HTTPStatus.OK, render_metrics()
+        if method == 'GET' and path == '/health':
+            return HTTPStatus.OK, {'ready': self.batcher.loader.ready, **self.batcher.stats}
+        return HTTPStatus.NOT_FOUND, {'error': f'{method} {path} not found'}
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, *_ = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+        except (ValueError, asyncio.IncompleteReadError):
+            writer.close()
+            return
+        try:
+            status, payload = await self.route(method, path, body)
+        except Exception as e:
+            logger.exception('Error handling a request')
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)}
+        if isinstance(payload, str):
+            data, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+        else:
+            data, content_type = json.dumps(payload, default=_json_default).encode('utf-8'), 'application/json'
+        writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                     f'Content-Type: {content_type}\r\nContent-Length: {len(data)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode('latin-1') + data)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        batching_task = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        logger.info(f'QA service listening on http://{self.host}:{self.port}')
+        async with server:
+            await asyncio.gather(server.serve_forever(), batching_task)
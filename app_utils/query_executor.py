@@ -0,0 +1,141 @@
+"""
+Query executor: the questions of all the web app sessions that are not found in the answer caches
+are answered by a bounded pool of threads.
+
+- Single flight: identical questions in flight at the same time (same corpus, normalized question
+  and query parameters) are computed once; all the waiting sessions get the same results.
+- Cancellation: a computation is abandoned when no session waits for it anymore (the user edited
+  the question, or asked a new one): it is dropped from the queue, or stopped before the reader.
+- Admission control: when all the workers are busy and the queue is full, new questions are
+  rejected immediately (QueryRejected) instead of growing the backlog.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Hashable
+
+from app_utils.config import QUERY_WORKERS, QUERY_MAX_QUEUED
+from app_utils.metrics import current_trace, use_trace
+
+logger = logging.getLogger(__name__)
+
+
+class QueryRejected(Exception):
+    """The executor is overloaded: retry later"""
+    # outcome of the request in traces and metrics
+    trace_outcome = 'rejected'
+
+
+class QueryCancelled(Exception):
+    """No session waits for the results of the question anymore"""
+    trace_outcome = 'cancelled'
+
+
+class _Flight:
+    """Computation of a question, shared by the sessions waiting for it"""
+
+    def __init__(self, key: Hashable):
+        self.key = key
+        self.future = Future()
+        self.cancelled = threading.Event()
+        # waiter token -> session id
+        self.waiters = {}
+
+
+class QueryExecutor:
+    def __init__(self, max_workers: int = QUERY_WORKERS, max_queued: int = QUERY_MAX_QUEUED,
+                 poll_interval: float = 0.1):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query')
+        self._flights = {}
+        # flights running or queued in the pool
+        self._admitted = 0
+        self._lock = threading.Lock()
+
+    def run(self, key: Hashable, compute: Callable, session_id: str = None,
+            on_wait: Callable = None, timeout: float = None):
+        """
+        Results of compute(cancelled) for the question identified by key, and whether they were
+        shared with a computation already in flight.
+        compute runs in a worker thread and should stop (raising QueryCancelled) when cancelled() is True.
+        A new question of a session abandons its previous ones. While waiting, on_wait is called
+        every poll_interval seconds (e.g. a Streamlit yield point, where a rerun stops the session).
+        """
+        start = time.perf_counter()
+        token = object()
+        with self._lock:
+            if session_id is not None:
+                self._release_session(session_id)
+            flight = self._flights.get(key)
+            shared = flight is not None
+            if flight is None:
+                if self._admitted >= self.max_workers + self.max_queued:
+                    raise QueryRejected(f'Too many questions in progress ({self._admitted})')
+                flight = _Flight(key)
+                self._flights[key] = flight
+                self._admitted += 1
+                self._pool.submit(self._compute, flight, compute, current_trace())
+            flight.waiters[token] = session_id
+        try:
+            while not wait([flight.future], timeout=self.poll_interval).done:
+                if on_wait is not None:
+                    on_wait()
+                if timeout is not None and time.perf_counter() - start > timeout:
+                    raise TimeoutError(f'No answer within {timeout} s')
+            return flight.future.result(), shared
+        finally:
+            with self._lock:
+                flight.waiters.pop(token, None)
+                if not flight.waiters:
+                    self._cancel(flight)
+
+    def cancel_session(self, session_id: str):
+        """Abandon the questions of a session (the computations no one else waits for are cancelled)"""
+        with self._lock:
+            self._release_session(session_id)
+
+    def _release_session(self, session_id: str):
+        for flight in list(self._flights.values()):
+            for token, waiter_session in list(flight.waiters.items()):
+                if waiter_session == session_id:
+                    del flight.waiters[token]
+            if not flight.waiters:
+                self._cancel(flight)
+
+    def _cancel(self, flight: _Flight):
+        if flight.future.done():
+            return
+        flight.cancelled.set()
+        # identical questions asked from now on start a new computation
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        logger.debug(f'Question cancelled: {flight.key}')
+
+    def _compute(self, flight: _Flight, compute: Callable, request_trace):
+        # a plain function (not a bound method): pipeline params are deep-copied
+        def cancelled() -> bool:
+            return flight.cancelled.is_set()
+
+        try:
+            if cancelled():
+                raise QueryCancelled('Question cancelled while queued')
+            # the spans recorded by the pipeline nodes go to the trace of the first session
+            with use_trace(request_trace):
+                result = compute(cancelled)
+        except Exception as e:
+            # the pipeline wraps the exceptions raised by its nodes
+            error = QueryCancelled('Question cancelled') if cancelled() else e
+        else:
+            error = None
+        with self._lock:
+            self._admitted -= 1
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if error is None:
+            flight.future.set_result(result)
+        else:
+            flight.future.set_exception(error)
@@ -0,0 +1,141 @@
+"""
+Question generation from the wiki pages (batch job, see scripts/generate_questions.py).
+
+The corpus is streamed and sharded in small tasks across a process pool: every worker loads
+the question generation model once and generates the questions of its pages in batches.
+Every completed page is appended to the JSONL output ({"name", "url", "page_hash", "model",
+"questions"}) and flushed, so the output is also the checkpoint: an interrupted job resumes
+from the completed pages, and after a re-crawl only new or modified pages are processed
+(pages are compared by content hash). At the end, the output is rewritten with the current pages only.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import Counter
+from typing import Dict
+
+from app_utils.config import INPUT_DOCS_DIR, GENERATED_QUESTIONS_JSONL_PATH, QUESTION_GENERATION_MODEL
+from app_utils.corpus import iter_documents
+from app_utils.indexing import page_hash
+
+logger = logging.getLogger(__name__)
+
+# model loaded once per worker process
+_generator = None
+
+
+def _init_worker(model_name: str, batch_size: int, num_threads: int = None):
+    global _generator
+    from haystack.nodes import QuestionGenerator
+
+    if num_threads:
+        import torch
+        # the CPU cores are shared among the workers
+        torch.set_num_threads(num_threads)
+    _generator = QuestionGenerator(model_name_or_path=model_name, use_gpu=False,
+                                   batch_size=batch_size, progress_bar=False)
+
+
+def _generate(pages):
+    """Generate the questions of a task (a few pages), in batches"""
+    questions = _generator.generate_batch([page.pop('content') for page in pages])
+    return [{**page, 'questions': [question.strip() for question in page_questions if question.strip()]}
+            for page, page_questions in zip(pages, questions)]
+
+
+def page_json_size(page: dict) -> int:
+    """Size in bytes of the page saved as a JSON file by the original crawler ({"name", "url", "text"})"""
+    # ASCII output (escaped non-ASCII characters): one byte per character
+    return len(json.dumps({'name': page['meta']['name'], 'url': page['meta'].get('url'),
+                           'text': page['content']}))
+
+
+def load_generated_questions(path: str = GENERATED_QUESTIONS_JSONL_PATH) -> Dict[str, dict]:
+    """Records of the output file by page name (the last one of every page; a truncated line is skipped)"""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding='utf-8') as fin:
+        for line in fin:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # last line of an interrupted job
+                continue
+            records[record['name']] = record
+    return records
+
+
+def generate_questions(input_dir: str = INPUT_DOCS_DIR, output_path: str = GENERATED_QUESTIONS_JSONL_PATH,
+                       workers: int = 2, pages_per_task: int = 4, batch_size: int = 16,
+                       min_size: int = 5000, model_name: str = QUESTION_GENERATION_MODEL) -> Counter:
+    """
+    Generate questions for the pages in input_dir whose JSON file would be at least min_size bytes
+    (as in the question generation notebook, to skip stubs), resuming from output_path.
+    With workers=0, questions are generated in the current process.
+    Return a Counter with job statistics.
+    """
+    start = time.time()
+    stats = Counter()
+    done = load_generated_questions(output_path)
+    current = {}
+
+    def tasks():
+        task = []
+        for page in iter_documents(input_dir):
+            if page_json_size(page) < min_size:
+                continue
+            name = page['meta']['name']
+            current[name] = page_hash(page)
+            record = done.get(name)
+            if record and record['page_hash'] == current[name] and record.get('model') == model_name:
+                stats['pages_unchanged'] += 1
+                continue
+            task.append({'name': name, 'url': page['meta'].get('url'), 'page_hash': current[name],
+                         'model': model_name, 'content': page['content']})
+            if len(task) == pages_per_task:
+                yield task
+                task = []
+        if task:
+            yield task
+
+    num_threads = max(multiprocessing.cpu_count() // workers, 1) if workers else None
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'a', encoding='utf-8') as fout:
+        if workers:
+            pool = multiprocessing.Pool(workers, initializer=_init_worker,
+                                        initargs=(model_name, batch_size, num_threads))
+            results = pool.imap_unordered(_generate, tasks())
+        else:
+            pool = None
+            _init_worker(model_name, batch_size)
+            results = map(_generate, tasks())
+        try:
+            for records in results:
+                for record in records:
+                    fout.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    done[record['name']] = record
+                    stats['pages_generated'] += 1
+                    stats['questions_generated'] += len(record['questions'])
+                # checkpoint: completed pages are not generated again
+                fout.flush()
+                logger.info(f"Generated questions for {stats['pages_generated']} pages "
+                            f'({time.time() - start:.0f} s)')
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    # only the latest record of the current pages is kept
+    stats['pages_deleted'] = len(set(done) - set(current))
+    records = [done[name] for name in sorted(current)]
+    stats['questions'] = sum(len(record['questions']) for record in records)
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fout:
+        for record in records:
+            fout.write(json.dumps(record, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, output_path)
+    stats['seconds'] = round(time.time() - start, 1)
+    return stats
@@ -0,0 +1,69 @@
+"""Read the question files in data/questions"""
+
+import json
+import random
+import re
+from urllib.parse import unquote
+
+from app_utils.config import QUESTIONS_PATH, GENERATED_QUESTIONS_PATH
+
+
+def read_selected_questions(path: str = QUESTIONS_PATH):
+    """Manually selected questions (one per line, lines starting with # are comments)"""
+    with open(path, encoding='utf-8') as fin:
+        questions = [line.strip() for line in fin.readlines()
+                     if not line.startswith('#')]
+    return [question for question in questions if question]
+
+
+def _parse_generated_questions(path: str):
+    """Yield (question, title of the source page) pairs"""
+    if path.endswith('.jsonl'):
+        # output of scripts/generate_questions.py: one page per line
+        with open(path, encoding='utf-8') as fin:
+            for line in fin:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # last line of an interrupted job
+                    continue
+                title = unquote(record['name']).replace('_', ' ')
+                for question in record['questions']:
+                    yield question, title
+        return
+    title = None
+    with open(path, encoding='utf-8') as fin:
+        for line in fin:
+            if line.startswith(' - '):
+                question = line[3:].strip()
+                if question:
+                    yield question, title
+            elif re.match(r'\d+: ', line):
+                # document header, e.g. "0: Twin Peaks in popular culture"
+                title = line.split(': ', 1)[1].strip()
+
+
+def read_generated_questions(path: str = GENERATED_QUESTIONS_PATH,
+                             sample_size: int = None, seed: int = 42):
+    """
+    Automatically generated questions.
+    In the text file, every document header is followed by its questions, in the form " - question";
+    in the JSONL file, every line contains the questions of a page.
+    If sample_size is set, a reproducible random sample of (distinct) questions is returned.
+    """
+    questions = list(dict.fromkeys(question for question, _ in _parse_generated_questions(path)))
+    if sample_size is not None and sample_size < len(questions):
+        questions = random.Random(seed).sample(questions, sample_size)
+    return questions
+
+
+def read_generated_questions_with_pages(path: str = GENERATED_QUESTIONS_PATH,
+                                        sample_size: int = None, seed: int = 42):
+    """
+    Generated questions with the title of the page they were generated from
+    (a rough relevance label, e.g. to measure retrieval recall), as (question, title) pairs
+    """
+    pairs = list(dict(_parse_generated_questions(path)).items())
+    if sample_size is not None and sample_size < len(pairs):
+        pairs = random.Random(seed).sample(pairs, sample_size)
+    return pairs
@@ -0,0 +1,65 @@
+"""
+Reader backends: PyTorch (default) or ONNX Runtime with int8 dynamic quantization.
+
+Both backends are FARMReader instances (Haystack runs ONNX models with the same inferencer),
+so they return answers in the same format and with comparable scores.
+"""
+
+import logging
+import os
+from pathlib import Path
+
+from haystack.nodes import FARMReader
+
+from app_utils.config import (READER_MODEL, READER_CONFIG_THRESHOLD, READER_BACKEND,
+    ONNX_READER_DIR, ONNX_NUM_THREADS)
+
+logger = logging.getLogger(__name__)
+
+
+def export_onnx_reader(model_name: str = READER_MODEL, output_dir: str = ONNX_READER_DIR,
+                       quantize: bool = True):
+    """
+    Export the reader model to ONNX and (optionally) apply int8 dynamic quantization.
+    The quantized model replaces model.onnx (the float32 one is kept as model-fp32.onnx).
+    """
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    output_path = Path(output_dir)
+    # Haystack's quantize option writes the quantized model in a separate file,
+    # which is not the one loaded by FARMReader: quantization is done here
+    FARMReader.convert_to_onnx(model_name=model_name, output_path=output_path)
+    if quantize:
+        fp32_path = output_path / 'model-fp32.onnx'
+        os.replace(output_path / 'model.onnx', fp32_path)
+        quantize_dynamic(str(fp32_path), str(output_path / 'model.onnx'),
+                         weight_type=QuantType.QInt8)
+    logger.info(f'ONNX reader exported to {output_dir} (quantized: {quantize})')
+
+
+def load_onnx_reader(model_dir: str = ONNX_READER_DIR, num_threads: int = ONNX_NUM_THREADS,
+                     **reader_params) -> FARMReader:
+    """Load the exported ONNX reader, running ONNX Runtime with num_threads threads"""
+    import onnxruntime
+
+    reader = FARMReader(model_name_or_path=model_dir, use_gpu=False, **reader_params)
+    if num_threads:
+        # Haystack creates the ONNX Runtime session using all the CPU cores:
+        # it is recreated with the configured number of threads
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        sess_options.intra_op_num_threads = num_threads
+        reader.inferencer.model.onnx_session = onnxruntime.InferenceSession(
+            f'{model_dir}/model.onnx', sess_options, providers=['CPUExecutionProvider'])
+    return reader
+
+
+def load_reader(backend: str = READER_BACKEND) -> FARMReader:
+    """Load the reader used in the web app, with the chosen backend ("pytorch" or "onnx")"""
+    if backend == 'onnx':
+        return load_onnx_reader(confidence_threshold=READER_CONFIG_THRESHOLD)
+    if backend != 'pytorch':
+        raise ValueError(f'Unknown reader backend: {backend}. Use "pytorch" or "onnx".')
+    return FARMReader(model_name_or_path=READER_MODEL,
+                      use_gpu=False,
+                      confidence_threshold=READER_CONFIG_THRESHOLD)
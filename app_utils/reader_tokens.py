@@ -0,0 +1,148 @@
+"""
+Pre-tokenized passages for the reader.
+
+FARMReader tokenizes the retrieved passages at every query (the corpus does not change
+between index builds). The indexing step saves the reader tokenization of every passage
+(token IDs, character offsets, word IDs) next to the index; at query time, a tokenizer proxy
+serves the passages from this cache, so that only the question is tokenized.
+The tokens are the same produced by the tokenizer, so the answers do not change.
+"""
+
+import hashlib
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from app_utils.config import INDEX_DIR, READER_MODEL
+
+logger = logging.getLogger(__name__)
+
+READER_TOKENS_FILE = 'reader_tokens.npz'
+
+
+def passage_key(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def build_reader_tokens(texts: List[str], path: str, model_name: str = READER_MODEL,
+                        tokenizer=None, batch_size: int = 256):
+    """Tokenize the passages as FARMReader does (fast tokenizer, no special tokens) and save them"""
+    if tokenizer is None:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+    texts = list(dict.fromkeys(texts))
+    ids, offsets, words, lengths = [], [], [], []
+    for i in range(0, len(texts), batch_size):
+        encoded = tokenizer.batch_encode_plus(texts[i:i + batch_size], return_offsets_mapping=True,
+                                              add_special_tokens=False, verbose=False)
+        for input_ids, offset_mapping, encoding in zip(encoded['input_ids'], encoded['offset_mapping'],
+                                                       encoded.encodings):
+            ids.extend(input_ids)
+            offsets.extend(offset_mapping)
+            words.extend(-1 if word is None else word for word in encoding.words)
+            lengths.append(len(input_ids))
+    np.savez(path, model_name=np.array(model_name),
+             keys=np.array([passage_key(text) for text in texts]),
+             starts=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+             ids=np.array(ids, dtype=np.int32),
+             offsets=np.array(offsets, dtype=np.int32).reshape(-1, 2),
+             words=np.array(words, dtype=np.int32))
+
+
+class _Encoding:
+    """The part of tokenizers.Encoding used by the Haystack QA processor"""
+
+    def __init__(self, words):
+        self.words = words
+
+
+class _BatchEncoding(dict):
+    def __init__(self, data, encodings):
+        super().__init__(data)
+        self.encodings = encodings
+
+
+class PassageTokenCache:
+    """Tokenized passages, looked up by text"""
+
+    def __init__(self, path: str):
+        with np.load(path) as npz:
+            self.model_name = str(npz['model_name'])
+            self.positions = {key: i for i, key in enumerate(npz['keys'].tolist())}
+            self.starts = npz['starts']
+            self.ids = npz['ids']
+            self.offsets = npz['offsets']
+            self.words = npz['words']
+        self.hits = self.misses = 0
+
+    @classmethod
+    def load(cls, index_dir: str = INDEX_DIR, model_name: str = READER_MODEL) -> Optional['PassageTokenCache']:
+        """Load the cache, if present and created with the tokenizer of the reader model"""
+        path = f'{index_dir}/{READER_TOKENS_FILE}'
+        if not os.path.exists(path):
+            logger.info(f'{path} not found: passages are tokenized at query time')
+            return None
+        cache = cls(path)
+        if cache.model_name != model_name:
+            logger.warning(f'{path} was created for {cache.model_name}: it is not used')
+            return None
+        return cache
+
+    def get(self, text: str):
+        """(input_ids, offset_mapping, words) of a passage, or None"""
+        i = self.positions.get(passage_key(text))
+        if i is None:
+            return None
+        start, end = self.starts[i], self.starts[i + 1]
+        return (self.ids[start:end].tolist(),
+                [tuple(offset) for offset in self.offsets[start:end].tolist()],
+                [None if word == -1 else word for word in self.words[start:end].tolist()])
+
+
+class CachedPassageTokenizer:
+    """
+    Tokenizer proxy: batch_encode_plus calls on passages (the ones made by the QA processor:
+    no special tokens, with offsets) are served from the cache; everything else goes to the tokenizer
+    """
+
+    def __init__(self, tokenizer, cache: PassageTokenCache):
+        self.tokenizer = tokenizer
+        self.cache = cache
+
+    def __getattr__(self, name):
+        if name == 'tokenizer':
+            # not set yet (e.g. while unpickling)
+            raise AttributeError(name)
+        return getattr(self.tokenizer, name)
+
+    def batch_encode_plus(self, texts, **kwargs):
+        if kwargs.get('add_special_tokens', True) or not kwargs.get('return_offsets_mapping') \
+                or any(kwargs.get(arg) for arg in ('truncation', 'padding', 'max_length', 'return_tensors')) \
+                or not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return self.tokenizer.batch_encode_plus(texts, **kwargs)
+        cached = [self.cache.get(text) for text in texts]
+        missing = [i for i, entry in enumerate(cached) if entry is None]
+        self.cache.hits += len(texts) - len(missing)
+        self.cache.misses += len(missing)
+        encodings = [None if entry is None else _Encoding(entry[2]) for entry in cached]
+        if missing:
+            encoded = self.tokenizer.batch_encode_plus([texts[i] for i in missing], **kwargs)
+            for j, i in enumerate(missing):
+                cached[i] = (encoded['input_ids'][j], encoded['offset_mapping'][j], None)
+                encodings[i] = encoded.encodings[j]
+        data = {'input_ids': [entry[0] for entry in cached],
+                'offset_mapping': [entry[1] for entry in cached],
+                'attention_mask': [[1] * len(entry[0]) for entry in cached]}
+        if kwargs.get('return_special_tokens_mask'):
+            data['special_tokens_mask'] = [[0] * len(entry[0]) for entry in cached]
+        return _BatchEncoding(data, encodings)
+
+
+def use_passage_token_cache(reader, cache: PassageTokenCache):
+    """Make the reader (FARMReader, PyTorch or ONNX) tokenize passages through the cache"""
+    processor = reader.inferencer.processor
+    if not isinstance(processor.tokenizer, CachedPassageTokenizer):
+        processor.tokenizer = CachedPassageTokenizer(processor.tokenizer, cache)
+    return reader
@@ -0,0 +1,198 @@
+"""
+Semantic answer cache.
+
+Answers are cached by question embedding: a new question reuses the answers
+of a past question if their embeddings are similar enough
+(e.g. "Who killed Laura?" and "who killed laura palmer").
+The cache has a bounded size (LRU eviction), entries expire after a TTL
+and are invalidated when the index changes.
+"""
+
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from haystack.nodes import EmbeddingRetriever
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and remove trailing punctuation"""
+    return re.sub(r'\s+', ' ', question.lower()).strip().rstrip('?!. ')
+
+
+class MemoizedEmbeddingRetriever(EmbeddingRetriever):
+    """
+    EmbeddingRetriever that remembers the embeddings of the last queries,
+    so that a question embedded for the cache lookup is not embedded again by the pipeline.
+    In a batch of queries, only the ones not seen recently are embedded (together).
+    """
+
+    memo_size = 64
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        if not hasattr(self, '_memo'):
+            self._memo = OrderedDict()
+            self._memo_lock = threading.Lock()
+        with self._memo_lock:
+            embeddings = [self._memo.get(query) for query in queries]
+            for query, embedding in zip(queries, embeddings):
+                if embedding is not None:
+                    self._memo.move_to_end(query)
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings)
+                                     if embedding is None))
+        if missing:
+            new_embeddings = dict(zip(missing, super().embed_queries(missing)))
+            embeddings = [new_embeddings[query] if embedding is None else embedding
+                          for query, embedding in zip(queries, embeddings)]
+            with self._memo_lock:
+                self._memo.update(new_embeddings)
+                while len(self._memo) > self.memo_size:
+                    self._memo.popitem(last=False)
+        return np.stack(embeddings)
+
+
+class SemanticCache:
+    """
+    Bounded cache of pipeline results, looked up by question embedding similarity.
+    Entries are also keyed by the query parameters (e.g. top_k values)
+    and by the version of the index used to compute them.
+    If path is set, the cache is saved to disk every persist_every new entries.
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 24 * 60 * 60,
+                 similarity_threshold: float = 0.95, index_version: str = None,
+                 path: str = None, persist_every: int = 20):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.index_version = index_version
+        self.path = path
+        self.persist_every = persist_every
+        # key: (normalized question, params key) -> (normalized embedding, results, creation time)
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = None
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self.hits = self.semantic_hits = self.misses = self.evictions = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as fin:
+                saved = pickle.load(fin)
+        except Exception as e:
+            logger.warning(f'Cannot load the answer cache from {self.path}: {e}')
+            return
+        if saved.get('index_version') != self.index_version:
+            logger.info('The index has changed: the saved answer cache is discarded')
+            return
+        self._entries = saved['entries']
+        self._expire()
+
+    def save(self):
+        """Save the cache to disk (atomically)"""
+        if not self.path:
+            return
+        with self._lock:
+            data = pickle.dumps({'index_version': self.index_version,
+                                 'entries': self._entries})
+            self._unsaved = 0
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as fout:
+            fout.write(data)
+        os.replace(tmp_path, self.path)
+
+    def invalidate(self, index_version: str = None):
+        """Remove all the entries (e.g. because the index has been rebuilt)"""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self.index_version = index_version
+
+    def check_index_version(self, index_version: str):
+        """Invalidate the cache if it was filled using a different index"""
+        if index_version != self.index_version:
+            self.invalidate(index_version)
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        now = time.time()
+        expired = [key for key, (_, _, created) in self._entries.items()
+                   if now - created > self.ttl]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _similar_key(self, embedding: np.ndarray, params_key):
+        """Most similar cached question with the same params, if above the threshold"""
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries)
+            self._matrix = np.vstack([entry[0] for entry in self._entries.values()]) \
+                if self._entries else np.empty((0, len(embedding)), dtype=np.float32)
+        if not self._matrix_keys:
+            return None
+        similarities = self._matrix @ embedding
+        for i in np.argsort(-similarities):
+            if similarities[i] < self.similarity_threshold:
+                return None
+            if self._matrix_keys[i][1] == params_key:
+                return self._matrix_keys[i]
+        return None
+
+    def lookup(self, question: str, embedding: np.ndarray, params_key=None):
+        """Return the cached results for the question (or a similar one), or None"""
+        key = (normalize_question(question), params_key)
+        with self._lock:
+            self._expire()
+            if key not in self._entries:
+                key = self._similar_key(_normalize(embedding), params_key)
+                if key is not None:
+                    self.semantic_hits += 1
+            if key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][1]
+
+    def store(self, question: str, embedding: np.ndarray, results, params_key=None):
+        """Add the results for a question, evicting the least recently used entries"""
+        key = (normalize_question(question), params_key)
+        with self._lock:
+            self._entries[key] = (_normalize(embedding), results, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+            self._unsaved += 1
+            save = self.path and self._unsaved >= self.persist_every
+        if save:
+            self.save()
+
+    def stats(self) -> dict:
+        """Hit-rate counters"""
+        lookups = self.hits + self.misses
+        return {'size': len(self._entries),
+                'hits': self.hits,
+                'semantic_hits': self.semantic_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0}
+
+
+def _normalize(embedding: np.ndarray) -> np.ndarray:
+    embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    return embedding / (np.linalg.norm(embedding) or 1.0)
@@ -0,0 +1,217 @@
+"""
+Sparse (BM25) retrieval, fused with dense retrieval.
+
+The BM25 inverted index is built from the same chunks of the FAISS document store
+and saved next to it as compact numpy arrays (postings sorted by term).
+HybridRetriever fuses BM25 and dense results with reciprocal rank fusion (RRF):
+rare proper nouns (e.g. "Glastonbury Grove") are found by BM25 even when the
+dense retriever misses them, so a smaller top_k can be sent to the reader.
+"""
+
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+from haystack import Document
+
+from app_utils.config import INDEX_DIR, HYBRID_RETRIEVAL_PARAMS
+from app_utils.semantic_cache import MemoizedEmbeddingRetriever
+
+logger = logging.getLogger(__name__)
+
+SPARSE_INDEX_FILE = 'bm25.npz'
+
+# common English words, not useful to match questions and passages
+STOPWORDS = set("""a an and are as at be but by did do does for from had has have he her his how i
+in is it its of on or she that the their them they this to was were what when where which who whom
+whose why will with you""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, without stopwords"""
+    return [token for token in re.findall(r'\w+', text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory BM25 index.
+    Postings of term i are postings_docs/postings_tfs[term_offsets[i]:term_offsets[i+1]].
+    """
+
+    def __init__(self, doc_ids: np.ndarray, doc_lengths: np.ndarray, vocabulary: List[str],
+                 term_offsets: np.ndarray, postings_docs: np.ndarray, postings_tfs: np.ndarray,
+                 k1: float = 1.2, b: float = 0.75):
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.term_index = {term: i for i, term in enumerate(vocabulary)}
+        self.term_offsets = term_offsets
+        self.postings_docs = postings_docs
+        self.postings_tfs = postings_tfs
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @classmethod
+    def build(cls, documents: List[Document], **bm25_params) -> 'BM25Index':
+        """Build the index from the chunks"""
+        term_postings = {}
+        doc_lengths = []
+        for doc_index, doc in enumerate(documents):
+            tokens = tokenize(doc.content)
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                term_postings.setdefault(term, []).append((doc_index, tf))
+        vocabulary = sorted(term_postings)
+        lengths = [len(term_postings[term]) for term in vocabulary]
+        postings = [posting for term in vocabulary for posting in term_postings[term]]
+        return cls(doc_ids=np.array([doc.id for doc in documents]),
+                   doc_lengths=np.array(doc_lengths, dtype=np.int32),
+                   vocabulary=vocabulary,
+                   term_offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+                   postings_docs=np.array([doc for doc, _ in postings], dtype=np.int32),
+                   postings_tfs=np.array([tf for _, tf in postings], dtype=np.uint16),
+                   **bm25_params)
+
+    def save(self, path: str):
+        vocabulary = sorted(self.term_index, key=self.term_index.get)
+        np.savez_compressed(path, doc_ids=self.doc_ids, doc_lengths=self.doc_lengths,
+                            vocabulary=np.array('\n'.join(vocabulary)),
+                            term_offsets=self.term_offsets, postings_docs=self.postings_docs,
+                            postings_tfs=self.postings_tfs)
+
+    @classmethod
+    def load(cls, path: str, **bm25_params) -> 'BM25Index':
+        with np.load(path) as npz:
+            vocabulary = str(npz['vocabulary'])
+            return cls(doc_ids=npz['doc_ids'], doc_lengths=npz['doc_lengths'],
+                       vocabulary=vocabulary.split('\n') if vocabulary else [],
+                       term_offsets=npz['term_offsets'], postings_docs=npz['postings_docs'],
+                       postings_tfs=npz['postings_tfs'], **bm25_params)
+
+    def search(self, query: str, top_k: int = 10):
+        """Return the (document ID, BM25 score) pairs of the best documents"""
+        scores = np.zeros(len(self.doc_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            i = self.term_index.get(term)
+            if i is None:
+                continue
+            start, end = self.term_offsets[i], self.term_offsets[i + 1]
+            docs = self.postings_docs[start:end]
+            tfs = self.postings_tfs[start:end].astype(np.float32)
+            idf = math.log(1 + (len(self.doc_ids) - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_length)
+            # every document appears once in the postings of a term
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(str(self.doc_ids[i]), float(scores[i])) for i in candidates]
+
+
+def build_sparse_index(documents: List[Document], path: str):
+    """Build the BM25 index of the chunks and save it"""
+    BM25Index.build(documents).save(path)
+
+
+def load_sparse_index(index_dir: str = INDEX_DIR) -> Optional[BM25Index]:
+    """Load the BM25 index saved next to the FAISS index (None if missing)"""
+    path = f'{index_dir}/{SPARSE_INDEX_FILE}'
+    if not os.path.exists(path):
+        logger.warning(f'{path} not found: only dense retrieval is used. '
+                       'Create it with: python -m scripts.build_index --derived-only')
+        return None
+    return BM25Index.load(path)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Fuse rankings of document IDs: score(d) = sum over rankings of 1 / (k + rank(d))"""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1 / (k + rank)
+    return [doc_id for doc_id, _ in scores.most_common()]
+
+
+class HybridRetriever(MemoizedEmbeddingRetriever):
+    """
+    EmbeddingRetriever whose results are fused with BM25 results (reciprocal rank fusion).
+    Both retrievers return `candidates` documents; the best top_k fused documents are returned.
+    Documents keep the dense retrieval score (computed from the FAISS index for the ones found only by BM25),
+    so that the thresholds of PassageGate and of the web app still apply.
+    If no sparse index is set, it works as the dense retriever.
+    """
+
+    def set_sparse_index(self, sparse_index: Optional[BM25Index], enabled: bool = HYBRID_RETRIEVAL_PARAMS['enabled'],
+                         candidates: int = HYBRID_RETRIEVAL_PARAMS['candidates'],
+                         rrf_k: int = HYBRID_RETRIEVAL_PARAMS['rrf_k']):
+        self.sparse_index = sparse_index
+        self.hybrid_enabled = enabled
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    def _dense_scores(self, query_emb: np.ndarray, documents: List[Document], document_store, scale_score: bool):
+        """Dense similarity of documents not retrieved by the dense retriever"""
+        faiss_index = document_store.faiss_indexes[document_store.index]
+        for doc in documents:
+            try:
+                embedding = faiss_index.reconstruct(int(doc.meta['vector_id']))
+            except (RuntimeError, KeyError, ValueError):
+                # index without reconstruction (e.g. IVF without direct map): PassageGate is bypassed
+                doc.score = None
+                continue
+            score = float(np.dot(query_emb, embedding))
+            doc.score = document_store.scale_to_unit_interval(score, document_store.similarity) \
+                if scale_score else score
+
+    def _fuse(self, query: str, query_emb: np.ndarray, dense_docs: List[Document], top_k: int,
+              document_store, scale_score: bool) -> List[Document]:
+        sparse_ids = [doc_id for doc_id, _ in self.sparse_index.search(query, self.candidates)]
+        fused_ids = reciprocal_rank_fusion([[doc.id for doc in dense_docs], sparse_ids], self.rrf_k)[:top_k]
+        docs_by_id = {doc.id: doc for doc in dense_docs}
+        sparse_only = [doc_id for doc_id in fused_ids if doc_id not in docs_by_id]
+        if sparse_only:
+            fetched = document_store.get_documents_by_id(sparse_only)
+            self._dense_scores(query_emb, fetched, document_store, scale_score)
+            docs_by_id.update((doc.id, doc) for doc in fetched)
+        return [docs_by_id[doc_id] for doc_id in fused_ids if doc_id in docs_by_id]
+
+    def _use_sparse(self, filters) -> bool:
+        # filters are only supported by the dense retriever
+        return getattr(self, 'hybrid_enabled', False) and self.sparse_index is not None and not filters
+
+    def retrieve(self, query: str, filters=None, top_k: Optional[int] = None, index: str = None,
+                 headers=None, scale_score: bool = None, document_store=None) -> List[Document]:
+        if not self._use_sparse(filters):
+            return super().retrieve(query=query, filters=filters, top_k=top_k, index=index,
+                                    headers=headers, scale_score=scale_score, document_store=document_store)
+        top_k = top_k or self.top_k
+        scale_score = self.scale_score if scale_score is None else scale_score
+        document_store = document_store or self.document_store
+        dense_docs = super().retrieve(query=query, filters=filters, top_k=max(top_k, self.candidates),
+                                      index=index, headers=headers, scale_score=scale_score,
+                                      document_store=document_store)
+        query_emb = self.embed_queries([query])[0]
+        return self._fuse(query, query_emb, dense_docs, top_k, document_store, scale_score)
+
+    def retrieve_batch(self, queries: List[str], filters=None, top_k: Optional[int] = None,
+                       index: str = None, headers=None, batch_size: Optional[int] = None,
+                       scale_score: bool = None, document_store=None) -> List[List[Document]]:
+        if not self._use_sparse(filters):
+            return super().retrieve_batch(queries=queries, filters=filters, top_k=top_k, index=index,
+                                          headers=headers, batch_size=batch_size,
+                                          scale_score=scale_score, document_store=document_store)
+        top_k = top_k or self.top_k
+        scale_score = self.scale_score if scale_score is None else scale_score
+        document_store = document_store or self.document_store
+        dense_docs = super().retrieve_batch(queries=queries, filters=filters, top_k=max(top_k, self.candidates),
+                                            index=index, headers=headers, batch_size=batch_size,
+                                            scale_score=scale_score, document_store=document_store)
+        # memoized: computed by the dense retrieval
+        query_embs = self.embed_queries(queries)
+        return [self._fuse(query, query_emb, docs, top_k, document_store, scale_score)
+                for query, query_emb, docs in zip(queries, query_embs, dense_docs)]
@@ -0,0 +1,149 @@
+"""
+Loading of the Question Answering pipeline, with a per-phase timing breakdown.
+
+In "fast" startup mode the pipeline is loaded in a background thread,
+so the web app can render while the models are loading;
+the index is opened in place (memory-mapped FAISS index, see indexing.read_faiss_index;
+read-only database).
+A warmup query is run before the pipeline is reported ready.
+"""
+
+import json
+import logging
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from haystack.document_stores import FAISSDocumentStore
+
+from app_utils.config import (INDEX_DIR, RETRIEVER_MODEL, RETRIEVER_MODEL_FORMAT,
+    STARTUP_MODE, WARMUP_QUERY, READY_FILE, PASSAGE_GATE_PARAMS, RETRIEVER_TOP_K, READER_TOP_K,
+    HYBRID_RETRIEVAL_PARAMS, READER_TOKEN_CACHE)
+from app_utils.indexing import configure_faiss_search, open_document_store
+from app_utils.metrics import instrument_pipeline
+from app_utils.passage_gate import PassageGate, GatedExtractiveQAPipeline
+from app_utils.reader_backends import load_reader
+from app_utils.reader_tokens import PassageTokenCache, use_passage_token_cache
+from app_utils.sparse_index import HybridRetriever, load_sparse_index
+
+logger = logging.getLogger(__name__)
+
+
+def pipeline_params(retriever_top_k: int = RETRIEVER_TOP_K, reader_top_k: int = READER_TOP_K) -> dict:
+    """Params of the pipeline nodes for a query"""
+    return {"Retriever": {"top_k": retriever_top_k},
+            "PassageGate": PASSAGE_GATE_PARAMS,
+            "Reader": {"top_k": reader_top_k}}
+
+
+def params_key(params: dict) -> str:
+    """
+    Key of the settings that determine the answers to a question, for the answer caches:
+    the params of the pipeline nodes and the hybrid retrieval settings (set on the retriever at load)
+    """
+    return json.dumps({**params, 'hybrid_retrieval': HYBRID_RETRIEVAL_PARAMS}, sort_keys=True)
+
+
+class PipelineLoader:
+    """
+    Load document store, retriever and reader and create the pipeline,
+    synchronously ("eager" mode) or in a background thread ("fast" mode).
+    """
+
+    def __init__(self, mode: str = STARTUP_MODE, index_dir: str = INDEX_DIR,
+                 warmup_query: str = WARMUP_QUERY, ready_file: str = READY_FILE):
+        if mode not in ('eager', 'fast'):
+            raise ValueError(f'Unknown startup mode: {mode}. Use "eager" or "fast".')
+        self.mode = mode
+        self.index_dir = index_dir
+        self.warmup_query = warmup_query
+        self.ready_file = ready_file
+        # phase -> seconds
+        self.timings = OrderedDict()
+        self._pipeline = None
+        self._error = None
+        self._ready = threading.Event()
+        if mode == 'fast':
+            threading.Thread(target=self._load, name='pipeline-loader', daemon=True).start()
+        else:
+            self._load()
+            if self._error is not None:
+                raise self._error
+
+    def _timed(self, phase: str, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.timings[phase] = time.perf_counter() - start
+        return result
+
+    def _open_document_store(self):
+        if self.mode == 'fast':
+            return open_document_store(self.index_dir, read_only=True)
+        # the config saved by the indexing notebook refers to the database in the working directory
+        shutil.copy(f'{self.index_dir}/faiss_document_store.db', '.')
+        document_store = FAISSDocumentStore(
+            faiss_index_path=f'{self.index_dir}/my_faiss_index.faiss',
+            faiss_config_path=f'{self.index_dir}/my_faiss_index.json')
+        # search parameters of approximate indexes (IVF/HNSW) come from the config
+        configure_faiss_search(document_store.faiss_indexes[document_store.index])
+        return document_store
+
+    def _load(self):
+        try:
+            start = time.perf_counter()
+            document_store = self._timed('document_store', self._open_document_store)
+            print(f'Index size: {document_store.get_document_count()}')
+
+            # the query embedding computed for the answer cache lookup is reused by the retriever
+            retriever = self._timed('retriever', HybridRetriever,
+                                    document_store=document_store,
+                                    embedding_model=RETRIEVER_MODEL,
+                                    model_format=RETRIEVER_MODEL_FORMAT)
+            # dense results are fused with BM25 results, if enabled
+            if HYBRID_RETRIEVAL_PARAMS['enabled']:
+                retriever.set_sparse_index(self._timed('sparse_index', load_sparse_index, self.index_dir),
+                                           **HYBRID_RETRIEVAL_PARAMS)
+
+            # PyTorch or quantized ONNX model, depending on READER_BACKEND
+            reader = self._timed('reader', load_reader)
+            # passages pre-tokenized at index time
+            if READER_TOKEN_CACHE:
+                token_cache = self._timed('reader_tokens', PassageTokenCache.load, self.index_dir)
+                if token_cache is not None:
+                    use_passage_token_cache(reader, token_cache)
+
+            # the gate decides how many retrieved passages are sent to the reader
+            gate = PassageGate(similarity=document_store.similarity)
+            pipeline = GatedExtractiveQAPipeline(reader, retriever, gate)
+
+            if self.warmup_query:
+                # the first run initializes lazy state (e.g. tokenizers, thread pools, index pages)
+                self._timed('warmup', pipeline.run, self.warmup_query, params=pipeline_params())
+            # stage timings for traces and metrics (after the warmup, not to record it)
+            instrument_pipeline(pipeline)
+            self.timings['total'] = time.perf_counter() - start
+            self._pipeline = pipeline
+        except Exception as e:
+            logger.exception('Cannot load the pipeline')
+            self._error = e
+        else:
+            print(f'Pipeline ready ({self.mode} startup). Timings (s): ' +
+                  ', '.join(f'{phase}={seconds:.2f}' for phase, seconds in self.timings.items()))
+            if self.ready_file:
+                with open(self.ready_file, 'w') as fout:
+                    fout.write(f'{time.time()}\n')
+        finally:
+            self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set() and self._error is None
+
+    def get(self, timeout: float = None):
+        """Return the pipeline, waiting until it is loaded"""
+        if not self._ready.wait(timeout):
+            raise TimeoutError('The pipeline is still loading')
+        if self._error is not None:
+            raise RuntimeError('The pipeline could not be loaded') from self._error
+        return self._pipeline
@@ -0,0 +1,71 @@
+"""
+Local HTTP stand-in for the wiki API, serving recorded responses.
+
+Responses are stored in a folder, one JSON file per request
+(named after a hash of the sorted query parameters).
+In record mode, missing responses are fetched from the real API and saved.
+
+Usage:
+    python replay_server.py --fixtures fixtures --record https://twinpeaks.fandom.com/api.php
+    python replay_server.py --fixtures fixtures
+    scrapy crawl tpcrawler -a api_url=http://localhost:8000/api.php -a output_dir=./test_output
+"""
+
+import argparse
+import hashlib
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from urllib.request import Request, urlopen
+
+
+def request_key(query):
+    """Key of a request: hash of its sorted query parameters"""
+    params = sorted(parse_qsl(query, keep_blank_values=True))
+    return hashlib.sha1(urlencode(params).encode('utf-8')).hexdigest()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    fixtures_dir = 'fixtures'
+    record_url = None
+
+    def do_GET(self):
+        query = urlsplit(self.path).query
+        fixture_path = os.path.join(self.fixtures_dir, f'{request_key(query)}.json')
+        if not os.path.exists(fixture_path) and self.record_url:
+            request = Request(f'{self.record_url}?{query}',
+                              headers={'User-Agent': 'tpcrawler replay_server'})
+            with urlopen(request) as response:
+                body = response.read()
+            os.makedirs(self.fixtures_dir, exist_ok=True)
+            with open(fixture_path, 'wb') as fout:
+                fout.write(body)
+        if not os.path.exists(fixture_path):
+            self.send_error(404, f'No recorded response for: {query}')
+            return
+        with open(fixture_path, 'rb') as fin:
+            body = fin.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixtures', default='fixtures', help='folder of recorded responses')
+    parser.add_argument('--record', help='real API URL, to record missing responses')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    ReplayHandler.fixtures_dir = args.fixtures
+    ReplayHandler.record_url = args.record
+    server = ThreadingHTTPServer(('localhost', args.port), ReplayHandler)
+    print(f'Serving recorded API responses on http://localhost:{args.port}/api.php')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
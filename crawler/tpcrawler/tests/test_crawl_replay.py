@@ -0,0 +1,207 @@
+"""
+Crawl the recorded API responses in tests/fixtures, served by replay_server.py,
+and check the corpus written by the pipeline.
+Run from crawler/tpcrawler: python -m pytest tests
+"""
+
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlencode
+
+from replay_server import ReplayHandler, request_key
+from tpcrawler.pipelines import INDEX_FILE, TpcrawlerPipeline, compact_corpus
+
+CRAWLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FIXTURES_DIR = os.path.join(CRAWLER_DIR, 'tests', 'fixtures')
+WIKI_URL = 'https://twinpeaks.fandom.com/wiki/'
+# second request of the page listing in the fixtures
+LISTING_CONTINUATION = {'action': 'query', 'format': 'json', 'formatversion': 2, 'list': 'allpages',
+                        'apnamespace': 0, 'apfilterredir': 'nonredirects', 'aplimit': 'max',
+                        'apcontinue': 'Laura_Palmer', 'continue': '-||'}
+
+
+def read_corpus(output_dir):
+    """Live pages of the corpus, by name"""
+    with open(os.path.join(output_dir, INDEX_FILE), encoding='utf-8') as fin:
+        index = json.load(fin)
+    pages = {}
+    for name, entry in index['pages'].items():
+        with open(os.path.join(output_dir, entry['shard']), 'rb') as fin:
+            fin.seek(entry['offset'])
+            lines = gzip.decompress(fin.read(entry['length'])).decode('utf-8').splitlines()
+        pages[name] = json.loads(lines[entry['line']])
+    return pages
+
+
+class CrawlReplayTest(unittest.TestCase):
+    fixtures_dir = FIXTURES_DIR
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        handler = type('Handler', (ReplayHandler,), {'fixtures_dir': self.fixtures_dir,
+                                                      'log_message': lambda *args: None})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.output_dir = os.path.join(self.tmp_dir, 'data')
+        self.state_path = os.path.join(self.tmp_dir, 'crawl_state.json')
+        self.changelog_path = os.path.join(self.tmp_dir, 'changelog.jsonl')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def crawl(self, *args):
+        """Run the spider (args: additional command line arguments, e.g. "-a", "full=1")"""
+        api_url = f'http://127.0.0.1:{self.server.server_address[1]}/api.php'
+        subprocess.run([sys.executable, '-m', 'scrapy', 'crawl', 'tpcrawler',
+                        '-a', f'api_url={api_url}', '-a', f'wiki_url={WIKI_URL}',
+                        '-a', f'output_dir={self.output_dir}', '-a', f'state_path={self.state_path}',
+                        '-a', f'changelog_path={self.changelog_path}',
+                        '-s', 'AUTOTHROTTLE_ENABLED=False', '-s', 'LOG_LEVEL=CRITICAL', *args],
+                       cwd=CRAWLER_DIR, check=True)
+        with open(self.changelog_path, encoding='utf-8') as fin:
+            return json.loads(fin.readlines()[-1])
+
+    def test_crawl(self):
+        changes = self.crawl()
+        pages = read_corpus(self.output_dir)
+        # "Sheryl Lee" is in an excluded category (Actors)
+        self.assertEqual(set(pages), {'%27Tis_Pity_She%27s_a_Whore',
+                                      '17_Pieces_of_Pie:_Shooting_at_the_Mar_T_(aka_RR)_Diner',
+                                      'Laura_Palmer'})
+        for name, page in pages.items():
+            self.assertEqual(page['name'], name)
+            self.assertEqual(page['url'], WIKI_URL + name)
+        self.assertEqual(pages['Laura_Palmer']['text'],
+                         'Laura Palmer\nLaura Palmer was a high school student.\n'
+                         'Biography\nShe was the daughter of Leland and Sarah Palmer.')
+        # images, references and sections after "Appearances"/"References" are removed
+        self.assertEqual(pages['%27Tis_Pity_She%27s_a_Whore']['text'],
+                         "'Tis Pity She's a Whore\n'Tis Pity She's a Whore is a play by John Ford.\n"
+                         "In Fire Walk with Me, Laura Palmer mentions the play.")
+        self.assertEqual(pages['17_Pieces_of_Pie:_Shooting_at_the_Mar_T_(aka_RR)_Diner']['text'],
+                         '17 Pieces of Pie: Shooting at the Mar T (aka RR) Diner\n'
+                         '17 Pieces of Pie: Shooting at the Mar T (aka RR) Diner is a book about the Double R Diner.')
+        self.assertEqual(sorted(changes['added']), sorted(pages))
+        self.assertEqual(changes['deleted'], [])
+
+        # nothing changed: nothing is downloaded again
+        changes = self.crawl()
+        self.assertEqual((changes['added'], changes['modified'], changes['deleted']), ([], [], []))
+        self.assertEqual(set(read_corpus(self.output_dir)), set(pages))
+
+    def add_known_page(self, name):
+        """Add to the crawl state a page that is no longer in the wiki"""
+        with open(self.state_path, encoding='utf-8') as fin:
+            state = json.load(fin)
+        state['999'] = {'name': name, 'revid': 1, 'excluded': False}
+        with open(self.state_path, 'w', encoding='utf-8') as fout:
+            json.dump(state, fout)
+
+    def modify_pages(self):
+        """Make all the pages look modified since the last crawl (they are downloaded in the same batch)"""
+        with open(self.state_path, encoding='utf-8') as fin:
+            state = json.load(fin)
+        for page in state.values():
+            page['revid'] -= 1
+        with open(self.state_path, 'w', encoding='utf-8') as fout:
+            json.dump(state, fout)
+
+    def dead_bytes(self):
+        pipeline = TpcrawlerPipeline(buffer_size=200, shard_max_bytes=2**20)
+        pipeline.open_corpus(self.output_dir)
+        return pipeline.dead_bytes()
+
+    def test_deleted_page(self):
+        self.crawl()
+        self.add_known_page('Removed_page')
+        changes = self.crawl()
+        self.assertEqual(changes['deleted'], ['Removed_page'])
+
+    def break_listing(self):
+        """Make the continuation of the page listing unavailable"""
+        fixtures_dir = os.path.join(self.tmp_dir, 'fixtures')
+        shutil.copytree(self.fixtures_dir, fixtures_dir)
+        os.remove(os.path.join(fixtures_dir, f"{request_key(urlencode(LISTING_CONTINUATION))}.json"))
+        self.server.RequestHandlerClass.fixtures_dir = fixtures_dir
+
+    def shard_files(self):
+        return sorted(file_name for file_name in os.listdir(self.output_dir) if file_name.endswith('.jsonl.gz'))
+
+    def test_incomplete_listing(self):
+        """If a part of the page listing fails, no page is deleted"""
+        self.crawl()
+        self.add_known_page('Removed_page')
+        self.break_listing()
+        changes = self.crawl()
+        self.assertEqual(changes['deleted'], [])
+        self.assertEqual(len(read_corpus(self.output_dir)), 3)
+        with open(self.state_path, encoding='utf-8') as fin:
+            self.assertIn('999', json.load(fin))
+
+    def test_full_crawl(self):
+        """A full crawl writes new shards and deletes the previous ones"""
+        self.crawl()
+        pages = read_corpus(self.output_dir)
+        self.assertEqual(self.shard_files(), ['corpus-00000.jsonl.gz'])
+        changes = self.crawl('-a', 'full=1')
+        self.assertEqual(sorted(changes['added']), sorted(pages))
+        self.assertEqual(self.shard_files(), ['corpus-00001.jsonl.gz'])
+        self.assertEqual(read_corpus(self.output_dir), pages)
+
+    def test_incomplete_full_crawl(self):
+        """A full crawl with an incomplete page listing keeps the previous corpus and crawl state"""
+        self.crawl()
+        pages = read_corpus(self.output_dir)
+        with open(self.state_path, encoding='utf-8') as fin:
+            state = json.load(fin)
+        self.break_listing()
+        self.crawl('-a', 'full=1')
+        self.assertEqual(self.shard_files(), ['corpus-00000.jsonl.gz'])
+        self.assertEqual(read_corpus(self.output_dir), pages)
+        with open(self.state_path, encoding='utf-8') as fin:
+            self.assertEqual(json.load(fin), state)
+
+    def test_compaction(self):
+        """Superseded versions are dropped when they exceed CORPUS_COMPACTION_DEAD_RATIO"""
+        self.crawl()
+        pages = read_corpus(self.output_dir)
+        self.modify_pages()
+        changes = self.crawl('-s', 'CORPUS_COMPACTION_DEAD_RATIO=0.9')
+        self.assertEqual(sorted(changes['modified']), sorted(pages))
+        # half of the records are superseded
+        self.assertGreater(self.dead_bytes(), 0)
+        self.assertEqual(self.shard_files(), ['corpus-00000.jsonl.gz'])
+
+        self.modify_pages()
+        self.crawl('-s', 'CORPUS_COMPACTION_DEAD_RATIO=0.5')
+        self.assertEqual(self.dead_bytes(), 0)
+        self.assertEqual(self.shard_files(), ['corpus-00001.jsonl.gz'])
+        self.assertEqual(read_corpus(self.output_dir), pages)
+        with gzip.open(os.path.join(self.output_dir, 'corpus-00001.jsonl.gz'), 'rt', encoding='utf-8') as fin:
+            self.assertEqual(len(fin.readlines()), len(pages))
+
+    def test_compact_corpus(self):
+        self.crawl()
+        pages = read_corpus(self.output_dir)
+        self.add_known_page('Removed_page')
+        self.modify_pages()
+        self.crawl('-s', 'CORPUS_COMPACTION_DEAD_RATIO=0.9')
+        self.assertGreater(self.dead_bytes(), 0)
+        compact_corpus(self.output_dir)
+        self.assertEqual(self.dead_bytes(), 0)
+        self.assertEqual(self.shard_files(), ['corpus-00001.jsonl.gz'])
+        self.assertEqual(read_corpus(self.output_dir), pages)
+
+
+if __name__ == '__main__':
+    unittest.main()
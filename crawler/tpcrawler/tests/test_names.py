@@ -0,0 +1,43 @@
+"""
+Page names of the crawler must not change: names and URLs identify the pages in the
+index (manifest, chunk IDs) and in the links of the web app.
+Run from crawler/tpcrawler: python -m pytest tests
+"""
+
+import json
+import os
+import unittest
+
+from tpcrawler.spiders.tpcrawler import title_to_name, WIKI_URL, WIKI
+
+INPUT_DOCS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'data', 'input_docs')
+
+
+class TitleToNameTest(unittest.TestCase):
+    def test_examples(self):
+        self.assertEqual(title_to_name("'Tis Pity She's a Whore"), '%27Tis_Pity_She%27s_a_Whore')
+        self.assertEqual(title_to_name('17 Pieces of Pie: Shooting at the Mar T (aka RR) Diner'),
+                         '17_Pieces_of_Pie:_Shooting_at_the_Mar_T_(aka_RR)_Diner')
+        self.assertEqual(title_to_name('"Diane..." - The Twin Peaks Tapes of Agent Cooper'),
+                         '%22Diane...%22_-_The_Twin_Peaks_Tapes_of_Agent_Cooper')
+
+    @unittest.skipUnless(os.path.isdir(INPUT_DOCS_DIR), 'data/input_docs not available')
+    def test_existing_corpus_names(self):
+        """The names and URLs of the pages in data/input_docs are reproduced from their titles"""
+        checked = 0
+        for file_name in sorted(os.listdir(INPUT_DOCS_DIR)):
+            if not file_name.endswith('.json'):
+                continue
+            with open(os.path.join(INPUT_DOCS_DIR, file_name), encoding='utf-8') as fin:
+                page = json.load(fin)
+            # the text starts with the page title
+            title = page['text'].split('\n')[0]
+            name = title_to_name(title)
+            self.assertEqual(name, page['name'], title)
+            self.assertEqual(WIKI_URL.format(wiki=WIKI) + name, page['url'], title)
+            checked += 1
+        self.assertGreater(checked, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,10 @@ import scrapy
 
 
 class TpcrawlerItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    """A wiki page (or the deletion of a page, if deleted is True)"""
+    name = scrapy.Field()
+    url = scrapy.Field()
+    text = scrapy.Field()
+    pageid = scrapy.Field()
+    revid = scrapy.Field()
+    deleted = scrapy.Field()
@@ -3,11 +3,211 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import argparse
+import gzip
+import json
+import os
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy import signals
+
+INDEX_FILE = 'corpus_index.json'
+SHARD_PATTERN = 'corpus-{:05d}.jsonl.gz'
 
 
 class TpcrawlerPipeline:
+    """
+    Append pages to a corpus of sharded, gzip-compressed JSONL files.
+
+    Items are buffered and every flush appends a gzip member to the current shard
+    (a new shard is started when CORPUS_SHARD_MAX_BYTES is exceeded).
+    The offset index (corpus_index.json) maps every live page to the
+    shard, byte offset and length of its gzip member and to its line in the member;
+    newer versions of a page supersede older ones and deletions remove the page from the index.
+
+    A full crawl writes a new set of shards: the offset index is swapped, and the previous shards
+    deleted, only when the crawl finishes with a complete page listing (otherwise the new shards
+    are deleted and the previous corpus is kept).
+    The superseded versions and deletions stay in the shards until a compaction rewrites the live pages
+    in new shards, in the same way: after a crawl, when their (uncompressed) size exceeds
+    CORPUS_COMPACTION_DEAD_RATIO of the records written, or with compact_corpus.
+    """
+
+    def __init__(self, buffer_size, shard_max_bytes, compaction_dead_ratio=None):
+        self.buffer_size = buffer_size
+        self.shard_max_bytes = shard_max_bytes
+        self.compaction_dead_ratio = compaction_dead_ratio
+        self.buffer = []
+        # shards of the corpus being replaced (None: the records are appended to the current corpus)
+        self.replaced_shards = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls(buffer_size=crawler.settings.getint('CORPUS_BUFFER_SIZE', 200),
+                       shard_max_bytes=crawler.settings.getint('CORPUS_SHARD_MAX_BYTES', 32 * 2**20),
+                       compaction_dead_ratio=crawler.settings.getfloat('CORPUS_COMPACTION_DEAD_RATIO', 0.5))
+        # the close reason is only known to the spider_closed signal (sent after close_spider)
+        crawler.signals.connect(pipeline.spider_closed, signal=signals.spider_closed)
+        return pipeline
+
+    def open_corpus(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.index_path = os.path.join(self.output_dir, INDEX_FILE)
+        # bytes: uncompressed size of all the records written to the shards
+        self.index = {'shards': [], 'pages': {}, 'bytes': 0}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as fin:
+                self.index = json.load(fin)
+
+    def open_spider(self, spider):
+        self.open_corpus(spider.output_dir)
+        if spider.full_crawl:
+            self.start_rewrite()
+
+    def start_rewrite(self):
+        """Write a new corpus, in new shards, next to the current one (see finish_rewrite)"""
+        self.replaced_shards = self.index['shards']
+        self.index = {'shards': [], 'pages': {}, 'bytes': 0}
+
+    def finish_rewrite(self):
+        """Swap the offset index of the new corpus, then delete the shards of the previous one"""
+        self.save_index()
+        for shard in set(self.replaced_shards) - set(self.index['shards']):
+            if os.path.exists(os.path.join(self.output_dir, shard)):
+                os.remove(os.path.join(self.output_dir, shard))
+        self.replaced_shards = None
+
+    def abort_rewrite(self):
+        """Delete the shards of the new corpus and keep the previous one"""
+        for shard in self.index['shards']:
+            if os.path.exists(os.path.join(self.output_dir, shard)):
+                os.remove(os.path.join(self.output_dir, shard))
+        self.buffer = []
+        self.replaced_shards = None
+        self.open_corpus(self.output_dir)
+
     def process_item(self, item, spider):
+        self.buffer.append(ItemAdapter(item).asdict())
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
         return item
+
+    def current_shard(self):
+        """Name of the shard to append to (a new one if the last is full)"""
+        shards = self.index['shards']
+        if not shards or os.path.getsize(os.path.join(self.output_dir, shards[-1])) >= self.shard_max_bytes:
+            # the shards of a corpus being replaced are still in use
+            taken = set(shards) | set(self.replaced_shards or [])
+            number = len(shards)
+            while SHARD_PATTERN.format(number) in taken \
+                    or os.path.exists(os.path.join(self.output_dir, SHARD_PATTERN.format(number))):
+                number += 1
+            shards.append(SHARD_PATTERN.format(number))
+        return shards[-1]
+
+    def flush(self):
+        """Append the buffered records as a gzip member and update the offset index"""
+        if not self.buffer:
+            return
+        shard = self.current_shard()
+        shard_path = os.path.join(self.output_dir, shard)
+        lines = [(json.dumps(record) + '\n').encode('utf-8') for record in self.buffer]
+        data = gzip.compress(b''.join(lines))
+        with open(shard_path, 'ab') as fout:
+            offset = fout.tell()
+            fout.write(data)
+
+        pages = self.index['pages']
+        for line, record in enumerate(self.buffer):
+            if record.get('deleted'):
+                pages.pop(record['name'], None)
+            else:
+                pages[record['name']] = {'shard': shard, 'offset': offset, 'length': len(data),
+                    'line': line, 'size': len(lines[line]), 'pageid': record['pageid'], 'revid': record['revid']}
+        # indexes written before the sizes were tracked count only the new records
+        self.index['bytes'] = self.index.get('bytes', 0) + sum(len(line) for line in lines)
+        self.buffer = []
+        if self.replaced_shards is None:
+            self.save_index()
+
+    def save_index(self):
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fout:
+            json.dump(self.index, fout)
+        os.replace(tmp_path, self.index_path)
+
+    def dead_bytes(self):
+        """Uncompressed size of the superseded versions and deletions in the shards"""
+        return self.index.get('bytes', 0) - sum(entry.get('size', 0) for entry in self.index['pages'].values())
+
+    def compact(self):
+        """Rewrite the live pages in new shards, swap the offset index and delete the previous shards"""
+        shard_order = {shard: i for i, shard in enumerate(self.index['shards'])}
+        # live lines of every gzip member, so that each member is decompressed once
+        members = {}
+        for entry in self.index['pages'].values():
+            members.setdefault((entry['shard'], entry['offset'], entry['length']), []).append(entry['line'])
+        self.start_rewrite()
+        try:
+            for shard, offset, length in sorted(members, key=lambda member: (shard_order[member[0]], member[1])):
+                with open(os.path.join(self.output_dir, shard), 'rb') as fin:
+                    fin.seek(offset)
+                    lines = gzip.decompress(fin.read(length)).decode('utf-8').split('\n')
+                for line in sorted(members[(shard, offset, length)]):
+                    self.buffer.append(json.loads(lines[line]))
+                    if len(self.buffer) >= self.buffer_size:
+                        self.flush()
+            self.flush()
+        except Exception:
+            self.abort_rewrite()
+            raise
+        self.finish_rewrite()
+
+    def close_spider(self, spider):
+        self.flush()
+        if self.replaced_shards is None:
+            # also when nothing changed (e.g. first crawl of an empty wiki)
+            self.save_index()
+            dead_bytes = self.dead_bytes()
+            if self.compaction_dead_ratio is not None and dead_bytes > 0 \
+                    and dead_bytes > self.compaction_dead_ratio * self.index['bytes']:
+                spider.logger.info(f'Compacting the corpus ({dead_bytes} bytes of superseded records)')
+                self.compact()
+
+    def spider_closed(self, spider, reason):
+        if self.replaced_shards is None:
+            return
+        if reason == 'finished' and spider.listing_complete:
+            self.finish_rewrite()
+        else:
+            spider.logger.error(f'Full crawl not completed ({reason}): the previous corpus is kept')
+            self.abort_rewrite()
+
+
+def compact_corpus(output_dir, buffer_size=200, shard_max_bytes=32 * 2**20):
+    """Rewrite the live pages of a corpus in new shards (see TpcrawlerPipeline.compact)"""
+    pipeline = TpcrawlerPipeline(buffer_size=buffer_size, shard_max_bytes=shard_max_bytes)
+    pipeline.open_corpus(output_dir)
+    pipeline.compact()
+
+
+def shards_size(output_dir):
+    with open(os.path.join(output_dir, INDEX_FILE), encoding='utf-8') as fin:
+        shards = json.load(fin)['shards']
+    return sum(os.path.getsize(os.path.join(output_dir, shard)) for shard in shards)
+
+
+def main():
+    """Compact the corpus written by the crawler: python -m tpcrawler.pipelines --output-dir ./data"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--output-dir', default='./data', help='folder of the corpus')
+    args = parser.parse_args()
+    size = shards_size(args.output_dir)
+    compact_corpus(args.output_dir)
+    print(f'Shards: {size} -> {shards_size(args.output_dir)} bytes')
+
+
+if __name__ == '__main__':
+    main()
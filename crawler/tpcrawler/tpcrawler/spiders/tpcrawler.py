@@ -1,8 +1,15 @@
 import scrapy
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
 from scrapy.http import TextResponse
 import re
-import fandom
 import json
+import os
+import time
+from urllib.parse import urlencode, urlparse, quote
+import mwparserfromhell
+
+from tpcrawler.items import TpcrawlerItem
 
 # Categories unrelated to Twin Peaks plot
 # (they make noise in the index)
@@ -31,54 +38,250 @@ Decades
 Days
 Production timeline""".split("\n"))
 
-fandom.set_wiki("Twinpeaks")
+WIKI = 'twinpeaks'
+API_URL = 'https://{wiki}.fandom.com/api.php'
+WIKI_URL = 'https://{wiki}.fandom.com/wiki/'
+
+# wiki links and tags whose content is not plain text
+excluded_link_namespaces = {'file', 'image', 'category'}
+excluded_tags = {'table', 'ref', 'gallery'}
+
+
+def title_to_name(title):
+    """
+    Page name as in the wiki URLs (e.g. "'Tis Pity She's a Whore" -> "%27Tis_Pity_She%27s_a_Whore"),
+    encoded as MediaWiki does (wfUrlencode), so that the names of the pages crawled from the HTML
+    pages (e.g. "17_Pieces_of_Pie:_Shooting_at_the_Mar_T_(aka_RR)_Diner") do not change
+    """
+    return quote(title.replace(" ", "_"), safe=";:@$!*(),/~")
 
-article_id_pattern = "wgArticleId\"\:([0-9]+)"
-categories_xpath = "//div[@class='page-header__categories']/a//text()"
-wiki_page_href_xpath = "//ul[@class='mw-allpages-chunk']/li/a[not(contains(@class, 'redirect'))]/@href"
-next_page_href_xpath = "//div[@class='mw-allpages-nav']/a[contains(.,'Next page')]/@href"
+
+def wikitext_to_text(title, wikitext):
+    """
+    Convert the wikitext of a page to plain text
+    (excluding templates, images, tables and references), preceded by the title.
+    """
+    wikicode = mwparserfromhell.parse(wikitext)
+    to_remove = [link for link in wikicode.filter_wikilinks()
+                 if str(link.title).split(':')[0].strip().lower() in excluded_link_namespaces]
+    to_remove += [tag for tag in wikicode.filter_tags()
+                  if str(tag.tag).strip().lower() in excluded_tags]
+    for node in to_remove:
+        try:
+            wikicode.remove(node)
+        except ValueError:
+            # already removed together with its parent
+            pass
+    text = wikicode.strip_code(normalize=True, collapse=True)
+    text = re.sub(r'[ \t]+', ' ', text)
+    text = re.sub(r'\s*\n\s*', '\n', text).strip()
+    return f'{title}\n{text}'
 
 
 class Tpcrawler(scrapy.Spider):
+    """
+    Crawl the wiki through the MediaWiki API.
+    Page IDs are listed with list=allpages; then text (wikitext of the last revision)
+    and categories are requested in batches of many page IDs per call.
+    All the calls are regular Scrapy requests, so they run concurrently
+    according to the concurrency and autothrottle settings.
+
+    Pages are yielded as TpcrawlerItem and written by TpcrawlerPipeline
+    (sharded, compressed JSONL corpus).
+
+    The crawl is incremental: the state file keeps article ID and latest revision ID
+    of every page, so only pages whose revision changed since the last run are downloaded
+    and written; deleted pages are removed from the corpus. Every run appends a record
+    (added, modified and deleted pages) to the change log.
+
+    Spider arguments (-a name=value): wiki (fandom wiki to crawl, e.g. "harrypotter"; default: Twin Peaks),
+    api_url, wiki_url (to crawl a local stand-in of the API, see replay_server.py),
+    output_dir, state_path, changelog_path, full (=1 to download everything).
+    Crawling another wiki, output, state and change log default to per-wiki paths
+    (./data/<wiki>, ./crawl_state_<wiki>.json, ./changelog_<wiki>.jsonl).
+    """
     name = 'tpcrawler'
-    allowed_domains = ['https://twinpeaks.fandom.com/']
-    start_urls = ['https://twinpeaks.fandom.com/wiki/Special:AllPages']
-
-    
-    def parse(self, response):
-        """Start from wiki "all pages" list and open them"""
-        hrefs = response.xpath(wiki_page_href_xpath).extract()
-        for href in hrefs:
-            yield scrapy.Request(url=response.urljoin(href),
-                callback=self.parse_page, dont_filter=True,
-                meta={'name':href.rpartition('/')[-1],
-                'url':response.urljoin(href)})
-
-        next_page =  response.xpath(next_page_href_xpath).extract_first()
-        if next_page:
-            yield scrapy.Request(url=response.urljoin(next_page),
-                callback=self.parse, dont_filter=True)
-
-    def parse_page(self, response: TextResponse):
+
+    def __init__(self, wiki=WIKI, api_url=None, wiki_url=None, output_dir=None,
+                 state_path=None, changelog_path=None, full=False, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wiki = wiki
+        # the Twin Peaks wiki keeps the original paths
+        suffix = '' if wiki == WIKI else f'_{wiki}'
+        output_dir = output_dir or ('./data' if wiki == WIKI else f'./data/{wiki}')
+        state_path = state_path or f'./crawl_state{suffix}.json'
+        changelog_path = changelog_path or f'./changelog{suffix}.jsonl'
+        self.api_url = api_url or API_URL.format(wiki=wiki)
+        self.wiki_url = wiki_url or WIKI_URL.format(wiki=wiki)
+        # the excluded categories are the ones of the Twin Peaks wiki
+        self.excluded_categories = excluded_categories if wiki == WIKI else set()
+        self.output_dir = output_dir
+        self.allowed_domains = [urlparse(self.api_url).hostname]
+        self.state_path = state_path
+        self.changelog_path = changelog_path
+        # state: page ID -> {'name', 'revid', 'excluded'}
+        self.state = {}
+        self.full_crawl = full not in (False, '0', 'false', 'False')
+        if os.path.exists(state_path) and not self.full_crawl:
+            with open(state_path, encoding='utf-8') as fin:
+                self.state = {int(page_id): page for page_id, page in json.load(fin).items()}
+        self.listed_ids = set()
+        self.listing_complete = False
+        self.deletions_checked = False
+        self.changes = {'added': [], 'modified': [], 'deleted': []}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    def api_request(self, params, callback, meta=None, errback=None):
+        """Request to the MediaWiki query API"""
+        params = {'action': 'query', 'format': 'json', 'formatversion': 2, **params}
+        # API calls were made by fandom-py, outside of Scrapy robots.txt handling
+        return scrapy.Request(url=f'{self.api_url}?{urlencode(params)}',
+            callback=callback, errback=errback, dont_filter=True,
+            meta={'dont_obey_robotstxt': True, **(meta or {})})
+
+    def start_requests(self):
+        """Start from wiki "all pages" list (redirects excluded)"""
+        yield self.api_request({'list': 'allpages', 'apnamespace': 0,
+            'apfilterredir': 'nonredirects', 'aplimit': 'max'},
+            callback=self.parse, errback=self.listing_failed)
+
+    def parse(self, response: TextResponse):
+        """Collect page IDs and request their latest revision IDs, in batches"""
+        data = json.loads(response.text)
+        page_ids = [page['pageid'] for page in data['query']['allpages']]
+        self.listed_ids.update(page_ids)
+        batch_size = self.settings.getint('API_BATCH_SIZE', 50)
+        for i in range(0, len(page_ids), batch_size):
+            yield self.api_request({'pageids': '|'.join(str(page_id) for page_id in page_ids[i:i+batch_size]),
+                'prop': 'info'}, callback=self.parse_revisions)
+
+        if 'continue' in data:
+            yield self.api_request({'list': 'allpages', 'apnamespace': 0,
+                'apfilterredir': 'nonredirects', 'aplimit': 'max',
+                **data['continue']}, callback=self.parse, errback=self.listing_failed)
+        else:
+            self.listing_complete = True
+
+    def listing_failed(self, failure):
+        """A part of the list of pages is missing: no page can be considered deleted in this run"""
+        self.logger.error(f'Listing of the pages failed ({failure.value!r}): deleted pages are not removed')
+
+    def parse_revisions(self, response: TextResponse):
+        """Request the content of the pages whose revision changed since the last crawl"""
+        data = json.loads(response.text)
+        changed_ids = []
+        for page in data['query']['pages']:
+            known = self.state.get(page['pageid'])
+            if known is None or known['revid'] != page.get('lastrevid'):
+                changed_ids.append(page['pageid'])
+        if changed_ids:
+            yield self.pages_request(changed_ids)
+
+    def pages_request(self, page_ids, continue_params=None, pages=None):
+        """Request text, revision ID and (visible) categories of a batch of pages"""
+        params = {'pageids': '|'.join(str(page_id) for page_id in page_ids),
+            'prop': 'categories|revisions', 'rvprop': 'ids|content', 'rvslots': 'main',
+            'cllimit': 'max', 'clshow': '!hidden', **(continue_params or {})}
+        return self.api_request(params, callback=self.parse_pages,
+            meta={'page_ids': page_ids, 'pages': pages if pages is not None else {}})
+
+    def parse_pages(self, response: TextResponse):
+        """
+        Collect text and categories of a batch of pages.
+        Large batches can be split by the API in several responses (continue parameters):
+        partial results are accumulated until the batch is complete.
+        """
+        data = json.loads(response.text)
+        pages = response.meta['pages']
+        for page in data['query']['pages']:
+            collected = pages.setdefault(page['pageid'],
+                {'title': page['title'], 'categories': set(), 'wikitext': None, 'revid': None})
+            collected['categories'].update(category['title'].partition(':')[2]
+                for category in page.get('categories', []))
+            if page.get('revisions'):
+                collected['revid'] = page['revisions'][0]['revid']
+                collected['wikitext'] = page['revisions'][0]['slots']['main']['content']
+
+        if 'continue' in data:
+            yield self.pages_request(response.meta['page_ids'], data['continue'], pages)
+            return
+
+        for page_id, page in pages.items():
+            if page['wikitext'] is None:
+                continue
+            # the wiki page is interesting only if related to plot
+            # (= not contained in excluded categories)
+            excluded = bool(page['categories'] & self.excluded_categories)
+            yield from self.update_page(page_id, page, excluded)
+
+    def update_page(self, page_id, page, excluded):
+        """Yield a new or modified page (or its deletion, if excluded) and update the state"""
+        name = title_to_name(page['title'])
+        known = self.state.get(page_id)
+        if known and not known['excluded'] and (excluded or known['name'] != name):
+            # the page is now excluded or has been renamed
+            yield self.deleted_item(page_id, known['name'])
+        if not excluded:
+            yield self.page_item(page_id, page)
+            if known and not known['excluded']:
+                self.changes['modified'].append(name)
+            else:
+                self.changes['added'].append(name)
+        elif known and not known['excluded']:
+            self.changes['deleted'].append(known['name'])
+        self.state[page_id] = {'name': name, 'revid': page['revid'], 'excluded': excluded}
+
+    def page_item(self, page_id, page):
+        """Item with the plain text of the page"""
+        name = title_to_name(page['title'])
+        # trailing newline: the sections are cut also when their heading is the last line
+        text = wikitext_to_text(page['title'], page['wikitext']) + '\n'
+        text = text.split('\nAppearances\n')[0]\
+            .split('\nReferences\n')[0].rstrip('\n')
+        return TpcrawlerItem(name=name, url=self.wiki_url + name, text=text,
+            pageid=page_id, revid=page['revid'], deleted=False)
+
+    def deleted_item(self, page_id, name):
+        return TpcrawlerItem(name=name, pageid=page_id, deleted=True)
+
+    def spider_idle(self):
         """
-        Collect all interesting pages IDs
-        and use the Fandom API to crawl them.
-        Save the output in JSON format.
+        When all the pages have been crawled, check for deleted pages.
+        Deletions can only be detected if the list of pages is complete.
         """
+        if self.listing_complete and not self.deletions_checked:
+            self.deletions_checked = True
+            # local request, only to yield the deletion items from a callback
+            self.crawler.engine.crawl(scrapy.Request('data:,', callback=self.parse_deletions,
+                dont_filter=True, meta={'dont_obey_robotstxt': True}))
+            raise DontCloseSpider
+
+    def parse_deletions(self, response):
+        """Yield the deletion of the pages no longer in the wiki"""
+        for page_id in set(self.state) - self.listed_ids:
+            known = self.state.pop(page_id)
+            if not known['excluded']:
+                self.changes['deleted'].append(known['name'])
+                yield self.deleted_item(page_id, known['name'])
+
+    def closed(self, reason):
+        """Save the state and append to the change log"""
+        if self.full_crawl and not (reason == 'finished' and self.listing_complete):
+            # the pipeline keeps the previous corpus: keep its state
+            self.logger.error('Full crawl not completed: the crawl state is not saved')
+        else:
+            tmp_path = f'{self.state_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as fout:
+                json.dump(self.state, fout)
+            os.replace(tmp_path, self.state_path)
 
-        categories = set(response.xpath(categories_xpath).extract())
-        
-        # the wiki page is interesting only if related to plot
-        # (= not contained in excluded categories)
-        if len(categories.intersection(excluded_categories))==0:
-            name = response.meta['name']
-            url = response.meta['url']
-            article_id = int(re.findall(article_id_pattern, response.text)[0])
-
-            # once the ID is found, use the Fandom API to retrieve the clean page text
-            page = fandom.page(pageid = article_id)            
-            text = page.plain_text.split('\nAppearances\n')[0]\
-                .split('\nReferences\n')[0]
-            json_content={'name': name, 'url':url, 'text':text}
-            with open(f'./data/{name}.json','w', encoding='utf-8') as fout:
-                json.dump(json_content, fout)
\ No newline at end of file
+        with open(self.changelog_path, 'a', encoding='utf-8') as fout:
+            fout.write(json.dumps({'time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+                'reason': reason, **self.changes}) + '\n')
+        self.logger.info(f"Added: {len(self.changes['added'])}, modified: {len(self.changes['modified'])}, "
+            f"deleted: {len(self.changes['deleted'])}")
@@ -0,0 +1,102 @@
+"""
+Compare dense-only and hybrid (dense + BM25, reciprocal rank fusion) retrieval.
+
+For every top_k, the script reports the page-level recall@k (a retrieved passage
+comes from the page the generated question was created from) and the retrieval latency.
+With --reader, the reader latency on the retrieved passages is measured too,
+to see how much a smaller fused top_k saves.
+Questions: a sample of data/questions/generated_questions.txt.
+
+Usage (from the repository root):
+    python -m scripts.build_index --derived-only  # if data/index/bm25.npz is missing
+    python -m scripts.benchmark_hybrid --top-k 3 5 10 --num-questions 300 --output hybrid_benchmark.json
+"""
+
+import argparse
+import json
+import time
+from urllib.parse import unquote
+
+import numpy as np
+
+from app_utils.config import (INDEX_DIR, RETRIEVER_MODEL, RETRIEVER_MODEL_FORMAT,
+    RETRIEVER_TOP_K, READER_TOP_K, HYBRID_RETRIEVAL_PARAMS)
+from app_utils.indexing import open_document_store
+from app_utils.questions import read_generated_questions_with_pages
+from app_utils.reader_backends import load_reader
+from app_utils.sparse_index import HybridRetriever, load_sparse_index
+
+
+def page_title(doc) -> str:
+    return unquote(doc.meta['name']).replace('_', ' ')
+
+
+def evaluate(retriever, reader, questions, top_k: int, hybrid: bool):
+    """Recall@k and latency of a retrieval mode"""
+    retriever.hybrid_enabled = hybrid
+    hits, retrieval_times, reader_times = [], [], []
+    for question, title in questions:
+        start = time.perf_counter()
+        documents = retriever.retrieve(question, top_k=top_k)
+        retrieval_times.append(time.perf_counter() - start)
+        hits.append(any(page_title(doc) == title for doc in documents))
+        if reader is not None:
+            start = time.perf_counter()
+            reader.predict(query=question, documents=documents, top_k=READER_TOP_K)
+            reader_times.append(time.perf_counter() - start)
+    result = {'mode': 'hybrid' if hybrid else 'dense',
+              'top_k': top_k,
+              'recall': round(float(np.mean(hits)), 4),
+              'retrieval_p50_ms': round(float(np.percentile(retrieval_times, 50)) * 1000, 2),
+              'retrieval_p95_ms': round(float(np.percentile(retrieval_times, 95)) * 1000, 2)}
+    if reader_times:
+        result['reader_p50_ms'] = round(float(np.percentile(reader_times, 50)) * 1000, 2)
+        result['reader_p95_ms'] = round(float(np.percentile(reader_times, 95)) * 1000, 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top-k', type=int, nargs='+', default=[3, 5, RETRIEVER_TOP_K],
+                        help='number of passages retrieved (sent to the reader)')
+    parser.add_argument('--num-questions', type=int, default=300,
+                        help='number of generated questions')
+    parser.add_argument('--candidates', type=int, default=HYBRID_RETRIEVAL_PARAMS['candidates'],
+                        help='passages retrieved by each retriever before fusion')
+    parser.add_argument('--rrf-k', type=int, default=HYBRID_RETRIEVAL_PARAMS['rrf_k'])
+    parser.add_argument('--reader', action='store_true', help='also measure the reader latency')
+    parser.add_argument('--output', default='hybrid_benchmark.json',
+                        help='JSON file where the results are saved')
+    args = parser.parse_args()
+
+    sparse_index = load_sparse_index(INDEX_DIR)
+    if sparse_index is None:
+        raise SystemExit('The BM25 index is missing')
+    retriever = HybridRetriever(document_store=open_document_store(INDEX_DIR),
+                                embedding_model=RETRIEVER_MODEL,
+                                model_format=RETRIEVER_MODEL_FORMAT)
+    retriever.set_sparse_index(sparse_index, enabled=True, candidates=args.candidates, rrf_k=args.rrf_k)
+    reader = load_reader() if args.reader else None
+    questions = read_generated_questions_with_pages(sample_size=args.num_questions)
+    # warmup
+    for question, _ in questions[:3]:
+        retriever.retrieve(question)
+
+    results = []
+    for top_k in args.top_k:
+        for hybrid in (False, True):
+            result = evaluate(retriever, reader, questions, top_k, hybrid)
+            print(json.dumps(result))
+            results.append(result)
+
+    with open(args.output, 'w') as fout:
+        json.dump({'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+                   'num_questions': len(questions),
+                   'candidates': args.candidates,
+                   'rrf_k': args.rrf_k,
+                   'results': results}, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Compare FAISS index types (flat, IVF, HNSW, product quantization) on the corpus embeddings.
+
+For every index type, the script reports recall@k against the exact (flat) index,
+query latency (one query at a time, as in the web app), index memory and build time.
+Queries are a sample of data/questions/generated_questions.txt.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_index --factories Flat HNSW32 IVF64,Flat IVF64,PQ64 --output results.json
+"""
+
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+from haystack.nodes import EmbeddingRetriever
+
+from app_utils.config import (INDEX_DIR, RETRIEVER_MODEL, RETRIEVER_MODEL_FORMAT,
+    RETRIEVER_TOP_K, FAISS_NPROBE, FAISS_EF_SEARCH)
+from app_utils.indexing import EMBEDDINGS_FILE, FAISS_INDEX_FILE, configure_faiss_search
+from app_utils.questions import read_generated_questions
+
+
+def load_corpus_embeddings(index_dir: str):
+    """Exact corpus embeddings: saved by the index build or reconstructed from a flat index"""
+    embeddings_path = f'{index_dir}/{EMBEDDINGS_FILE}'
+    if os.path.exists(embeddings_path):
+        with np.load(embeddings_path) as npz:
+            return npz['embeddings'].astype(np.float32)
+    index = faiss.read_index(f'{index_dir}/{FAISS_INDEX_FILE}')
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def benchmark_factory(factory: str, corpus: np.ndarray, queries: np.ndarray,
+                      exact_ids: np.ndarray, top_k: int, nprobe: int, ef_search: int):
+    """Build an index with the given factory string and measure it"""
+    start = time.perf_counter()
+    index = faiss.index_factory(corpus.shape[1], factory, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(corpus)
+    index.add(corpus)
+    build_time = time.perf_counter() - start
+    configure_faiss_search(index, nprobe=nprobe, ef_search=ef_search)
+
+    latencies, found_ids = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), top_k)
+        latencies.append(time.perf_counter() - start)
+        found_ids.append(ids[0])
+    recall = np.mean([len(set(found) & set(exact)) / top_k
+                      for found, exact in zip(found_ids, exact_ids)])
+    latencies_ms = np.array(latencies) * 1000
+    return {'factory': factory,
+            f'recall@{top_k}': round(float(recall), 4),
+            'latency_p50_ms': round(float(np.percentile(latencies_ms, 50)), 3),
+            'latency_p95_ms': round(float(np.percentile(latencies_ms, 95)), 3),
+            'latency_p99_ms': round(float(np.percentile(latencies_ms, 99)), 3),
+            'memory_mb': round(faiss.serialize_index(index).nbytes / 2**20, 2),
+            'build_s': round(build_time, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-dir', default=INDEX_DIR)
+    parser.add_argument('--factories', nargs='+',
+                        default=['Flat', 'HNSW32', 'IVF64,Flat', 'IVF64,PQ64'],
+                        help='FAISS index factory strings to compare')
+    parser.add_argument('--top-k', type=int, default=RETRIEVER_TOP_K)
+    parser.add_argument('--nprobe', type=int, default=FAISS_NPROBE)
+    parser.add_argument('--ef-search', type=int, default=FAISS_EF_SEARCH)
+    parser.add_argument('--num-questions', type=int, default=1000,
+                        help='number of generated questions used as queries')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    args = parser.parse_args()
+
+    corpus = load_corpus_embeddings(args.index_dir)
+    questions = read_generated_questions(sample_size=args.num_questions)
+    retriever = EmbeddingRetriever(embedding_model=RETRIEVER_MODEL,
+                                   model_format=RETRIEVER_MODEL_FORMAT,
+                                   use_gpu=False, progress_bar=False)
+    queries = np.asarray(retriever.embed_queries(questions), dtype=np.float32)
+    print(f'{corpus.shape[0]} vectors, {len(questions)} queries')
+
+    # ground truth: exact maximum inner product search
+    exact_index = faiss.IndexFlatIP(corpus.shape[1])
+    exact_index.add(corpus)
+    _, exact_ids = exact_index.search(queries, args.top_k)
+
+    results = []
+    for factory in args.factories:
+        result = benchmark_factory(factory, corpus, queries, exact_ids,
+                                   args.top_k, args.nprobe, args.ef_search)
+        print(json.dumps(result))
+        results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump({'num_vectors': int(corpus.shape[0]), 'num_queries': len(questions),
+                       'top_k': args.top_k, 'nprobe': args.nprobe,
+                       'ef_search': args.ef_search, 'results': results}, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
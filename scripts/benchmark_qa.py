@@ -0,0 +1,163 @@
+"""
+Headless benchmark of the Question Answering pipeline used by the web app.
+
+The pipeline loaded by the web app is run step by step, timing separately:
+query embedding, FAISS search, SQL document fetch and reader.
+For every (retriever top_k, reader top_k) setting, the script reports
+p50/p95/p99 latency of each stage and the throughput.
+Questions: data/questions/selected_questions.txt and a sample of generated_questions.txt.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_qa --settings 10:5 5:3 20:5 --output qa_benchmark.json
+    python -m scripts.benchmark_qa --compare qa_benchmark_before.json --output qa_benchmark.json
+"""
+
+import argparse
+import json
+import subprocess
+import time
+
+import numpy as np
+
+from app_utils.backend_utils import get_pipeline
+from app_utils.config import (RETRIEVER_TOP_K, READER_TOP_K, RETRIEVER_MODEL,
+    READER_MODEL, FAISS_INDEX_FACTORY, PASSAGE_GATE_PARAMS)
+from app_utils.questions import read_selected_questions, read_generated_questions
+
+STAGES = ['embedding', 'faiss_search', 'document_fetch', 'reader', 'total']
+
+pipe = get_pipeline()
+
+
+def latency_summary(seconds):
+    """Latency percentiles in milliseconds"""
+    ms = np.array(seconds) * 1000
+    return {'mean_ms': round(float(ms.mean()), 2),
+            'p50_ms': round(float(np.percentile(ms, 50)), 2),
+            'p95_ms': round(float(np.percentile(ms, 95)), 2),
+            'p99_ms': round(float(np.percentile(ms, 99)), 2)}
+
+
+def run_stages(question: str, retriever_top_k: int, reader_top_k: int):
+    """
+    Run the pipeline steps for a question (like EmbeddingRetriever and FARMReader do),
+    returning the duration of each stage and the prediction
+    """
+    retriever = pipe.get_node('Retriever')
+    reader = pipe.get_node('Reader')
+    document_store = retriever.document_store
+    timings = {}
+
+    start = time.perf_counter()
+    query_emb = np.asarray(retriever.embed_queries([question]), dtype=np.float32)
+    timings['embedding'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    faiss_index = document_store.faiss_indexes[document_store.index]
+    scores, vector_ids = faiss_index.search(query_emb, retriever_top_k)
+    timings['faiss_search'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores_by_vector_id = {str(vector_id): score for vector_id, score
+                           in zip(vector_ids[0], scores[0]) if vector_id != -1}
+    documents = document_store.get_documents_by_vector_ids(list(scores_by_vector_id))
+    for doc in documents:
+        doc.score = document_store.scale_to_unit_interval(
+            scores_by_vector_id[doc.meta['vector_id']], document_store.similarity)
+    documents.sort(key=lambda doc: doc.score, reverse=True)
+    timings['document_fetch'] = time.perf_counter() - start
+
+    # passages selected by the PassageGate node (all of them, if the gate is disabled)
+    documents = pipe.get_node('PassageGate').select(documents, **PASSAGE_GATE_PARAMS)
+    start = time.perf_counter()
+    prediction = reader.predict(query=question, documents=documents, top_k=reader_top_k) \
+        if documents else {'answers': []}
+    timings['reader'] = time.perf_counter() - start
+
+    timings['total'] = sum(timings.values())
+    return timings, prediction
+
+
+def benchmark_setting(questions, retriever_top_k: int, reader_top_k: int):
+    """Run all the questions with one top_k setting"""
+    durations = {stage: [] for stage in STAGES}
+    start = time.perf_counter()
+    for question in questions:
+        timings, _ = run_stages(question, retriever_top_k, reader_top_k)
+        for stage, duration in timings.items():
+            durations[stage].append(duration)
+    wall_time = time.perf_counter() - start
+    return {'retriever_top_k': retriever_top_k,
+            'reader_top_k': reader_top_k,
+            'num_questions': len(questions),
+            'throughput_qps': round(len(questions) / wall_time, 3),
+            'stages': {stage: latency_summary(durations[stage]) for stage in STAGES}}
+
+
+def print_comparison(results, previous):
+    """Print p50/p95 differences with respect to a previous run"""
+    previous_by_setting = {(r['retriever_top_k'], r['reader_top_k']): r
+                           for r in previous['results']}
+    for result in results:
+        key = (result['retriever_top_k'], result['reader_top_k'])
+        if key not in previous_by_setting:
+            continue
+        before = previous_by_setting[key]
+        print(f'--- top_k {key[0]}/{key[1]} vs previous run')
+        for stage in STAGES:
+            now, old = result['stages'][stage], before['stages'][stage]
+            print(f"{stage:>15}: p50 {old['p50_ms']:.1f} -> {now['p50_ms']:.1f} ms, "
+                  f"p95 {old['p95_ms']:.1f} -> {now['p95_ms']:.1f} ms")
+        print(f"{'throughput':>15}: {before['throughput_qps']} -> {result['throughput_qps']} q/s")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--settings', nargs='+', default=[f'{RETRIEVER_TOP_K}:{READER_TOP_K}'],
+                        help='top_k settings to measure, as RETRIEVER_TOP_K:READER_TOP_K')
+    parser.add_argument('--num-generated', type=int, default=100,
+                        help='number of generated questions added to the selected ones')
+    parser.add_argument('--warmup', type=int, default=3,
+                        help='number of questions run before measuring')
+    parser.add_argument('--output', default='qa_benchmark.json',
+                        help='JSON file where the results are saved')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    args = parser.parse_args()
+
+    questions = read_selected_questions() + read_generated_questions(sample_size=args.num_generated)
+    for question in questions[:args.warmup]:
+        run_stages(question, RETRIEVER_TOP_K, READER_TOP_K)
+
+    results = []
+    for setting in args.settings:
+        retriever_top_k, reader_top_k = (int(value) for value in setting.split(':'))
+        result = benchmark_setting(questions, retriever_top_k, reader_top_k)
+        print(json.dumps(result))
+        results.append(result)
+
+    report = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+              'git_commit': git_commit(),
+              'config': {'retriever_model': RETRIEVER_MODEL,
+                         'reader_model': READER_MODEL,
+                         'faiss_index_factory': FAISS_INDEX_FACTORY,
+                         'passage_gate': PASSAGE_GATE_PARAMS},
+              'results': results}
+    with open(args.output, 'w') as fout:
+        json.dump(report, fout, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fin:
+            print_comparison(results, json.load(fin))
+
+
+if __name__ == '__main__':
+    main()
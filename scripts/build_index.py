@@ -0,0 +1,60 @@
+"""
+Build or incrementally update the FAISS index from the crawled wiki pages.
+
+Usage (from the repository root):
+    python -m scripts.build_index [--full] [--dedup] [--input-dir data/input_docs] [--index-dir data/index]
+    python -m scripts.build_index --corpus harrypotter  # corpus configured in CORPORA (app_utils/config.py)
+    python -m scripts.build_index --derived-only  # only BM25 index, passage store and reader tokens, from the existing document store
+"""
+
+import argparse
+import logging
+
+from app_utils.config import DEDUP_PARAMS, DEFAULT_CORPUS, CHUNKING_WORKERS
+from app_utils.corpora import corpus_paths
+from app_utils.indexing import build_index, build_derived_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS,
+                        help='name of the corpus (its folders are the defaults of --input-dir and --index-dir)')
+    parser.add_argument('--input-dir',
+                        help='folder containing the corpus downloaded by the crawler')
+    parser.add_argument('--index-dir',
+                        help='folder where the index is saved')
+    parser.add_argument('--full', action='store_true',
+                        help='ignore the manifest and re-embed all the chunks')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='number of chunks embedded at once')
+    parser.add_argument('--use-gpu', action='store_true')
+    parser.add_argument('--workers', type=int, default=CHUNKING_WORKERS,
+                        help='processes splitting the pages in chunks (default: one per CPU core)')
+    parser.add_argument('--dedup', dest='dedup', action='store_true',
+                        help='index only one chunk of every group of near-duplicates')
+    parser.add_argument('--no-dedup', dest='dedup', action='store_false',
+                        help='index all the chunks')
+    parser.set_defaults(dedup=DEDUP_PARAMS['enabled'])
+    parser.add_argument('--derived-only', action='store_true',
+                        help='only build the BM25 index (hybrid retrieval), the memory-mapped passage store '
+                             'and the reader tokens from the existing document store')
+    args = parser.parse_args()
+    paths = corpus_paths(args.corpus)
+    args.input_dir = args.input_dir or paths['input_docs_dir']
+    args.index_dir = args.index_dir or paths['index_dir']
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.derived_only:
+        print(f'BM25 index, passage store and reader tokens built: {build_derived_files(args.index_dir)} chunks')
+        return
+    stats = build_index(input_dir=args.input_dir, index_dir=args.index_dir,
+                        full_rebuild=args.full, batch_size=args.batch_size,
+                        use_gpu=args.use_gpu, dedup=args.dedup,
+                        workers=args.workers)
+    for key, value in sorted(stats.items()):
+        print(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    main()
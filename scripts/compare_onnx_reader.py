@@ -0,0 +1,91 @@
+"""
+Compare the PyTorch reader with the (quantized) ONNX reader.
+
+The same retrieved passages are given to both readers: the script reports
+how often the answers agree (top answer, answer sets, low relevance alert)
+and the speedup of the ONNX reader.
+
+Usage (from the repository root):
+    python -m scripts.compare_onnx_reader [--num-generated 50] [--threads 4]
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+from haystack.nodes import EmbeddingRetriever
+
+from app_utils.config import (INDEX_DIR, RETRIEVER_MODEL, RETRIEVER_MODEL_FORMAT,
+    RETRIEVER_TOP_K, READER_TOP_K, READER_CONFIG_THRESHOLD, LOW_RELEVANCE_THRESHOLD,
+    ONNX_READER_DIR, ONNX_NUM_THREADS)
+from app_utils.indexing import open_document_store
+from app_utils.questions import read_selected_questions, read_generated_questions
+from app_utils.reader_backends import load_reader, load_onnx_reader
+
+
+def timed_predict(reader, question, documents):
+    start = time.perf_counter()
+    prediction = reader.predict(query=question, documents=documents, top_k=READER_TOP_K)
+    return prediction['answers'], time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--onnx-dir', default=ONNX_READER_DIR)
+    parser.add_argument('--threads', type=int, default=ONNX_NUM_THREADS,
+                        help='ONNX Runtime threads')
+    parser.add_argument('--num-generated', type=int, default=50,
+                        help='number of generated questions added to the selected ones')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    args = parser.parse_args()
+
+    questions = read_selected_questions() + read_generated_questions(sample_size=args.num_generated)
+    retriever = EmbeddingRetriever(document_store=open_document_store(INDEX_DIR),
+                                   embedding_model=RETRIEVER_MODEL,
+                                   model_format=RETRIEVER_MODEL_FORMAT,
+                                   use_gpu=False, progress_bar=False)
+    pytorch_reader = load_reader('pytorch')
+    onnx_reader = load_onnx_reader(args.onnx_dir, args.threads,
+                                   confidence_threshold=READER_CONFIG_THRESHOLD)
+
+    same_top, same_sets, same_alert, score_diffs = 0, 0, 0, []
+    pytorch_times, onnx_times = [], []
+    for i, question in enumerate(questions):
+        documents = retriever.retrieve(question, top_k=RETRIEVER_TOP_K)
+        pytorch_answers, pytorch_time = timed_predict(pytorch_reader, question, documents)
+        onnx_answers, onnx_time = timed_predict(onnx_reader, question, documents)
+        if i == 0:
+            # warmup
+            continue
+        pytorch_times.append(pytorch_time)
+        onnx_times.append(onnx_time)
+
+        pytorch_texts = [answer.answer for answer in pytorch_answers]
+        onnx_texts = [answer.answer for answer in onnx_answers]
+        same_top += pytorch_texts[:1] == onnx_texts[:1]
+        same_sets += set(pytorch_texts) == set(onnx_texts)
+        # the web app alerts the user if an answer has low relevance
+        same_alert += (any(a.score < LOW_RELEVANCE_THRESHOLD for a in pytorch_answers) ==
+                       any(a.score < LOW_RELEVANCE_THRESHOLD for a in onnx_answers))
+        if pytorch_answers and onnx_answers and pytorch_texts[0] == onnx_texts[0]:
+            score_diffs.append(abs(pytorch_answers[0].score - onnx_answers[0].score))
+
+    n = len(pytorch_times)
+    results = {'num_questions': n,
+               'top_answer_agreement': round(same_top / n, 3),
+               'answer_set_agreement': round(same_sets / n, 3),
+               'low_relevance_alert_agreement': round(same_alert / n, 3),
+               'mean_top_score_diff': round(float(np.mean(score_diffs)), 4) if score_diffs else None,
+               'pytorch_mean_ms': round(float(np.mean(pytorch_times)) * 1000, 1),
+               'onnx_mean_ms': round(float(np.mean(onnx_times)) * 1000, 1),
+               'speedup': round(float(np.mean(pytorch_times) / np.mean(onnx_times)), 2)}
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Evaluate near-duplicate removal (MinHash/LSH) on the current index, before enabling it.
+
+For every threshold, the chunks of the document store are grouped in near-duplicates:
+the script reports how much smaller the index gets (chunks, FAISS vectors size)
+and, on selected and generated questions, how many of the retrieved passages are
+duplicates of a passage ranked higher, i.e. reader work that deduplication saves.
+With --reader, the reader also runs on all the retrieved passages and on the distinct ones
+(reader time and agreement of the top answer).
+
+Usage (from the repository root):
+    python -m scripts.evaluate_dedup [--thresholds 0.7 0.8 0.9] [--num-generated 100] [--reader]
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+from haystack.nodes import EmbeddingRetriever
+
+from app_utils.config import (INDEX_DIR, RETRIEVER_MODEL, RETRIEVER_MODEL_FORMAT,
+    RETRIEVER_TOP_K, READER_TOP_K, EMBEDDING_DIM, DEDUP_PARAMS)
+from app_utils.dedup import find_near_duplicates
+from app_utils.indexing import open_document_store
+from app_utils.questions import read_selected_questions, read_generated_questions
+from app_utils.reader_backends import load_reader
+
+
+def top_answer(prediction):
+    return prediction['answers'][0].answer if prediction['answers'] else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-dir', default=INDEX_DIR)
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.7, DEDUP_PARAMS['threshold'], 0.9])
+    parser.add_argument('--num-generated', type=int, default=100,
+                        help='number of generated questions added to the selected ones')
+    parser.add_argument('--reader', action='store_true',
+                        help='also run the reader on all and on the distinct retrieved passages')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    args = parser.parse_args()
+
+    document_store = open_document_store(args.index_dir, read_only=True)
+    chunks = document_store.get_all_documents(return_embedding=False)
+    if any('sources' in chunk.meta for chunk in chunks):
+        print('Warning: the index is already deduplicated; build it with --no-dedup to evaluate the thresholds')
+    questions = read_selected_questions() + read_generated_questions(sample_size=args.num_generated)
+    retriever = EmbeddingRetriever(document_store=document_store,
+                                   embedding_model=RETRIEVER_MODEL,
+                                   model_format=RETRIEVER_MODEL_FORMAT,
+                                   use_gpu=False, progress_bar=False)
+    retrieved = [retriever.retrieve(question, top_k=RETRIEVER_TOP_K) for question in questions]
+    reader = load_reader() if args.reader else None
+    if reader is not None and questions:
+        # warmup
+        reader.predict(query=questions[0], documents=retrieved[0], top_k=READER_TOP_K)
+
+    results = []
+    for threshold in args.thresholds:
+        start = time.perf_counter()
+        groups = find_near_duplicates(chunks, threshold=threshold, num_perm=DEDUP_PARAMS['num_perm'],
+                                      bands=DEDUP_PARAMS['bands'], shingle_size=DEDUP_PARAMS['shingle_size'])
+        seconds = time.perf_counter() - start
+        group_of = {chunks[i].id: g for g, group in enumerate(groups) for i in group}
+        removed = sum(len(group) - 1 for group in groups)
+
+        passages, redundant, distinct_by_question = 0, 0, []
+        for documents in retrieved:
+            seen, distinct = set(), []
+            for doc in documents:
+                key = group_of.get(doc.id, doc.id)
+                if key in seen:
+                    redundant += 1
+                else:
+                    seen.add(key)
+                    distinct.append(doc)
+            passages += len(documents)
+            distinct_by_question.append(distinct)
+        result = {'threshold': threshold,
+                  'dedup_seconds': round(seconds, 1),
+                  'chunks': len(chunks),
+                  'chunks_removed': removed,
+                  'index_reduction': round(removed / len(chunks), 3),
+                  'faiss_vectors_mb_saved': round(removed * EMBEDDING_DIM * 4 / 2 ** 20, 1),
+                  'groups': len(groups),
+                  'largest_group': max((len(group) for group in groups), default=0),
+                  'questions': len(questions),
+                  'redundant_passages_per_question': round(redundant / len(questions), 2),
+                  'reader_passages_saved': round(redundant / passages, 3)}
+
+        if reader is not None:
+            all_times, distinct_times, same_top = [], [], 0
+            for question, documents, distinct in zip(questions, retrieved, distinct_by_question):
+                start = time.perf_counter()
+                prediction = reader.predict(query=question, documents=documents, top_k=READER_TOP_K)
+                all_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                distinct_prediction = reader.predict(query=question, documents=distinct, top_k=READER_TOP_K)
+                distinct_times.append(time.perf_counter() - start)
+                same_top += top_answer(prediction) == top_answer(distinct_prediction)
+            result.update({'reader_ms_all': round(float(np.mean(all_times)) * 1000, 1),
+                           'reader_ms_distinct': round(float(np.mean(distinct_times)) * 1000, 1),
+                           'top_answer_agreement': round(same_top / len(questions), 3)})
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Evaluate settings of the PassageGate (adaptive reader depth).
+
+For every question, passages are retrieved once; the reader then runs on all of them
+(baseline) and on the passages selected by each gate setting.
+The script reports passages read, reader time, how often the reader is skipped
+and how often the top answer is the same as the baseline.
+
+Usage (from the repository root):
+    python -m scripts.evaluate_passage_gate
+    python -m scripts.evaluate_passage_gate --settings '{"score_gap": 3}' '{"score_mass": 0.95, "min_similarity": 15}'
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+from haystack.nodes import EmbeddingRetriever
+
+from app_utils.config import (INDEX_DIR, RETRIEVER_MODEL, RETRIEVER_MODEL_FORMAT,
+    RETRIEVER_TOP_K, READER_TOP_K)
+from app_utils.indexing import open_document_store
+from app_utils.passage_gate import PassageGate
+from app_utils.questions import read_selected_questions, read_generated_questions
+from app_utils.reader_backends import load_reader
+
+DEFAULT_SETTINGS = [
+    {"score_mass": 0.999},
+    {"score_mass": 0.99},
+    {"score_mass": 0.95},
+    {"score_gap": 2.0},
+    {"score_gap": 4.0},
+    {"score_mass": 0.99, "min_similarity": 15.0},
+]
+
+
+def top_answer(answers):
+    return answers[0].answer if answers else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--settings', nargs='+', type=json.loads, default=DEFAULT_SETTINGS,
+                        help='gate settings (JSON objects with PassageGate params)')
+    parser.add_argument('--num-generated', type=int, default=0,
+                        help='number of generated questions added to the selected ones')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    args = parser.parse_args()
+
+    questions = read_selected_questions()
+    if args.num_generated:
+        questions += read_generated_questions(sample_size=args.num_generated)
+    document_store = open_document_store(INDEX_DIR)
+    retriever = EmbeddingRetriever(document_store=document_store,
+                                   embedding_model=RETRIEVER_MODEL,
+                                   model_format=RETRIEVER_MODEL_FORMAT,
+                                   use_gpu=False, progress_bar=False)
+    reader = load_reader()
+    gate = PassageGate(similarity=document_store.similarity, enabled=True)
+
+    def read(question, documents):
+        start = time.perf_counter()
+        answers = reader.predict(query=question, documents=documents, top_k=READER_TOP_K)['answers'] \
+            if documents else []
+        return answers, time.perf_counter() - start
+
+    retrieved = [(question, retriever.retrieve(question, top_k=RETRIEVER_TOP_K)) for question in questions]
+    read(*retrieved[0])  # warmup
+    baseline = [read(question, documents) for question, documents in retrieved]
+
+    results = [{'setting': 'baseline',
+                'mean_passages_read': float(np.mean([len(docs) for _, docs in retrieved])),
+                'mean_reader_ms': round(float(np.mean([t for _, t in baseline])) * 1000, 1),
+                'reader_skipped': 0.0,
+                'top_answer_agreement': 1.0}]
+    for setting in args.settings:
+        passages, times, skipped, agreement = [], [], 0, 0
+        for (question, documents), (baseline_answers, _) in zip(retrieved, baseline):
+            selected = gate.select(documents, **setting)
+            answers, duration = read(question, selected)
+            passages.append(len(selected))
+            times.append(duration)
+            skipped += not selected
+            agreement += top_answer(answers) == top_answer(baseline_answers)
+        results.append({'setting': setting,
+                        'mean_passages_read': round(float(np.mean(passages)), 2),
+                        'mean_reader_ms': round(float(np.mean(times)) * 1000, 1),
+                        'reader_skipped': round(skipped / len(questions), 3),
+                        'top_answer_agreement': round(agreement / len(questions), 3)})
+
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Export the reader model to ONNX, with int8 dynamic quantization.
+To use it in the web app, set READER_BACKEND = "onnx" in app_utils/config.py.
+
+Usage (from the repository root):
+    python -m scripts.export_onnx_reader [--output-dir data/onnx_reader] [--no-quantize]
+"""
+
+import argparse
+import logging
+
+from app_utils.config import READER_MODEL, ONNX_READER_DIR
+from app_utils.reader_backends import export_onnx_reader
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=READER_MODEL)
+    parser.add_argument('--output-dir', default=ONNX_READER_DIR)
+    parser.add_argument('--no-quantize', action='store_true',
+                        help='keep the float32 weights')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    export_onnx_reader(args.model, args.output_dir, quantize=not args.no_quantize)
+
+
+if __name__ == '__main__':
+    main()
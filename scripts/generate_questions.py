@@ -0,0 +1,48 @@
+"""
+Generate questions from the crawled wiki pages (replaces the question generation notebook).
+
+Pages are processed by a pool of worker processes, in batches; completed pages are
+checkpointed in the JSONL output, so the job can be interrupted and resumed, and after
+a re-crawl only new or modified pages are processed.
+To use the generated questions in the scripts, set GENERATED_QUESTIONS_PATH in app_utils/config.py
+to the output file.
+
+Usage (from the repository root):
+    python -m scripts.generate_questions [--workers 2] [--batch-size 16] [--output data/questions/generated_questions.jsonl]
+"""
+
+import argparse
+import logging
+
+from app_utils.config import INPUT_DOCS_DIR, GENERATED_QUESTIONS_JSONL_PATH, QUESTION_GENERATION_MODEL
+from app_utils.question_generation import generate_questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input-dir', default=INPUT_DOCS_DIR,
+                        help='folder containing the corpus downloaded by the crawler')
+    parser.add_argument('--output', default=GENERATED_QUESTIONS_JSONL_PATH)
+    parser.add_argument('--model', default=QUESTION_GENERATION_MODEL)
+    parser.add_argument('--workers', type=int, default=2,
+                        help='worker processes, each loading the model (0: run in this process)')
+    parser.add_argument('--pages-per-task', type=int, default=4,
+                        help='pages sent to a worker at once')
+    parser.add_argument('--batch-size', type=int, default=16,
+                        help='passages given to the model at once')
+    parser.add_argument('--min-size', type=int, default=5000,
+                        help='pages whose JSON file (as saved by the original crawler) is smaller, in bytes, are skipped')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    stats = generate_questions(input_dir=args.input_dir, output_path=args.output,
+                               workers=args.workers, pages_per_task=args.pages_per_task,
+                               batch_size=args.batch_size, min_size=args.min_size,
+                               model_name=args.model)
+    for key, value in sorted(stats.items()):
+        print(f'{key}: {value}')
+
+
+if __name__ == '__main__':
+    main()
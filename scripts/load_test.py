@@ -0,0 +1,203 @@
+"""
+Load test: simulate many concurrent users asking questions, to size deployments and catch regressions.
+
+Every simulated user is a thread that asks questions from a mix of selected and generated
+questions (data/questions), waiting a random think time between questions. Users start
+gradually during the ramp-up. Targets:
+- "app": the query path of the web app (app_utils/backend_utils.query, with the shared pipeline and
+  answer caches), run in this process as Streamlit runs it in the session threads;
+- a URL: the QA service (scripts/qa_service.py), through the client used by the web app.
+Every report interval, the script prints throughput, latency percentiles, error rate and
+process memory (RSS of this process for "app", of --pid for the service).
+Answer caches are part of the measured path: use more generated questions for fewer repeats.
+
+Usage (from the repository root):
+    python -m scripts.load_test --users 20 --ramp-up 60 --duration 300 --think-time 5
+    python -m scripts.load_test --target http://127.0.0.1:8001 --pid 12345 --users 50 --output load.json
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+import numpy as np
+
+from app_utils.config import RETRIEVER_TOP_K, READER_TOP_K, DEFAULT_CORPUS
+from app_utils.questions import read_selected_questions, read_generated_questions
+
+
+def rss_mb(pid: int) -> float:
+    """Resident memory of a process (Linux)"""
+    try:
+        with open(f'/proc/{pid}/status') as fin:
+            for line in fin:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def latency_summary(seconds) -> dict:
+    if not seconds:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    ms = np.array(seconds) * 1000
+    return {'p50_ms': round(float(np.percentile(ms, 50)), 1),
+            'p95_ms': round(float(np.percentile(ms, 95)), 1),
+            'p99_ms': round(float(np.percentile(ms, 99)), 1)}
+
+
+def window_summary(records, seconds: float) -> dict:
+    """Summary of (end time, latency, ok) records completed in a time window"""
+    latencies = [latency for _, latency, ok in records if ok]
+    errors = sum(not ok for _, _, ok in records)
+    return {'requests': len(records),
+            'throughput_qps': round(len(records) / seconds, 2) if seconds > 0 else None,
+            'error_rate': round(errors / len(records), 3) if records else 0.0,
+            **latency_summary(latencies)}
+
+
+class LoadTest:
+    def __init__(self, query, questions, users: int, ramp_up: float, duration: float,
+                 think_time: float, seed: int = 42):
+        self.query = query
+        self.questions = questions
+        self.users = users
+        self.ramp_up = ramp_up
+        self.duration = duration
+        self.think_time = think_time
+        self.seed = seed
+        # (end time, latency, ok)
+        self.records = []
+        self.active_users = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _user(self, user: int, start_delay: float):
+        rng = random.Random(self.seed + user)
+        if self._stop.wait(start_delay):
+            return
+        with self._lock:
+            self.active_users += 1
+        while not self._stop.is_set():
+            question = rng.choice(self.questions)
+            start = time.perf_counter()
+            try:
+                self.query(question)
+                ok = True
+            except Exception:
+                ok = False
+            end = time.perf_counter()
+            with self._lock:
+                self.records.append((end, end - start, ok))
+            # exponentially distributed think time, as for independent users
+            if self.think_time and self._stop.wait(rng.expovariate(1 / self.think_time)):
+                break
+        with self._lock:
+            self.active_users -= 1
+
+    def run(self, report_interval: float, pid: int):
+        """Run the test, printing a report every report_interval seconds; return the timeline"""
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._user, args=(user, self.ramp_up * user / self.users),
+                                    daemon=True)
+                   for user in range(self.users)]
+        for thread in threads:
+            thread.start()
+        timeline, reported = [], 0
+        while True:
+            remaining = self.duration - (time.perf_counter() - start)
+            self._stop.wait(max(min(report_interval, remaining), 0))
+            finished = time.perf_counter() - start >= self.duration
+            now = time.perf_counter()
+            with self._lock:
+                window = self.records[reported:]
+                reported = len(self.records)
+                active_users = self.active_users
+            window_start = start + (timeline[-1]['elapsed_s'] if timeline else 0)
+            point = {'elapsed_s': round(now - start, 1), 'users': active_users,
+                     **window_summary(window, now - window_start), 'rss_mb': rss_mb(pid)}
+            timeline.append(point)
+            print(json.dumps(point))
+            if finished:
+                break
+        self._stop.set()
+        for thread in threads:
+            thread.join()
+        return timeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', default='app',
+                        help='"app" (query path of the web app, in this process) or the URL of the QA service')
+    parser.add_argument('--pid', type=int,
+                        help='process whose memory is sampled (default: this process)')
+    parser.add_argument('--users', type=int, default=10, help='concurrent users')
+    parser.add_argument('--ramp-up', type=float, default=30, help='seconds to start all the users')
+    parser.add_argument('--duration', type=float, default=120, help='seconds, including the ramp-up')
+    parser.add_argument('--think-time', type=float, default=5,
+                        help='mean seconds between the questions of a user (0: no pause)')
+    parser.add_argument('--num-generated', type=int, default=500,
+                        help='number of generated questions in the mix')
+    parser.add_argument('--selected-ratio', type=float, default=0.2,
+                        help='fraction of the questions taken from the selected ones')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS,
+                        help='corpus queried by the "app" target (see CORPORA)')
+    parser.add_argument('--retriever-top-k', type=int, default=RETRIEVER_TOP_K)
+    parser.add_argument('--reader-top-k', type=int, default=READER_TOP_K)
+    parser.add_argument('--report-interval', type=float, default=10, help='seconds')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='save timeline and summary to this JSON file')
+    args = parser.parse_args()
+
+    selected = read_selected_questions()
+    generated = read_generated_questions(sample_size=args.num_generated)
+    # mix with the requested share of selected questions
+    if args.selected_ratio >= 1:
+        questions = selected
+    else:
+        num_selected = round(len(generated) * args.selected_ratio / (1 - args.selected_ratio))
+        questions = generated + [selected[i % len(selected)] for i in range(num_selected)]
+
+    if args.target == 'app':
+        from app_utils.backend_utils import get_pipeline, query as app_query
+        # wait for the pipeline (in "fast" startup mode it is loaded in background)
+        get_pipeline(corpus=args.corpus)
+
+        def query(question, retriever_top_k, reader_top_k):
+            return app_query(question, retriever_top_k, reader_top_k, args.corpus)
+    else:
+        from app_utils.qa_client import QAClient
+        query = QAClient(args.target).query
+
+    load_test = LoadTest(lambda question: query(question, args.retriever_top_k, args.reader_top_k),
+                         questions, users=args.users, ramp_up=args.ramp_up, duration=args.duration,
+                         think_time=args.think_time, seed=args.seed)
+    pid = args.pid or os.getpid()
+    rss_before = rss_mb(pid)
+    start = time.perf_counter()
+    timeline = load_test.run(args.report_interval, pid)
+    elapsed = time.perf_counter() - start
+
+    # steady state: after all the users have started
+    steady = [record for record in load_test.records if record[0] - start >= args.ramp_up]
+    memory = [point['rss_mb'] for point in timeline if point['rss_mb'] is not None]
+    summary = {'target': args.target, 'users': args.users, 'think_time_s': args.think_time,
+               'duration_s': round(elapsed, 1),
+               'total': window_summary(load_test.records, elapsed),
+               'steady_state': window_summary(steady, elapsed - args.ramp_up),
+               'rss_mb_start': rss_before,
+               'rss_mb_max': max(memory) if memory else None}
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump({'summary': summary, 'timeline': timeline}, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Measure the CPU time saved by the pre-tokenized passages (data/index/reader_tokens.npz).
+
+For every question, the retrieved passages are given to the reader with and without
+the token cache: the script reports the CPU time per query of the passage tokenization
+and of the whole reader call, and checks that the answers are the same.
+
+Usage (from the repository root):
+    python -m scripts.measure_reader_tokens [--num-generated 50] [--repeat 3]
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+from haystack.nodes import EmbeddingRetriever
+
+from app_utils.config import (INDEX_DIR, RETRIEVER_MODEL, RETRIEVER_MODEL_FORMAT,
+    RETRIEVER_TOP_K, READER_TOP_K)
+from app_utils.indexing import open_document_store
+from app_utils.questions import read_selected_questions, read_generated_questions
+from app_utils.reader_backends import load_reader
+from app_utils.reader_tokens import PassageTokenCache, CachedPassageTokenizer
+
+
+def cpu_time(function, *args, **kwargs):
+    """Result and CPU time (all threads of the process) of a call"""
+    start = time.process_time()
+    result = function(*args, **kwargs)
+    return result, time.process_time() - start
+
+
+def tokenize_passages(tokenizer, documents):
+    # the call made by the Haystack QA processor for the passages
+    return tokenizer.batch_encode_plus([doc.content for doc in documents], return_offsets_mapping=True,
+                                       return_special_tokens_mask=True, add_special_tokens=False,
+                                       verbose=False)
+
+
+def summary(seconds) -> dict:
+    return {'mean_ms': round(float(np.mean(seconds)) * 1000, 3),
+            'p50_ms': round(float(np.percentile(seconds, 50)) * 1000, 3),
+            'p95_ms': round(float(np.percentile(seconds, 95)) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-dir', default=INDEX_DIR)
+    parser.add_argument('--num-generated', type=int, default=50,
+                        help='number of generated questions added to the selected ones')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='reader calls per question and setting (the minimum CPU time is kept)')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    args = parser.parse_args()
+
+    token_cache = PassageTokenCache.load(args.index_dir)
+    if token_cache is None:
+        parser.error('Reader tokens not found: create them with python -m scripts.build_index --derived-only')
+
+    questions = read_selected_questions() + read_generated_questions(sample_size=args.num_generated)
+    retriever = EmbeddingRetriever(document_store=open_document_store(args.index_dir, read_only=True),
+                                   embedding_model=RETRIEVER_MODEL,
+                                   model_format=RETRIEVER_MODEL_FORMAT,
+                                   use_gpu=False, progress_bar=False)
+    reader = load_reader()
+    processor = reader.inferencer.processor
+    tokenizer = processor.tokenizer
+    cached_tokenizer = CachedPassageTokenizer(tokenizer, token_cache)
+
+    times = {'tokenize': [], 'tokenize_cached': [], 'reader': [], 'reader_cached': []}
+    same_answers = 0
+    for i, question in enumerate(questions):
+        documents = retriever.retrieve(question, top_k=RETRIEVER_TOP_K)
+        measured = {}
+        for setting, setting_tokenizer in (('', tokenizer), ('_cached', cached_tokenizer)):
+            processor.tokenizer = setting_tokenizer
+            measured['tokenize' + setting] = min(cpu_time(tokenize_passages, setting_tokenizer, documents)[1]
+                                                 for _ in range(args.repeat))
+            runs = [cpu_time(reader.predict, query=question, documents=documents, top_k=READER_TOP_K)
+                    for _ in range(args.repeat)]
+            measured['reader' + setting] = min(seconds for _, seconds in runs)
+            measured['answers' + setting] = [(answer.answer, round(answer.score, 4))
+                                             for answer in runs[0][0]['answers']]
+        processor.tokenizer = tokenizer
+        if i == 0:
+            # warmup
+            continue
+        for key in times:
+            times[key].append(measured[key])
+        same_answers += measured['answers'] == measured['answers_cached']
+
+    n = len(times['reader'])
+    results = {'num_questions': n,
+               'retriever_top_k': RETRIEVER_TOP_K,
+               'cache_hit_rate': round(token_cache.hits / max(token_cache.hits + token_cache.misses, 1), 3),
+               'same_answers': round(same_answers / n, 3),
+               **{f'{key}_cpu': summary(seconds) for key, seconds in times.items()},
+               'cpu_saved_per_query_ms': round(float(np.mean(times['reader']) - np.mean(times['reader_cached']))
+                                               * 1000, 3)}
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Precompute the answers to known questions and save them next to the index,
+so that the web app answers them instantly (see app_utils/precomputed_answers.py).
+
+Questions: the selected questions of the corpus (data/questions/selected_questions.txt) and, optionally,
+a slice of the generated questions (generated_questions.txt), filtered by the score of the top answer (--min-score).
+The file is tied to the index build: run the script again after rebuilding the index.
+
+Usage (from the repository root):
+    python -m scripts.precompute_answers [--num-generated 500 --min-score 0.5] [--batch-size 16]
+    python -m scripts.precompute_answers --corpus harrypotter  # corpus configured in CORPORA (app_utils/config.py)
+"""
+
+import argparse
+import logging
+import time
+
+from app_utils.config import RETRIEVER_TOP_K, READER_TOP_K, DEFAULT_CORPUS, GENERATED_QUESTIONS_PATH
+from app_utils.corpora import CorpusManager, corpus_paths
+from app_utils.precomputed_answers import save_precomputed_answers
+from app_utils.questions import read_selected_questions, read_generated_questions
+from app_utils.startup import PipelineLoader, pipeline_params, params_key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS,
+                        help='name of the corpus (its index and questions are used)')
+    parser.add_argument('--generated-questions',
+                        help='generated questions of the corpus (default: '
+                             f'{GENERATED_QUESTIONS_PATH} for the default corpus)')
+    parser.add_argument('--num-generated', type=int, default=0,
+                        help='number of generated questions to consider, in addition to the selected ones')
+    parser.add_argument('--min-score', type=float, default=0.5,
+                        help='generated questions are kept only if the score of the top answer reaches this value')
+    parser.add_argument('--batch-size', type=int, default=16,
+                        help='number of questions run through the pipeline at once')
+    parser.add_argument('--output', help='default: the precomputed answers file of the corpus')
+    args = parser.parse_args()
+    paths = corpus_paths(args.corpus)
+    args.output = args.output or paths['precomputed_answers_path']
+    if args.generated_questions is None and args.corpus == DEFAULT_CORPUS:
+        args.generated_questions = GENERATED_QUESTIONS_PATH
+    if args.num_generated and not args.generated_questions:
+        parser.error(f'--generated-questions is required for the corpus {args.corpus}')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    selected = read_selected_questions(paths['questions_path']) if paths['questions_path'] else []
+    generated = read_generated_questions(args.generated_questions, sample_size=args.num_generated) \
+        if args.num_generated else []
+    questions = list(dict.fromkeys(selected + generated))
+    # the answers are served only for queries with the same parameters as the web app
+    params = pipeline_params(RETRIEVER_TOP_K, READER_TOP_K)
+    # the models are loaded with the default corpus, as in the web app
+    corpus_manager = CorpusManager(PipelineLoader(mode='eager', warmup_query=None))
+    pipe = corpus_manager.get(args.corpus)
+
+    start = time.perf_counter()
+    answers = {}
+    for i in range(0, len(questions), args.batch_size):
+        batch = questions[i:i + args.batch_size]
+        output = pipe.run_batch(queries=batch, params=params)
+        for question, question_answers in zip(batch, output['answers']):
+            answers[question] = question_answers
+        logging.info(f'Answered {min(i + args.batch_size, len(questions))}/{len(questions)} questions')
+
+    selected = set(selected)
+    kept = {question: question_answers for question, question_answers in answers.items()
+            if question in selected or (question_answers and question_answers[0].answer
+                                        and question_answers[0].score >= args.min_score)}
+    save_precomputed_answers(kept, corpus_manager.index_version(args.corpus), params_key(params), args.output)
+    print(f'{len(kept)} questions saved to {args.output} '
+          f'({len(kept) - len(selected)} generated), {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
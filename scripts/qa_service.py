@@ -0,0 +1,52 @@
+"""
+Run the Question Answering service: an HTTP server that answers concurrent questions
+in micro-batches (see app_utils/qa_service.py).
+To use it from the web app, set QA_SERVICE_URL in app_utils/config.py.
+
+Usage (from the repository root):
+    python -m scripts.qa_service [--host 127.0.0.1] [--port 8001] [--max-batch-size 16] [--max-wait-ms 20]
+"""
+
+import argparse
+import asyncio
+import logging
+
+from app_utils.config import (QA_SERVICE_MAX_BATCH_SIZE, QA_SERVICE_MAX_WAIT_MS, ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_PATH, INDEX_DIR)
+from app_utils.indexing import index_version
+from app_utils.precomputed_answers import PrecomputedAnswers
+from app_utils.qa_service import MicroBatcher, QAService
+from app_utils.semantic_cache import SemanticCache
+from app_utils.startup import PipelineLoader
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--max-batch-size', type=int, default=QA_SERVICE_MAX_BATCH_SIZE,
+                        help='maximum number of questions answered together')
+    parser.add_argument('--max-wait-ms', type=float, default=QA_SERVICE_MAX_WAIT_MS,
+                        help='time window to collect a batch, after the first question')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the semantic answer cache')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    loaded_index_version = index_version(INDEX_DIR)
+    answer_cache = None if args.no_cache else SemanticCache(
+        max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL,
+        similarity_threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        index_version=loaded_index_version, path=ANSWER_CACHE_PATH)
+    batcher = MicroBatcher(PipelineLoader(), answer_cache,
+                           max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    precomputed_answers = PrecomputedAnswers.load(loaded_index_version)
+    try:
+        asyncio.run(QAService(batcher, args.host, args.port, precomputed_answers).serve())
+    finally:
+        if answer_cache is not None:
+            answer_cache.save()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Chunk size sweep: build an index for every (split length, split overlap) setting of the
+PreProcessor and compare them, to choose the chunk size with the best speed/quality trade-off.
+
+For every setting, the script reports:
+- index: number of chunks, size on disk, build time (chunking in parallel, embedding);
+- speed: latency of retrieval and reader per question (selected questions);
+- quality: agreement of the top answer with the current setting (PREPROCESSOR_PARAMS),
+  mean score of the top answer and share of questions without low relevance answers
+  (selected questions have no gold answers), plus page-level recall@k on generated questions.
+Every index is built from scratch in its own folder (the whole corpus is embedded every time).
+
+Usage (from the repository root):
+    python -m scripts.sweep_chunk_size --split-lengths 100 200 300 --overlaps 0 20 --output sweep.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from urllib.parse import unquote
+
+import numpy as np
+from haystack.nodes import EmbeddingRetriever
+
+from app_utils.config import (INPUT_DOCS_DIR, RETRIEVER_MODEL, RETRIEVER_MODEL_FORMAT, RETRIEVER_TOP_K,
+    READER_TOP_K, LOW_RELEVANCE_THRESHOLD, PREPROCESSOR_PARAMS, CHUNKING_WORKERS)
+from app_utils.indexing import build_index, open_document_store
+from app_utils.questions import read_selected_questions, read_generated_questions_with_pages
+from app_utils.reader_backends import load_reader
+
+
+def dir_size_mb(path: str) -> float:
+    return round(sum(os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path)
+                     if os.path.isfile(os.path.join(path, file_name))) / 2 ** 20, 1)
+
+
+def top_answer(prediction):
+    return prediction['answers'][0] if prediction['answers'] else None
+
+
+def evaluate(retriever, reader, document_store, questions, generated):
+    """Answers, latency and recall of an index"""
+    retrieval_times, reader_times, answers = [], [], {}
+    for question in questions:
+        start = time.perf_counter()
+        documents = retriever.retrieve(question, top_k=RETRIEVER_TOP_K, document_store=document_store)
+        retrieval_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        answers[question] = top_answer(reader.predict(query=question, documents=documents, top_k=READER_TOP_K))
+        reader_times.append(time.perf_counter() - start)
+    hits = []
+    for question, title in generated:
+        documents = retriever.retrieve(question, top_k=RETRIEVER_TOP_K, document_store=document_store)
+        hits.append(any(unquote(doc.meta['name']).replace('_', ' ') == title for doc in documents))
+    return answers, {'retrieval_p50_ms': round(float(np.percentile(retrieval_times, 50)) * 1000, 1),
+                     'reader_p50_ms': round(float(np.percentile(reader_times, 50)) * 1000, 1),
+                     'reader_p95_ms': round(float(np.percentile(reader_times, 95)) * 1000, 1),
+                     f'recall@{RETRIEVER_TOP_K}': round(float(np.mean(hits)), 3) if hits else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--input-dir', default=INPUT_DOCS_DIR)
+    parser.add_argument('--output-dir', default='data/chunk_sweep',
+                        help='folder where the indexes are built (one subfolder per setting)')
+    parser.add_argument('--split-lengths', type=int, nargs='+', default=[100, 150, 200, 300])
+    parser.add_argument('--overlaps', type=int, nargs='+', default=[0, 20])
+    parser.add_argument('--num-generated', type=int, default=200,
+                        help='generated questions used to measure recall')
+    parser.add_argument('--workers', type=int, default=CHUNKING_WORKERS,
+                        help='chunking processes (default: one per CPU core)')
+    parser.add_argument('--batch-size', type=int, default=32, help='chunks embedded at once')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    questions = read_selected_questions()
+    generated = read_generated_questions_with_pages(sample_size=args.num_generated)
+    # models are loaded once for all the settings
+    retriever = EmbeddingRetriever(embedding_model=RETRIEVER_MODEL, model_format=RETRIEVER_MODEL_FORMAT,
+                                   use_gpu=False, progress_bar=False)
+    reader = load_reader()
+
+    settings = [(length, overlap) for length in args.split_lengths for overlap in args.overlaps
+                if overlap < length]
+    current = (PREPROCESSOR_PARAMS['split_length'], PREPROCESSOR_PARAMS['split_overlap'])
+    if current not in settings:
+        # reference for the answer agreement
+        settings.insert(0, current)
+
+    results, answers_by_setting = [], {}
+    for length, overlap in settings:
+        index_dir = f'{args.output_dir}/len{length}_overlap{overlap}'
+        params = {**PREPROCESSOR_PARAMS, 'split_length': length, 'split_overlap': overlap}
+        stats = build_index(input_dir=args.input_dir, index_dir=index_dir, full_rebuild=True,
+                            batch_size=args.batch_size, retriever=retriever,
+                            preprocessor_params=params, workers=args.workers)
+        document_store = open_document_store(index_dir, read_only=True)
+        # warmup
+        evaluate(retriever, reader, document_store, questions[:1], [])
+        answers, speed = evaluate(retriever, reader, document_store, questions, generated)
+        answers_by_setting[(length, overlap)] = answers
+        scores = [answer.score if answer else 0.0 for answer in answers.values()]
+        result = {'split_length': length, 'split_overlap': overlap,
+                  'chunks': stats['chunks'], 'index_mb': dir_size_mb(index_dir),
+                  'build_seconds': stats['seconds'], **speed,
+                  'mean_top_score': round(float(np.mean(scores)), 3),
+                  'confident_answers': round(float(np.mean([score >= LOW_RELEVANCE_THRESHOLD
+                                                             for score in scores])), 3)}
+        results.append(result)
+        print(json.dumps(result))
+
+    reference = answers_by_setting[current]
+    for result in results:
+        answers = answers_by_setting[(result['split_length'], result['split_overlap'])]
+        result['top_answer_agreement'] = round(float(np.mean([
+            (answers[question].answer if answers[question] else None) ==
+            (reference[question].answer if reference[question] else None) for question in questions])), 3)
+
+    print(f'\nReference for the agreement: split_length={current[0]}, split_overlap={current[1]}')
+    columns = ['split_length', 'split_overlap', 'chunks', 'index_mb', 'build_seconds', 'retrieval_p50_ms',
+               'reader_p50_ms', f'recall@{RETRIEVER_TOP_K}', 'mean_top_score', 'confident_answers',
+               'top_answer_agreement']
+    print('\t'.join(columns))
+    for result in results:
+        print('\t'.join(str(result[column]) for column in columns))
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(results, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Near-duplicate detection (MinHash/LSH) and deduplication of chunks.
+Run from the repository root: python -m pytest tests
+"""
+
+import json
+import unittest
+
+import numpy as np
+from haystack import Document
+
+from app_utils.dedup import MinHasher, deduplicate, find_near_duplicates, passage_sources, shingles
+
+WORDS = [f'word{i}' for i in range(300)]
+
+
+def text(start: int, end: int, suffix: str = '') -> str:
+    # punctuation makes a text longer without changing its shingles
+    return ' '.join(WORDS[start:end]) + suffix
+
+
+def chunk(content: str, name: str, doc_id: str = None) -> Document:
+    return Document(content=content, id=doc_id or name, meta={'name': name, 'url': f'https://wiki/{name}'})
+
+
+def estimated_similarity(first: str, second: str) -> float:
+    hasher = MinHasher(128)
+    return float(np.mean(hasher.signature(shingles(first)) == hasher.signature(shingles(second))))
+
+
+class NearDuplicatesTest(unittest.TestCase):
+    def test_shingles(self):
+        self.assertTrue(np.array_equal(shingles('Laura Palmer, the homecoming queen.'),
+                                       shingles('laura palmer the  Homecoming QUEEN')))
+        # texts shorter than a shingle
+        self.assertEqual(len(shingles('Laura Palmer', size=5)), 1)
+
+    def test_similarity_estimate(self):
+        # word windows shifted by 16 words: Jaccard similarity 180 / 212 of their 196 shingles
+        self.assertAlmostEqual(estimated_similarity(text(0, 200), text(16, 216)), 180 / 212, delta=0.05)
+        self.assertLess(estimated_similarity(text(0, 100), text(200, 300)), 0.1)
+
+    def test_groups(self):
+        modified = WORDS[:200]
+        modified[100] = 'changed'
+        documents = [chunk(text(0, 200), 'A'), chunk(text(200, 300), 'B'), chunk(' '.join(modified) + '.', 'C')]
+        # the longest document first
+        self.assertEqual(find_near_duplicates(documents), [[2, 0]])
+        self.assertEqual(find_near_duplicates([]), [])
+
+    def test_threshold(self):
+        # estimated similarity 0.69
+        documents = [chunk(text(0, 200, '!' * 50), 'A'), chunk(text(32, 232), 'B')]
+        self.assertEqual(find_near_duplicates(documents, threshold=0.8), [])
+        self.assertEqual(find_near_duplicates(documents, threshold=0.6), [[0, 1]])
+        with self.assertRaises(ValueError):
+            find_near_duplicates(documents, num_perm=100, bands=16)
+
+    def test_no_chaining(self):
+        """A near-duplicate of a near-duplicate is removed only if it is a near-duplicate of the kept document"""
+        first, middle, last = (0, 200), (16, 216), (32, 232)
+        self.assertGreaterEqual(estimated_similarity(text(*first), text(*middle)), 0.8)
+        self.assertGreaterEqual(estimated_similarity(text(*middle), text(*last)), 0.8)
+        self.assertLess(estimated_similarity(text(*first), text(*last)), 0.8)
+        # the first is kept: the last is kept as well
+        documents = [chunk(text(*first, '!' * 50), 'first'), chunk(text(*middle), 'middle'),
+                     chunk(text(*last), 'last')]
+        self.assertEqual(find_near_duplicates(documents), [[0, 1]])
+        # the middle is kept: both the others are near-duplicates of it (the longest first)
+        documents = [chunk(text(*first), 'first'), chunk(text(*middle, '!' * 50), 'middle'),
+                     chunk(text(*last), 'last')]
+        self.assertEqual(find_near_duplicates(documents), [[1, 2, 0]])
+
+
+class DeduplicateTest(unittest.TestCase):
+    def test_deduplicate(self):
+        documents = [chunk(text(0, 200), 'Laura_Palmer', 'a'),
+                     chunk(text(200, 300), 'Dale_Cooper', 'b'),
+                     chunk(text(0, 200, '.'), 'Twin_Peaks', 'c'),
+                     chunk(text(0, 200), 'Laura_Palmer', 'd'),
+                     chunk(text(0, 200), 'Bob', 'e')]
+        documents[1].meta['sources'] = 'stale'
+        kept, removed = deduplicate(documents)
+        self.assertEqual(removed, 3)
+        # the longest chunk is kept, in the original order
+        self.assertEqual([doc.id for doc in kept], ['b', 'c'])
+        # its page first, then the other pages (once), by name
+        self.assertEqual(json.loads(kept[1].meta['sources']),
+                         [{'name': 'Twin_Peaks', 'url': 'https://wiki/Twin_Peaks'},
+                          {'name': 'Bob', 'url': 'https://wiki/Bob'},
+                          {'name': 'Laura_Palmer', 'url': 'https://wiki/Laura_Palmer'}])
+        self.assertEqual(passage_sources(kept[1].meta)[0]['name'], 'Twin_Peaks')
+        self.assertNotIn('sources', kept[0].meta)
+        self.assertEqual(passage_sources(kept[0].meta), [{'name': 'Dale_Cooper', 'url': 'https://wiki/Dale_Cooper'}])
+
+
+if __name__ == '__main__':
+    unittest.main()
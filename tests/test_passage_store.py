@@ -0,0 +1,57 @@
+"""
+Write and read the memory-mapped passage store.
+Run from the repository root: python -m pytest tests
+"""
+
+import os
+import tempfile
+import unittest
+
+from haystack import Document
+
+from app_utils.passage_store import ID_SIZE, PASSAGE_STORE_FILE, PassageStore, write_passage_store
+
+
+def passage(doc_id: str, vector_id: int, content: str, name: str) -> Document:
+    return Document(content=content, id=doc_id,
+                    meta={'name': name, 'url': f'https://twinpeaks.fandom.com/wiki/{name}',
+                          'vector_id': str(vector_id)})
+
+
+class PassageStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, PASSAGE_STORE_FILE)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_round_trip(self):
+        documents = [passage('b' * ID_SIZE, 1, 'Bob is the inhabiting spirit. “Fire walk with me”', 'BOB'),
+                     passage('a1', 0, 'Laura Palmer was the homecoming queen.', 'Laura_Palmer'),
+                     passage('c' * 39, 2, '', 'Empty')]
+        documents[1].meta['sources'] = '[{"name": "Laura_Palmer", "url": null}]'
+        write_passage_store(documents, self.path)
+        store = PassageStore(self.path)
+        self.assertEqual(len(store), 3)
+        # passages are stored in vector ID order
+        for vector_id, doc in enumerate(sorted(documents, key=lambda doc: int(doc.meta['vector_id']))):
+            read = store.get(vector_id)
+            self.assertEqual(read.id, doc.id)
+            self.assertEqual(read.content, doc.content)
+            self.assertEqual(read.meta, doc.meta)
+            self.assertEqual(read.meta['vector_id'], str(vector_id))
+            self.assertEqual(store.position(doc.id), vector_id)
+        self.assertIsNone(store.position('missing'))
+
+    def test_long_id(self):
+        with self.assertRaises(ValueError):
+            write_passage_store([passage('x' * (ID_SIZE + 10), 0, 'text', 'Page')], self.path)
+
+    def test_vector_ids(self):
+        with self.assertRaises(ValueError):
+            write_passage_store([passage('a', 0, 'text', 'Page'), passage('b', 2, 'text', 'Page')], self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+"""
+Single flight, admission control and cancellation of the query executor.
+Run from the repository root: python -m pytest tests
+"""
+
+import threading
+import time
+import unittest
+
+from app_utils.query_executor import QueryExecutor, QueryRejected, QueryCancelled
+
+
+class BlockingCompute:
+    """compute function running until released (or cancelled)"""
+
+    def __init__(self, result='answer'):
+        self.result = result
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.saw_cancelled = False
+
+    def __call__(self, cancelled):
+        self.calls += 1
+        self.started.set()
+        while not self.release.wait(0.01):
+            if cancelled():
+                self.saw_cancelled = True
+                raise QueryCancelled('Question cancelled')
+        return self.result
+
+
+class Asker(threading.Thread):
+    """Ask a question in a session thread, keeping the results or the exception"""
+
+    def __init__(self, executor, key, compute, session_id=None, **kwargs):
+        super().__init__(daemon=True)
+        self.executor = executor
+        self.args = (key, compute, session_id)
+        self.kwargs = kwargs
+        self.results = self.shared = self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.results, self.shared = self.executor.run(*self.args, **self.kwargs)
+        except Exception as e:
+            self.error = e
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise AssertionError('Condition not reached')
+        time.sleep(0.005)
+
+
+class QueryExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.executor = QueryExecutor(max_workers=1, max_queued=1, poll_interval=0.01)
+
+    def tearDown(self):
+        for compute in getattr(self, 'computes', []):
+            compute.release.set()
+        self.executor._pool.shutdown(wait=True)
+        # every admitted question left the executor
+        self.assertEqual(self.executor._admitted, 0)
+        self.assertEqual(self.executor._flights, {})
+
+    def blocking_compute(self, result='answer'):
+        compute = BlockingCompute(result)
+        self.computes = getattr(self, 'computes', []) + [compute]
+        return compute
+
+    def waiters(self, key):
+        flight = self.executor._flights.get(key)
+        return len(flight.waiters) if flight else 0
+
+    def test_single_flight(self):
+        compute = self.blocking_compute()
+        first = Asker(self.executor, 'question', compute, session_id='a')
+        compute.started.wait(5)
+        second = Asker(self.executor, 'question', compute, session_id='b')
+        wait_until(lambda: self.waiters('question') == 2)
+        compute.release.set()
+        first.join(5)
+        second.join(5)
+        self.assertEqual(compute.calls, 1)
+        self.assertEqual((first.results, first.shared, first.error), ('answer', False, None))
+        self.assertEqual((second.results, second.shared, second.error), ('answer', True, None))
+
+    def test_rejected_when_full(self):
+        running, queued = self.blocking_compute(), self.blocking_compute()
+        Asker(self.executor, 'running', running, session_id='a')
+        running.started.wait(5)
+        Asker(self.executor, 'queued', queued, session_id='b')
+        wait_until(lambda: self.waiters('queued') == 1)
+        start = time.perf_counter()
+        with self.assertRaises(QueryRejected):
+            self.executor.run('rejected', self.blocking_compute(), session_id='c')
+        self.assertLess(time.perf_counter() - start, 1)
+        # questions in flight are still shared when the executor is full
+        shared = Asker(self.executor, 'queued', queued, session_id='d')
+        wait_until(lambda: self.waiters('queued') == 2)
+        running.release.set()
+        queued.release.set()
+        shared.join(5)
+        self.assertEqual((shared.results, shared.shared), ('answer', True))
+
+    def test_new_question_cancels_previous(self):
+        previous = self.blocking_compute()
+        asker = Asker(self.executor, 'previous', previous, session_id='a')
+        previous.started.wait(5)
+        wait_until(lambda: self.waiters('previous') == 1)
+        new = self.blocking_compute('new answer')
+        new.release.set()
+        results, shared = self.executor.run('new', new, session_id='a')
+        self.assertEqual((results, shared), ('new answer', False))
+        asker.join(5)
+        self.assertIsInstance(asker.error, QueryCancelled)
+        self.assertTrue(previous.saw_cancelled)
+
+    def test_cancelled_while_queued(self):
+        running, queued = self.blocking_compute(), self.blocking_compute()
+        Asker(self.executor, 'running', running, session_id='a')
+        running.started.wait(5)
+        asker = Asker(self.executor, 'queued', queued, session_id='b')
+        wait_until(lambda: self.waiters('queued') == 1)
+        self.executor.cancel_session('b')
+        # an identical question asked from now on starts a new computation
+        self.assertNotIn('queued', self.executor._flights)
+        running.release.set()
+        asker.join(5)
+        self.assertIsInstance(asker.error, QueryCancelled)
+        self.assertEqual(queued.calls, 0)
+
+    def test_timeout_releases_waiter(self):
+        compute = self.blocking_compute()
+        with self.assertRaises(TimeoutError):
+            self.executor.run('question', compute, session_id='a', timeout=0.05)
+        self.assertNotIn('question', self.executor._flights)
+        wait_until(lambda: compute.saw_cancelled)
+        retry = self.blocking_compute('retried')
+        retry.release.set()
+        self.assertEqual(self.executor.run('question', retry, session_id='a'), ('retried', False))
+
+    def test_error(self):
+        def compute(cancelled):
+            raise ValueError('pipeline error')
+
+        with self.assertRaises(ValueError):
+            self.executor.run('question', compute)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+BM25 index, reciprocal rank fusion and fusion of dense and sparse results (HybridRetriever).
+Run from the repository root: python -m pytest tests
+"""
+
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from haystack import Document
+
+from app_utils.sparse_index import (BM25Index, HybridRetriever, SPARSE_INDEX_FILE, load_sparse_index,
+    reciprocal_rank_fusion, tokenize)
+
+CHUNKS = [Document(content='Laura Palmer was killed by Bob in the train car', id='laura'),
+          Document(content='The Double R Diner serves cherry pie', id='diner'),
+          Document(content='Agent Cooper loves cherry pie and damn fine coffee. Cherry pie again', id='cooper')]
+
+
+class BM25IndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = BM25Index.build(CHUNKS)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('Who killed Laura Palmer?'), ['killed', 'laura', 'palmer'])
+
+    def test_ranking(self):
+        results = self.index.search('cherry pie')
+        # more occurrences of the terms rank higher; chunks without the terms are not returned
+        self.assertEqual([doc_id for doc_id, _ in results], ['cooper', 'diner'])
+        self.assertEqual([doc_id for doc_id, _ in self.index.search('Who killed Laura?')], ['laura'])
+        self.assertEqual(self.index.search('who is the'), [])
+        self.assertEqual([doc_id for doc_id, _ in self.index.search('pie coffee', top_k=1)], ['cooper'])
+
+    def test_score(self):
+        # "pie" is in 2 chunks out of 3 and twice in "cooper" (11 tokens; 6 in the other chunks)
+        idf = math.log(1 + (3 - 2 + 0.5) / (2 + 0.5))
+        norm = 1.2 * (1 - 0.75 + 0.75 * 11 / (23 / 3))
+        (_, score), _ = self.index.search('pie')
+        self.assertAlmostEqual(score, idf * 2 * 2.2 / (2 + norm), places=5)
+
+    def test_save_load(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, SPARSE_INDEX_FILE)
+            self.index.save(path)
+            loaded = load_sparse_index(tmp_dir)
+            self.assertEqual(loaded.term_index, self.index.term_index)
+            np.testing.assert_array_equal(loaded.doc_ids, self.index.doc_ids)
+            for query in ['cherry pie', 'Laura Palmer', 'coffee train']:
+                self.assertEqual(loaded.search(query), self.index.search(query))
+
+            BM25Index.build([]).save(path)
+            self.assertEqual(BM25Index.load(path).search('pie'), [])
+            os.remove(path)
+            self.assertIsNone(load_sparse_index(tmp_dir))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class ReciprocalRankFusionTest(unittest.TestCase):
+    def test_order(self):
+        # b: 1/62 + 1/61, a: 1/61, c: 1/62 + 1/63
+        self.assertEqual(reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'c']]), ['b', 'c', 'a'])
+        # a small k favors the top ranks: a: 1/2, c: 1/3 + 1/4
+        self.assertEqual(reciprocal_rank_fusion([['a', 'c'], ['d', 'e', 'c']], k=1), ['c', 'a', 'd', 'e'])
+
+    def test_ties(self):
+        # equal scores keep the order of the first ranking (the dense one in HybridRetriever)
+        self.assertEqual(reciprocal_rank_fusion([['a', 'b'], ['b', 'a']]), ['a', 'b'])
+        self.assertEqual(reciprocal_rank_fusion([['a', 'b'], ['c', 'd']]), ['a', 'c', 'b', 'd'])
+        self.assertEqual(reciprocal_rank_fusion([[], []]), [])
+
+
+class FakeFaissIndex:
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def reconstruct(self, vector_id):
+        if vector_id >= len(self.embeddings):
+            raise RuntimeError('direct map not initialized')
+        return self.embeddings[vector_id]
+
+
+class FakeDocumentStore:
+    index = 'document'
+    similarity = 'dot_product'
+
+    def __init__(self, documents, embeddings):
+        self.documents = {doc.id: doc for doc in documents}
+        self.faiss_indexes = {'document': FakeFaissIndex(embeddings)}
+        self.requested_ids = []
+
+    def get_documents_by_id(self, ids):
+        self.requested_ids += ids
+        return [Document(content=self.documents[doc_id].content, id=doc_id, meta=dict(self.documents[doc_id].meta))
+                for doc_id in ids]
+
+    @staticmethod
+    def scale_to_unit_interval(score, similarity):
+        return (score + 1) / 2
+
+
+class HybridRetrieverTest(unittest.TestCase):
+    def setUp(self):
+        chunks = [Document(content=doc.content, id=doc.id, meta={'vector_id': str(i)}) for i, doc in enumerate(CHUNKS)]
+        self.document_store = FakeDocumentStore(chunks, np.eye(3, dtype=np.float32))
+        # the query encoder is not needed to fuse the results
+        self.retriever = HybridRetriever.__new__(HybridRetriever)
+        self.retriever.set_sparse_index(BM25Index.build(CHUNKS), enabled=True, candidates=3, rrf_k=60)
+
+    def test_fuse(self):
+        dense_docs = [Document(content=CHUNKS[0].content, id='laura', score=0.9)]
+        query_emb = np.array([0.1, 0.2, 0.6], dtype=np.float32)
+        docs = self.retriever._fuse('cherry pie', query_emb, dense_docs, top_k=3,
+                                    document_store=self.document_store, scale_score=False)
+        # ties: the dense result first, then the BM25 ranking
+        self.assertEqual([doc.id for doc in docs], ['laura', 'cooper', 'diner'])
+        # only the documents found by BM25 alone are fetched, with their dense similarity
+        self.assertEqual(sorted(self.document_store.requested_ids), ['cooper', 'diner'])
+        self.assertIs(docs[0], dense_docs[0])
+        self.assertAlmostEqual(docs[1].score, 0.6, places=5)
+        self.assertAlmostEqual(docs[2].score, 0.2, places=5)
+
+        docs = self.retriever._fuse('cherry pie', query_emb, dense_docs, top_k=2,
+                                    document_store=self.document_store, scale_score=True)
+        self.assertEqual([doc.id for doc in docs], ['laura', 'cooper'])
+        self.assertAlmostEqual(docs[1].score, 0.8, places=5)
+
+    def test_fuse_without_reconstruction(self):
+        self.document_store.faiss_indexes['document'] = FakeFaissIndex([])
+        docs = self.retriever._fuse('coffee', np.ones(3, dtype=np.float32), [], top_k=3,
+                                    document_store=self.document_store, scale_score=True)
+        # no dense score: the passage gate is bypassed
+        self.assertEqual([(doc.id, doc.score) for doc in docs], [('cooper', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()